@@ -0,0 +1,102 @@
+"""
+Cache de respuestas de los listados publicos de propiedades, por agencia.
+
+La web publica repite pocas combinaciones de filtros, y cada una cuesta consultas,
+prefetch y firmar todas las URLs de imagenes. La respuesta se guarda en la cache de
+Django por (agencia, URL con los query params normalizados) junto con las versiones de
+las que depende (ZONAS y las propiedades de la agencia, ver ghl_middleware/versions.py):
+- Fresca (menos de FRONT_CACHE_SECONDS y mismas versiones): se sirve tal cual.
+- Caducada o con las versiones cambiadas (una propiedad editada), hasta
+  FRONT_CACHE_SECONDS + FRONT_CACHE_STALE_SECONDS: se sirve igualmente y se recalcula en
+  background (stale-while-revalidate, una sola vez aunque lleguen muchas peticiones).
+- Sin entrada: se calcula en la peticion.
+
+Las URLs firmadas de Cloudinary valen 10 minutos: la vida total de una entrada tiene que
+quedar bastante por debajo para que el navegador tenga tiempo de cargar las imagenes.
+"""
+import hashlib
+import logging
+import time
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from ghl_middleware import versions
+
+logger = logging.getLogger(__name__)
+
+HIT = 'HIT'
+STALE = 'STALE'
+MISS = 'MISS'
+
+
+def respuesta_cacheada(request, agency_id, calcular):
+    """
+    Response del listado desde la cache, o la de calcular() (que se guarda si es un 200).
+    Lleva la cabecera X-Cache: HIT, STALE o MISS.
+    """
+    clave = _clave(request, agency_id)
+    entrada = cache.get(clave)
+    if entrada is not None:
+        if entrada['versiones'] == _versiones(agency_id) and time.time() - entrada['creada'] < settings.FRONT_CACHE_SECONDS:
+            return _responder(entrada['datos'], HIT)
+        _revalidar(clave, agency_id, calcular)
+        return _responder(entrada['datos'], STALE)
+
+    response = _calcular_y_guardar(clave, agency_id, calcular)
+    response['X-Cache'] = MISS
+    return response
+
+
+def _clave(request, agency_id):
+    """Misma clave para los mismos parametros en cualquier orden."""
+    params = sorted((nombre, sorted(valores)) for nombre, valores in request.query_params.lists())
+    url = f"{request.build_absolute_uri(request.path)}?{urlencode(params, doseq=True)}"
+    return f'front:respuestas:{agency_id}:{hashlib.sha1(url.encode()).hexdigest()}'
+
+
+def _versiones(agency_id):
+    return [versions.version(versions.ZONAS), versions.version(versions.propiedades(agency_id))]
+
+
+def _calcular_y_guardar(clave, agency_id, calcular):
+    # Versiones leidas antes de calcular: si cambian mientras tanto, la entrada nace vieja
+    versiones = _versiones(agency_id)
+    response = calcular()
+    if response.status_code == 200:
+        cache.set(
+            clave,
+            {'versiones': versiones, 'creada': time.time(), 'datos': response.data},
+            settings.FRONT_CACHE_SECONDS + settings.FRONT_CACHE_STALE_SECONDS,
+        )
+    return response
+
+
+def _revalidar(clave, agency_id, calcular):
+    """Recalcula la entrada en background; single-flight por clave entre procesos."""
+    from ghl_middleware.background import runner, JobRejected
+
+    bloqueo = f'{clave}:revalidando'
+    if not cache.add(bloqueo, 1, settings.FRONT_CACHE_SECONDS):
+        return
+
+    def _recalcular():
+        try:
+            _calcular_y_guardar(clave, agency_id, calcular)
+        except Exception as e:
+            logger.warning(f"No se pudo revalidar la cache del listado de {agency_id}: {str(e)}")
+        finally:
+            cache.delete(bloqueo)
+
+    try:
+        runner.submit('front_cache', _recalcular)
+    except JobRejected:
+        # Cola llena: se sigue sirviendo la copia vieja y lo intentara la siguiente peticion
+        cache.delete(bloqueo)
+
+
+def _responder(datos, estado):
+    response = Response(datos)
+    response['X-Cache'] = estado
+    return response
@@ -0,0 +1,146 @@
+"""
+Paginacion de los listados publicos de propiedades.
+
+- PropiedadPagination: por numero de pagina (la de siempre). Cada pagina hace un COUNT(*)
+  de todo el filtro y las paginas profundas pagan el OFFSET.
+- PropiedadCursorPagination: keyset, opcional (?pagination=cursor o ?cursor=...). El cursor
+  lleva el valor del campo de ordenacion y el id del ultimo resultado, y la pagina siguiente
+  es una consulta por rango sobre (campo, id): coste constante a cualquier profundidad y
+  sin duplicados ni saltos aunque se creen propiedades entre pagina y pagina. El total
+  se pide aparte con ?count=none (default), approx o exact.
+"""
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# CORRECCIÓN #23: Paginación para evitar devolver todos los datos de golpe
+class PropiedadPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class PropiedadCursorPagination(BasePagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    # Con count=approx se cuenta hasta aqui como mucho (COUNT sobre un LIMIT)
+    max_count_aproximado = 1000
+    # Campos por los que se puede ordenar; el id desempata
+    campos_ordenables = ('precio', 'habitaciones', 'metros', 'id')
+    ordenacion_por_defecto = '-id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self._page_size(request)
+        ordenacion = self._ordenacion(queryset)
+        campo = ordenacion.lstrip('-')
+        descendente = ordenacion.startswith('-')
+
+        orden = [ordenacion] if campo == 'id' else [ordenacion, '-id' if descendente else 'id']
+        queryset = queryset.order_by(*orden)
+        self.total, self.total_aproximado = self._contar(queryset, request)
+
+        cursor = self._leer_cursor(request, ordenacion, queryset.model)
+        if cursor is not None:
+            valor, pk = cursor
+            mayor = 'lt' if descendente else 'gt'
+            if campo == 'id':
+                queryset = queryset.filter(**{f'id__{mayor}': pk})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{campo}__{mayor}': valor}) | Q(**{campo: valor, f'id__{mayor}': pk})
+                )
+
+        resultados = list(queryset[:page_size + 1])
+        self.siguiente = None
+        if len(resultados) > page_size:
+            resultados = resultados[:page_size]
+            ultimo = resultados[-1]
+            self.siguiente = self._codificar(ordenacion, getattr(ultimo, campo), ultimo.pk)
+        return resultados
+
+    def get_paginated_response(self, data):
+        respuesta = {'next': self.get_next_link()}
+        if self.total is not None:
+            respuesta['count'] = self.total
+            respuesta['count_is_approximate'] = self.total_aproximado
+        respuesta['results'] = data
+        return Response(respuesta)
+
+    def get_next_link(self):
+        if self.siguiente is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, self.siguiente)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['next', 'results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'count_is_approximate': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
+
+    def _page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def _ordenacion(self, queryset):
+        """Ordenacion de la vista (la primera columna del order_by), o por id si no tiene."""
+        ordenacion = queryset.query.order_by[0] if queryset.query.order_by else self.ordenacion_por_defecto
+        if ordenacion.lstrip('-') not in self.campos_ordenables:
+            raise ValidationError({'ordering': f"Con paginacion por cursor solo se puede ordenar por {', '.join(self.campos_ordenables)}"})
+        return ordenacion
+
+    def _contar(self, queryset, request):
+        """(total, es_aproximado) segun ?count=none|approx|exact."""
+        modo = request.query_params.get(self.count_query_param, 'none')
+        queryset = queryset.order_by()
+        if modo == 'exact':
+            return queryset.count(), False
+        if modo == 'approx':
+            total = queryset[:self.max_count_aproximado + 1].count()
+            if total > self.max_count_aproximado:
+                return self.max_count_aproximado, True
+            return total, False
+        return None, False
+
+    def _codificar(self, ordenacion, valor, pk):
+        datos = json.dumps({'o': ordenacion, 'v': str(valor), 'id': pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(datos.encode()).decode().rstrip('=')
+
+    def _leer_cursor(self, request, ordenacion, model):
+        """(valor, id) del cursor, None en la primera pagina. 400 si no es valido."""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            datos = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            valor, pk, ordenacion_cursor = datos['v'], int(datos['id']), datos['o']
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise ValidationError({'cursor': 'Cursor no valido'})
+        if ordenacion_cursor != ordenacion:
+            raise ValidationError({'cursor': 'El cursor es de otra ordenacion: empieza de nuevo sin cursor'})
+        try:
+            # El valor viene del cliente: se valida con el campo antes de llegar al filter()
+            valor = model._meta.get_field(ordenacion.lstrip('-')).to_python(valor)
+        except DjangoValidationError:
+            raise ValidationError({'cursor': 'Cursor no valido'})
+        return valor, pk
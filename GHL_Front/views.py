@@ -7,12 +7,15 @@ from django.db import transaction
 from django.shortcuts import get_object_or_404
 
 from rest_framework import generics
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status as http_status
 
-from ghl_middleware.models import Agencia, Propiedad, Zona
+from ghl_middleware.helpers import respuesta_con_etag
+from ghl_middleware.models import Agencia, Propiedad
+from ghl_middleware.zonas import arbol_zonas, ubicaciones_agencia
+from .cache_respuestas import respuesta_cacheada
+from .pagination import PropiedadPagination, PropiedadCursorPagination
 from .serializers import PropiedadPublicaSerializer
 
 logger = logging.getLogger(__name__)
@@ -111,14 +114,33 @@ class DecryptSSO(APIView):
 
 
 
-# CORRECCIÓN #23: Paginación para evitar devolver todos los datos de golpe
-class PropiedadPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+class PaginacionCursorOpcionalMixin:
+    """
+    Paginacion por numero de pagina por defecto; por cursor (keyset) si la peticion
+    trae ?pagination=cursor o un ?cursor= (ver pagination.py).
+    """
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or params.get('cursor'):
+                self._paginator = PropiedadCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+
+class CacheRespuestaAgenciaMixin:
+    """Listado servido desde la cache de respuestas por agencia (ver cache_respuestas.py)."""
+    def list(self, request, *args, **kwargs):
+        agency_id = request.query_params.get('agency_id')
+        if not agency_id or settings.FRONT_CACHE_SECONDS <= 0:
+            return super().list(request, *args, **kwargs)
+        calcular = super().list
+        return respuesta_cacheada(request, agency_id, lambda: calcular(request, *args, **kwargs))
 
 
-class PublicPropertyList(generics.ListAPIView):
+class PublicPropertyList(CacheRespuestaAgenciaMixin, PaginacionCursorOpcionalMixin, generics.ListAPIView):
     serializer_class = PropiedadPublicaSerializer
     authentication_classes = []  # API abierta
     permission_classes = []
@@ -164,7 +186,7 @@ class PublicPropertyDetail(generics.RetrieveAPIView):
 
 # ========== NUEVOS ENDPOINTS CON FILTROS AVANZADOS ==========
 
-class PublicPropertyFilteredList(generics.ListAPIView):
+class PublicPropertyFilteredList(CacheRespuestaAgenciaMixin, PaginacionCursorOpcionalMixin, generics.ListAPIView):
     """
     Endpoint con filtros avanzados para búsqueda de propiedades.
 
@@ -253,11 +275,12 @@ class PublicPropertyFilteredList(generics.ListAPIView):
 
 class PublicLocationsList(APIView):
     """
-    Devuelve todas las ubicaciones (zonas) disponibles para una agencia.
+    Devuelve las ubicaciones (zonas) con propiedades de una agencia y cuantas hay en cada una.
     Útil para popular dropdowns de filtros en el frontend.
 
     Query params:
     - agency_id (requerido): ID de la agencia
+    - all: si es 'true', todas las zonas registradas (sin count), tengan propiedades o no
     """
     authentication_classes = []
     permission_classes = []
@@ -271,24 +294,13 @@ class PublicLocationsList(APIView):
                 status=http_status.HTTP_400_BAD_REQUEST
             )
 
-        # Obtener TODAS las zonas registradas en la base de datos (GHL)
-        zonas = Zona.objects.all().select_related('municipio', 'municipio__provincia').values(
-            'nombre',
-            'municipio__nombre',
-            'municipio__provincia__nombre'
-        ).order_by('nombre')
-
-        # Formatear respuesta
-        locations = [
-            {
-                'zona': z['nombre'],
-                'municipio': z['municipio__nombre'],
-                'provincia': z['municipio__provincia__nombre']
-            }
-            for z in zonas
-        ]
-
-        return Response({
-            'count': len(locations),
-            'locations': locations
+        # Instantaneas cacheadas por version: sin consultas mientras no cambien las zonas
+        # (ni las propiedades de la agencia), y 304 si el navegador ya tiene esta version
+        if request.query_params.get('all') == 'true':
+            ubicaciones = arbol_zonas()
+        else:
+            ubicaciones = ubicaciones_agencia(agency_id)
+        return respuesta_con_etag(request, ubicaciones['etag'], {
+            'count': len(ubicaciones['locations']),
+            'locations': ubicaciones['locations']
         })
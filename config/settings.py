@@ -189,6 +189,112 @@ GHL_REDIRECT_URI = os.environ.get('GHL_REDIRECT_URI', 'http://localhost:8000/api
 # Secreto para verificar webhooks de GHL (configurable por variable de entorno)
 GHL_WEBHOOK_SECRET = os.environ.get('GHL_WEBHOOK_SECRET', '')
 
+# Ventana (segundos) para agrupar rafagas de webhooks del mismo contacto. 0 = procesar al momento
+WEBHOOK_COALESCE_SECONDS = float(os.environ.get('WEBHOOK_COALESCE_SECONDS', 3))
+
+# Worker de sync DB → GHL. En Railway con proceso `worker:` dedicado, poner
+# SYNC_WORKER_IN_PROCESS=false en el servicio web para no arrancar el thread en cada gunicorn worker.
+SYNC_WORKER_IN_PROCESS = os.environ.get('SYNC_WORKER_IN_PROCESS', 'true').lower() in ('1', 'true', 'yes')
+SYNC_WORKER_CONCURRENCY = int(os.environ.get('SYNC_WORKER_CONCURRENCY', 4))
+# Maximo de syncs en paralelo de una misma agencia dentro de un ciclo
+SYNC_PER_AGENCY_CONCURRENCY = int(os.environ.get('SYNC_PER_AGENCY_CONCURRENCY', 2))
+# Lote adaptativo de registros reclamados por ciclo (crece mientras los lotes salen llenos)
+SYNC_BATCH_MIN = int(os.environ.get('SYNC_BATCH_MIN', 50))
+SYNC_BATCH_MAX = int(os.environ.get('SYNC_BATCH_MAX', 1000))
+# Lease de los registros en 'syncing' (se renueva mientras se trabaja) y cada cuanto
+# se devuelven a 'pending' los que tienen el lease caducado (proceso muerto a mitad)
+SYNC_LEASE_SECONDS = int(os.environ.get('SYNC_LEASE_SECONDS', 300))
+SYNC_REAPER_INTERVAL_SECONDS = int(os.environ.get('SYNC_REAPER_INTERVAL_SECONDS', 60))
+# Reintentos de registros en 'error': backoff exponencial con jitter y dead-letter tras N intentos
+SYNC_MAX_ATTEMPTS = int(os.environ.get('SYNC_MAX_ATTEMPTS', 8))
+SYNC_RETRY_BASE_SECONDS = int(os.environ.get('SYNC_RETRY_BASE_SECONDS', 60))
+SYNC_RETRY_MAX_SECONDS = int(os.environ.get('SYNC_RETRY_MAX_SECONDS', 6 * 3600))
+
+# Scheduler de jobs periodicos (ghl_middleware/scheduler.py)
+# Refresco anticipado de tokens OAuth y push diario de zonas a GHL (cron en UTC)
+TOKEN_REFRESH_INTERVAL_SECONDS = int(os.environ.get('TOKEN_REFRESH_INTERVAL_SECONDS', 600))
+ZONAS_PUSH_CRON = os.environ.get('ZONAS_PUSH_CRON', '0 4 * * *')
+# Push de zonas: agencias en paralelo y agrupacion de altas seguidas de zonas en un solo push
+ZONAS_PUSH_CONCURRENCY = int(os.environ.get('ZONAS_PUSH_CONCURRENCY', 4))
+ZONAS_PUSH_DEBOUNCE_SECONDS = int(os.environ.get('ZONAS_PUSH_DEBOUNCE_SECONDS', 10))
+ZONAS_PUSH_DEBOUNCE_MAX_SECONDS = int(os.environ.get('ZONAS_PUSH_DEBOUNCE_MAX_SECONDS', 60))
+# Caches en memoria versionados (ghl_middleware/versions.py): cada cuanto se relee la version
+# de la BD, es decir, el retraso maximo con el que un proceso ve un cambio hecho en otro
+CACHE_VERSION_CHECK_SECONDS = float(os.environ.get('CACHE_VERSION_CHECK_SECONDS', 2))
+# Vida en la cache de Django del arbol de zonas y de las ubicaciones en uso por agencia
+# (la clave lleva las versiones: no hace falta borrarlos)
+ZONAS_ARBOL_CACHE_SECONDS = int(os.environ.get('ZONAS_ARBOL_CACHE_SECONDS', 24 * 3600))
+# Cache de respuestas de los listados publicos de propiedades (GHL_Front/cache_respuestas.py):
+# segundos que una respuesta es fresca y cuantos mas se sirve caducada mientras se recalcula.
+# La suma tiene que quedar bien por debajo de los 10 min que valen las URLs firmadas de
+# las imagenes. FRONT_CACHE_SECONDS=0 desactiva la cache
+FRONT_CACHE_SECONDS = int(os.environ.get('FRONT_CACHE_SECONDS', 60))
+FRONT_CACHE_STALE_SECONDS = int(os.environ.get('FRONT_CACHE_STALE_SECONDS', 240))
+
+# Importacion inicial GHL → BD de agencias nuevas (ghl_middleware/importer.py): registros por
+# pagina de GHL (maximo 100) y lease de la importacion, renovado en cada pagina
+IMPORT_PAGE_SIZE = int(os.environ.get('IMPORT_PAGE_SIZE', 100))
+IMPORT_LEASE_SECONDS = int(os.environ.get('IMPORT_LEASE_SECONDS', 600))
+
+# Reconciliacion BD ↔ GHL (ghl_middleware/reconciler.py): cron diario (UTC), reparaciones
+# aplicadas por lote e IDs de GHL ordenados en memoria por tramo (el resto va a disco)
+RECONCILE_CRON = os.environ.get('RECONCILE_CRON', '30 3 * * *')
+RECONCILE_BATCH_SIZE = int(os.environ.get('RECONCILE_BATCH_SIZE', 200))
+RECONCILE_RUN_SIZE = int(os.environ.get('RECONCILE_RUN_SIZE', 50000))
+
+# Apagado ordenado (ghl_middleware/shutdown.py): segundos para terminar el trabajo en vuelo
+# antes de devolver lo reclamado a la BD. gunicorn.conf.py da este margen + 10s al worker.
+GRACEFUL_SHUTDOWN_SECONDS = int(os.environ.get('GRACEFUL_SHUTDOWN_SECONDS', 20))
+
+# Runner de trabajos en background del proceso (ghl_middleware/background.py): workers,
+# cola acotada, concurrencia maxima por tipo y politica por tipo cuando la cola esta llena
+# Las clases bajas tienen tope de workers para que siempre quede hueco para las altas,
+# y la cola se atiende por prioridad (interactive > webhook > backfill > maintenance).
+BACKGROUND_MAX_WORKERS = int(os.environ.get('BACKGROUND_MAX_WORKERS', 16))
+BACKGROUND_MAX_QUEUE = int(os.environ.get('BACKGROUND_MAX_QUEUE', 500))
+BACKGROUND_JOB_LIMITS = {
+    'outbox_drain': 4,             # un drenador por clase de prioridad
+    'outbox_webhook': 4,
+    'outbox_backfill': 4,
+    'outbox_maintenance': 2,
+    'front_cache': 2,              # revalidacion de la cache de listados publicos
+}
+BACKGROUND_JOB_POLICIES = {
+    # persistido en BD: mejor frenar al que envia que perderlo
+    'outbox_interactive': 'caller_runs',
+    'outbox_webhook': 'caller_runs',
+    'outbox_backfill': 'caller_runs',
+    'outbox_maintenance': 'caller_runs',
+}
+BACKGROUND_JOB_PRIORITIES = {
+    'outbox_drain': 'interactive',  # el drenador solo reparte; sus trabajos llevan su propia clase
+    'outbox_interactive': 'interactive',
+    'outbox_webhook': 'webhook',
+    'outbox_backfill': 'backfill',
+    'outbox_maintenance': 'maintenance',
+    'front_cache': 'interactive',
+}
+
+# Presupuesto de llamadas a GHL del proceso (token bucket). Cada clase deja intacta la
+# fraccion del burst reservada a las clases superiores (backfill no puede agotar el cupo)
+GHL_RATE_PER_SECOND = float(os.environ.get('GHL_RATE_PER_SECOND', 8))
+GHL_RATE_BURST = int(os.environ.get('GHL_RATE_BURST', 80))
+GHL_RATE_RESERVES = {'interactive': 0.2, 'webhook': 0.2, 'backfill': 0.1}
+
+# Debounce de los syncs lanzados por post_save: varios saves seguidos del mismo registro se
+# agrupan en un solo trabajo que se ejecuta tras SIGNAL_DEBOUNCE_SECONDS sin cambios
+# (como mucho SIGNAL_DEBOUNCE_MAX_SECONDS despues del primer save)
+SIGNAL_DEBOUNCE_SECONDS = float(os.environ.get('SIGNAL_DEBOUNCE_SECONDS', 2))
+SIGNAL_DEBOUNCE_MAX_SECONDS = float(os.environ.get('SIGNAL_DEBOUNCE_MAX_SECONDS', 30))
+
+# Outbox de trabajos de sync (SyncJob): trabajos reclamados por lote y duracion del lease
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 20))
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', 300))
+# Un trabajo que falla OUTBOX_MAX_ATTEMPTS veces se descarta (dead_at) y no se vuelve a reclamar
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 10))
+# Lotes del outbox que drena como mucho cada ciclo del sync worker (el resto, en la siguiente pasada)
+SYNC_CYCLE_OUTBOX_BATCHES = int(os.environ.get('SYNC_CYCLE_OUTBOX_BATCHES', 10))
+
 # Shared Secret para desencriptar SSO payload del Marketplace
 GHL_APP_SHARED_SECRET = os.environ.get('GHL_APP_SHARED_SECRET', '')
 
@@ -1,12 +1,12 @@
 from django.contrib import admin
-from .models import Agencia, Propiedad, Cliente, GHLToken, Zona, Municipio, Provincia
+from .models import Agencia, Propiedad, Cliente, GHLToken, Zona, Municipio, Provincia, SyncJob, PeriodicJobState, AgencyImport
 
 
 @admin.register(Agencia)
 class AgenciaAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'location_id', 'active')
+    list_display = ('nombre', 'location_id', 'active', 'sync_weight', 'setup_status')
     search_fields = ('nombre', 'location_id')
-    list_filter = ('active',)
+    list_filter = ('active', 'setup_status')
 
 
 @admin.register(Propiedad)
@@ -44,6 +44,26 @@ class MunicipioAdmin(admin.ModelAdmin):
 
 @admin.register(Zona)
 class ZonaAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'municipio')
+    list_display = ('nombre', 'municipio', 'label')
     list_filter = ('municipio__provincia',)
-    search_fields = ('nombre',)
+    search_fields = ('nombre', 'label')
+    readonly_fields = ('label', 'key')
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'job_type', 'agencia', 'attempts', 'next_run_at', 'lease_until', 'dead_at', 'created_at')
+    list_filter = ('job_type', 'agencia', ('dead_at', admin.EmptyFieldListFilter))
+    search_fields = ('last_error',)
+
+
+@admin.register(PeriodicJobState)
+class PeriodicJobStateAdmin(admin.ModelAdmin):
+    list_display = ('name', 'next_run_at', 'last_status', 'last_duration_ms', 'run_count', 'owner', 'lease_until')
+    search_fields = ('last_error',)
+
+
+@admin.register(AgencyImport)
+class AgencyImportAdmin(admin.ModelAdmin):
+    list_display = ('agencia', 'status', 'phase', 'clientes_importados', 'propiedades_importadas', 'matches', 'registros_saltados', 'updated_at')
+    list_filter = ('status', 'phase')
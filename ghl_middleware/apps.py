@@ -1,5 +1,17 @@
+import atexit
 import os
+import sys
 from django.apps import AppConfig
+from django.conf import settings
+
+
+def _es_comando_de_gestion():
+    """True si el proceso es un `manage.py <comando>` distinto de runserver."""
+    return (
+        len(sys.argv) > 1
+        and os.path.basename(sys.argv[0]) == 'manage.py'
+        and sys.argv[1] != 'runserver'
+    )
 
 
 class GhlMiddlewareConfig(AppConfig):
@@ -9,9 +21,19 @@ class GhlMiddlewareConfig(AppConfig):
     def ready(self):
         import ghl_middleware.signals  # noqa: F401
 
-        # Arrancar el worker automatico de sync DB → GHL.
-        # Solo arranca si NO estamos en el autoreloader de Django (evita doble ejecucion en dev).
-        # En produccion (gunicorn) siempre arranca.
+        # Red de seguridad si el proceso sale sin pasar por el hook worker_exit de gunicorn
+        # (runserver, otros servidores). run_sync_worker hace su propio apagado.
+        if not _es_comando_de_gestion():
+            from .shutdown import graceful_shutdown
+            atexit.register(graceful_shutdown)
+
+        # Arrancar el worker automatico de sync DB → GHL dentro del proceso web.
+        # - Se desactiva con SYNC_WORKER_IN_PROCESS=false (cuando hay un proceso `worker:` dedicado).
+        # - No arranca en comandos de gestion (migrate, shell, run_sync_worker...).
+        # - No arranca en el autoreloader de Django (evita doble ejecucion en dev).
+        if not settings.SYNC_WORKER_IN_PROCESS or _es_comando_de_gestion():
+            return
+
         if os.environ.get('RUN_MAIN') != 'true':
             from .sync_worker import start_sync_loop
             start_sync_loop()
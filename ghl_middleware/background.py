@@ -0,0 +1,268 @@
+"""
+Runner de trabajos en background del proceso, compartido por views, signals y tasks.
+
+Sustituye a los threads sueltos y al ThreadPoolExecutor con cola ilimitada:
+- Cola acotada (BACKGROUND_MAX_QUEUE); al llenarse se aplica la politica del tipo de trabajo.
+- Limite de concurrencia por tipo de trabajo (BACKGROUND_JOB_LIMITS).
+- Cierre explicito de las conexiones de BD del thread al terminar cada trabajo.
+- Metricas: profundidad de cola, workers activos y tiempo de espera en cola.
+- Prioridad por tipo (BACKGROUND_JOB_PRIORITIES): la cola se atiende de la clase mas alta
+  a la mas baja y el trabajo se ejecuta con esa clase (ver priority.py).
+
+Politicas cuando la cola esta llena (BACKGROUND_JOB_POLICIES):
+- 'reject': lanza JobRejected (por defecto).
+- 'shed_oldest': descarta el trabajo mas antiguo en cola del mismo tipo (el nuevo lo sustituye).
+- 'caller_runs': ejecuta el trabajo en el thread que lo envia (para trabajo que no se puede perder).
+"""
+import logging
+import threading
+import time
+from collections import deque, defaultdict
+from concurrent.futures import Future
+from django.conf import settings
+from django.db import connections
+
+from .priority import prioridad, rango
+
+logger = logging.getLogger(__name__)
+
+REJECT = 'reject'
+SHED_OLDEST = 'shed_oldest'
+CALLER_RUNS = 'caller_runs'
+
+
+class JobRejected(Exception):
+    """La cola del runner esta llena (o cerrada) y el trabajo no se ha admitido."""
+
+
+class _Entrada:
+    __slots__ = ('job_type', 'func', 'args', 'kwargs', 'future', 'encolado', 'clase')
+
+    def __init__(self, job_type, func, args, kwargs, clase=None):
+        self.job_type = job_type
+        self.clase = clase
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.encolado = time.monotonic()
+
+
+class BackgroundJobRunner:
+    """
+    Pool de threads con control de admision. Los threads se arrancan con el primer
+    trabajo, asi que importar el modulo (p.ej. en un management command) no lanza nada.
+    """
+    def __init__(self, max_workers, max_queue, limits=None, policies=None, priorities=None, name="ghl_bg"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.limits = dict(limits or {})
+        self.policies = dict(policies or {})
+        self.priorities = dict(priorities or {})
+        self.name = name
+
+        self._cola = deque()
+        self._cond = threading.Condition()
+        self._activos = defaultdict(int)
+        self._threads = []
+        self._cerrado = False
+        self._contadores = defaultdict(int)
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_workers=settings.BACKGROUND_MAX_WORKERS,
+            max_queue=settings.BACKGROUND_MAX_QUEUE,
+            limits=settings.BACKGROUND_JOB_LIMITS,
+            policies=settings.BACKGROUND_JOB_POLICIES,
+            priorities=settings.BACKGROUND_JOB_PRIORITIES,
+        )
+
+    def submit(self, job_type, func, *args, **kwargs):
+        """
+        Envia un trabajo y retorna su Future.
+        Lanza JobRejected si la cola esta llena y la politica del tipo no permite admitirlo.
+        """
+        clase = self.priorities.get(job_type)
+        entrada = _Entrada(job_type, func, args, kwargs, clase)
+        descartada = None
+
+        with self._cond:
+            if self._cerrado:
+                self._contadores['rechazados'] += 1
+                raise JobRejected(f"Runner cerrado: trabajo '{job_type}' rechazado")
+
+            if len(self._cola) >= self.max_queue:
+                politica = self.policies.get(job_type, REJECT)
+                if politica == CALLER_RUNS:
+                    self._contadores['inline'] += 1
+                    entrada = None
+                elif politica == SHED_OLDEST and self._quitar_mas_antigua(job_type):
+                    descartada = True
+                else:
+                    self._contadores['rechazados'] += 1
+                    raise JobRejected(f"Cola de background llena ({self.max_queue}): trabajo '{job_type}' rechazado")
+
+            if entrada is not None:
+                self._cola.append(entrada)
+                self._arrancar_workers()
+                self._cond.notify()
+
+        if descartada:
+            logger.warning(f"Cola de background llena: descartado el trabajo '{job_type}' mas antiguo")
+
+        if entrada is None:
+            # caller_runs: el thread que envia hace el trabajo (y conserva su conexion de BD)
+            inline = _Entrada(job_type, func, args, kwargs, clase)
+            self._ejecutar(inline, cerrar_conexion=False)
+            return inline.future
+        return entrada.future
+
+    def executor(self, job_type):
+        """Adaptador con interfaz submit/map de concurrent.futures para un tipo de trabajo."""
+        return _ExecutorDeTipo(self, job_type)
+
+    def stats(self):
+        """Metricas del runner para el endpoint de estado y los logs."""
+        with self._cond:
+            ejecutados = self._contadores['completados'] + self._contadores['fallidos']
+            return {
+                'cola': len(self._cola),
+                'max_cola': self.max_queue,
+                'activos': sum(self._activos.values()),
+                'max_workers': self.max_workers,
+                'activos_por_tipo': {t: n for t, n in self._activos.items() if n},
+                'espera_media_ms': round(self._espera_total / ejecutados * 1000, 1) if ejecutados else 0.0,
+                'espera_max_ms': round(self._espera_max * 1000, 1),
+                **self._contadores,
+            }
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """Deja de admitir trabajos; los threads terminan al vaciar la cola."""
+        with self._cond:
+            self._cerrado = True
+            if cancel_pending:
+                while self._cola:
+                    self._cola.popleft().future.cancel()
+            self._cond.notify_all()
+            threads = list(self._threads)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def join(self, timeout=None):
+        """
+        Espera (tras shutdown) a que los threads terminen la cola, como mucho `timeout` segundos.
+        Retorna True si han terminado todos.
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(None if limite is None else max(0.0, limite - time.monotonic()))
+        return not any(thread.is_alive() for thread in threads)
+
+    # --- Internos (llamar con self._cond adquirido salvo _ejecutar) ---
+
+    def _arrancar_workers(self):
+        vivos = [t for t in self._threads if t.is_alive()]
+        for i in range(len(vivos), self.max_workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}_{i}", daemon=True)
+            thread.start()
+            vivos.append(thread)
+        self._threads = vivos
+
+    def _quitar_mas_antigua(self, job_type):
+        for entrada in self._cola:
+            if entrada.job_type == job_type:
+                self._cola.remove(entrada)
+                entrada.future.cancel()
+                self._contadores['descartados'] += 1
+                return True
+        return False
+
+    def _siguiente(self):
+        """
+        Trabajo mas prioritario (y mas antiguo dentro de su clase) cuyo tipo no ha
+        alcanzado su limite de concurrencia.
+        """
+        elegida = None
+        for entrada in self._cola:
+            if self._activos[entrada.job_type] >= self.limits.get(entrada.job_type, self.max_workers):
+                continue
+            if elegida is None or rango(entrada.clase) < rango(elegida.clase):
+                elegida = entrada
+        if elegida is not None:
+            self._cola.remove(elegida)
+        return elegida
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                entrada = self._siguiente()
+                while entrada is None:
+                    if self._cerrado and not self._cola:
+                        return
+                    self._cond.wait()
+                    entrada = self._siguiente()
+                self._activos[entrada.job_type] += 1
+
+            try:
+                self._ejecutar(entrada, cerrar_conexion=True)
+            finally:
+                with self._cond:
+                    self._activos[entrada.job_type] -= 1
+                    # Puede haber trabajos de este tipo esperando a que se libere hueco
+                    self._cond.notify_all()
+
+    def _ejecutar(self, entrada, cerrar_conexion):
+        if not entrada.future.set_running_or_notify_cancel():
+            return
+
+        espera = time.monotonic() - entrada.encolado
+        try:
+            if entrada.clase:
+                with prioridad(entrada.clase):
+                    resultado = entrada.func(*entrada.args, **entrada.kwargs)
+            else:
+                resultado = entrada.func(*entrada.args, **entrada.kwargs)
+        except BaseException as e:
+            logger.error(f"Error en trabajo de background '{entrada.job_type}': {str(e)}", exc_info=True)
+            entrada.future.set_exception(e)
+            contador = 'fallidos'
+        else:
+            entrada.future.set_result(resultado)
+            contador = 'completados'
+        finally:
+            if cerrar_conexion:
+                # Los threads del runner no pasan por el ciclo request/response de Django
+                connections.close_all()
+
+        with self._cond:
+            self._contadores[contador] += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+
+
+class _ExecutorDeTipo:
+    """
+    Vista del runner con la interfaz de ThreadPoolExecutor (submit/map). El tipo puede ser
+    fijo o una funcion del primer argumento (p.ej. la prioridad de cada SyncJob).
+    """
+    def __init__(self, runner, job_type):
+        self._runner = runner
+        self._job_type = job_type
+
+    def submit(self, func, *args, **kwargs):
+        job_type = self._job_type(args[0]) if callable(self._job_type) else self._job_type
+        return self._runner.submit(job_type, func, *args, **kwargs)
+
+    def map(self, func, iterable):
+        futures = [self.submit(func, item) for item in iterable]
+        return (future.result() for future in futures)
+
+
+runner = BackgroundJobRunner.from_settings()
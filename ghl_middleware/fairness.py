@@ -0,0 +1,103 @@
+"""
+Reparto justo de la capacidad de sync entre agencias (tenants).
+
+Sin esto, "los primeros N pendientes" de una agencia importando 20k contactos
+acaparan el worker durante horas. Aqui la capacidad de cada ciclo se reparte por
+round-robin ponderado (Agencia.sync_weight) entre las agencias con cola.
+"""
+import threading
+from collections import defaultdict
+from django.db.models import Count
+
+from .models import Agencia
+
+_turno_lock = threading.Lock()
+_turno = 0
+
+
+def repartir_cuotas(profundidades, capacidad, pesos=None):
+    """
+    Reparte `capacidad` huecos entre agencias por round-robin ponderado.
+
+    profundidades: {agencia_id: elementos en cola}
+    pesos: {agencia_id: peso} (por defecto 1). En cada ronda cada agencia recibe tantos
+    huecos como su peso, hasta vaciar su cola o agotar la capacidad.
+    Retorna {agencia_id: cuota} solo con las agencias que reciben algo.
+    """
+    global _turno
+    pesos = pesos or {}
+    activas = sorted((a for a, n in profundidades.items() if n > 0), key=str)
+    if not activas or capacidad <= 0:
+        return {}
+
+    # Rotar el punto de partida entre llamadas: si hay mas agencias que capacidad,
+    # no se favorece siempre a las mismas
+    with _turno_lock:
+        inicio = _turno % len(activas)
+        _turno += 1
+    activas = activas[inicio:] + activas[:inicio]
+
+    cuotas = defaultdict(int)
+    restante = capacidad
+    while restante > 0 and activas:
+        siguiente_ronda = []
+        for agencia_id in activas:
+            if restante <= 0:
+                break
+            quantum = min(max(1, pesos.get(agencia_id, 1)), profundidades[agencia_id] - cuotas[agencia_id], restante)
+            cuotas[agencia_id] += quantum
+            restante -= quantum
+            if cuotas[agencia_id] < profundidades[agencia_id]:
+                siguiente_ronda.append(agencia_id)
+        activas = siguiente_ronda
+
+    return dict(cuotas)
+
+
+def pesos_agencias(agencia_ids):
+    """Pesos (sync_weight) de las agencias indicadas."""
+    ids = [a for a in agencia_ids if a is not None]
+    return dict(Agencia.objects.filter(pk__in=ids).values_list('pk', 'sync_weight'))
+
+
+def profundidad_por_agencia(queryset):
+    """Numero de elementos por agencia_id de un queryset (un solo GROUP BY)."""
+    return dict(queryset.order_by().values_list('agencia_id').annotate(n=Count('pk')))
+
+
+def intercalar_por_agencia(items, key):
+    """
+    Ordena los elementos alternando agencias (A1, B1, C1, A2, B2...), para que al
+    despacharlos a un pool ninguna agencia ocupe todos los workers primero.
+    """
+    colas = defaultdict(list)
+    for item in items:
+        colas[key(item)].append(item)
+
+    resultado = []
+    colas = list(colas.values())
+    while colas:
+        for cola in colas:
+            resultado.append(cola.pop(0))
+        colas = [cola for cola in colas if cola]
+    return resultado
+
+
+def profundidad_colas():
+    """
+    Profundidad de cola por agencia: registros pendientes de sync y trabajos del outbox.
+    Retorna {agencia_id: {'clientes': n, 'propiedades': n, 'trabajos': n}}.
+    """
+    from .models import Cliente, Propiedad, SyncJob
+    from .sync_worker import pending_sync_filter
+
+    colas = defaultdict(lambda: {'clientes': 0, 'propiedades': 0, 'trabajos': 0})
+    fuentes = (
+        ('clientes', Cliente.objects.filter(pending_sync_filter())),
+        ('propiedades', Propiedad.objects.filter(pending_sync_filter())),
+        ('trabajos', SyncJob.objects.filter(dead_at__isnull=True)),
+    )
+    for campo, queryset in fuentes:
+        for agencia_id, n in profundidad_por_agencia(queryset).items():
+            colas[agencia_id][campo] = n
+    return dict(colas)
@@ -3,6 +3,9 @@
 CORRECCIÓN #28: Helpers movidos desde views.py para mejor organización.
 Funciones de utilidad para procesamiento de datos de webhooks.
 """
+from django.utils.cache import get_conditional_response, patch_cache_control
+from rest_framework.response import Response
+
 from .models import Cliente, Propiedad
 
 
@@ -94,23 +97,6 @@ def guardadorURL(value):
     return lista
 
 
-def parse_zona_nombres(zona_input):
-    """
-    Parsea las zonas desde string o lista. Limpia el sufijo '--'.
-    Retorna una lista de nombres de zonas limpios.
-    """
-    if not zona_input:
-        return []
-    
-    if isinstance(zona_input, list):
-        zona_bruta = [str(z).strip() for z in zona_input]
-    else:
-        zona_bruta = [z.strip() for z in str(zona_input).split(",")]
-        
-    z_nombres = [z.split("--")[0].strip() for z in zona_bruta if z.split("--")[0].strip()]
-    return z_nombres
-
-
 def parse_property_data(data, custom_data=None):
     """
     Unifica el saneamiento de datos de la Propiedad, sirviendo tanto para Webhooks 
@@ -146,6 +132,26 @@ def parse_property_data(data, custom_data=None):
     return parsed_data
 
 
+def parse_cliente_data(data, custom_data=None):
+    """
+    Saneamiento de los datos de un Cliente, comun al webhook de GHL y a la importacion inicial.
+    No incluye agencia, ghl_contact_id ni zonas (ver zonas.resolver_zonas).
+    """
+    if custom_data is None:
+        custom_data = {}
+
+    return {
+        'nombre': custom_data.get('full_name'),
+        'presupuesto_maximo': clean_currency(custom_data.get('presupuesto') or data.get('presupuesto')),
+        'habitaciones_minimas': clean_int(custom_data.get('habitaciones') or data.get('habitaciones_min')),
+        'animales': preferenciasTraductor1(custom_data.get('animales')),
+        'metrosMinimo': clean_int(custom_data.get('metros')),
+        'balcon': preferenciasTraductor2(custom_data.get('balcon')),
+        'garaje': preferenciasTraductor2(custom_data.get('garaje')),
+        'patioInterior': preferenciasTraductor2(custom_data.get('patioInterior')),
+    }
+
+
 
 # --- FUNCIONES INVERSAS (DB → GHL) ---
 
@@ -204,3 +210,14 @@ def imagenes_para_ghl(urls_list):
     if not urls_list:
         return []
     return [{"url": url} for url in urls_list if url]
+
+
+def respuesta_con_etag(request, etag, datos):
+    """
+    Response de DRF con ETag, o un 304 sin cuerpo si el cliente ya tiene esa version
+    (If-None-Match). no-cache: el navegador guarda la respuesta pero revalida cada vez.
+    """
+    response = get_conditional_response(request, etag=etag) or Response(datos)
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
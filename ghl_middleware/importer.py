@@ -0,0 +1,322 @@
+"""
+Importacion inicial GHL → BD de una agencia recien instalada.
+
+En vez de esperar a que los webhooks lleguen de uno en uno (un matching completo por
+contacto), se recorren en streaming los contactos y los registros de Propiedad de GHL:
+- Cada pagina se guarda con bulk_create / bulk_update y las zonas se resuelven con el
+  mapa en memoria de zonas.py (sin una consulta por registro).
+- Tras cada pagina se guarda el cursor en AgencyImport: si la importacion falla o el
+  proceso muere, la siguiente ejecucion continua desde esa pagina.
+- Un registro que no se puede interpretar se registra en el log, se cuenta
+  (registros_saltados) y se salta: no bloquea la pagina ni la importacion.
+- Al final hay UNA pasada de matching en memoria (matching.emparejar_agencia) y una de
+  asociaciones con GHL (un trabajo del outbox por cliente, con prioridad backfill).
+
+Los registros se crean ya como 'synced' y sin signals: vienen de GHL, no hay que devolverlos.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import versions
+from .helpers import parse_cliente_data, parse_property_data, format_currency_eur
+from .models import AgencyImport, Agencia, Cliente, Propiedad
+from .zonas import zona_resolver
+
+logger = logging.getLogger(__name__)
+
+# Custom fields de contacto en GHL (ver ghl_create_contact) → claves de customData del webhook
+CAMPOS_CLIENTE_GHL = {
+    'presupuesto_mximo': 'presupuesto',
+    'habitaciones_minimas': 'habitaciones',
+    'ha_de_permitir_animales': 'animales',
+    'metros_cuadrados_mnimos_de_la_propiedad_deseada': 'metros',
+    'ha_de_tener_balcn': 'balcon',
+    'ha_de_tener_garaje': 'garaje',
+    'ha_de_tener_patio_interior': 'patioInterior',
+    'zonas_deseadas': 'zona_interes',
+}
+
+CAMPOS_CLIENTE = [
+    'nombre', 'presupuesto_maximo', 'habitaciones_minimas', 'animales',
+    'metrosMinimo', 'balcon', 'garaje', 'patioInterior',
+]
+CAMPOS_PROPIEDAD = [
+    'precio', 'habitaciones', 'estado', 'animales', 'metros', 'balcon', 'garaje',
+    'patioInterior', 'descripcion', 'calle', 'notas', 'favorito', 'imagenesUrl',
+]
+
+
+class ImportEnCurso(Exception):
+    """Otro proceso tiene el lease de la importacion de esta agencia."""
+
+
+def importar_agencia(location_id, page_size=None):
+    """
+    Ejecuta (o reanuda) la importacion inicial de una agencia. Retorna el AgencyImport.
+    Lanza ImportEnCurso si otro proceso la esta ejecutando, y la excepcion original
+    si falla (el estado queda en 'error' con el checkpoint de la ultima pagina guardada).
+    """
+    from .utils import get_valid_token
+
+    page_size = page_size or settings.IMPORT_PAGE_SIZE
+    agencia = Agencia.objects.get(location_id=location_id)
+    importacion, _ = AgencyImport.objects.get_or_create(agencia=agencia)
+    if importacion.status == AgencyImport.Status.DONE:
+        return importacion
+    _reclamar(importacion)
+
+    try:
+        access_token = get_valid_token(location_id)
+        if not access_token:
+            raise Exception(f"No se pudo obtener token para importar {location_id}")
+
+        zonas = zona_resolver()
+        if importacion.phase == AgencyImport.Phase.CLIENTES:
+            _importar_clientes(importacion, agencia, access_token, zonas, page_size)
+        if importacion.phase == AgencyImport.Phase.PROPIEDADES:
+            _importar_propiedades(importacion, agencia, access_token, zonas, page_size)
+        if importacion.phase == AgencyImport.Phase.MATCHING:
+            _emparejar_y_asociar(importacion, agencia, access_token)
+    except Exception as e:
+        importacion.status = AgencyImport.Status.ERROR
+        importacion.last_error = str(e)[:500]
+        importacion.lease_until = None
+        importacion.save(update_fields=['status', 'last_error', 'lease_until', 'updated_at'])
+        logger.error(f"Importacion de {location_id} fallida en fase {importacion.phase}: {str(e)}", exc_info=True)
+        raise
+
+    importacion.status = AgencyImport.Status.DONE
+    importacion.phase = AgencyImport.Phase.DONE
+    importacion.cursor = {}
+    importacion.lease_until = None
+    importacion.last_error = ''
+    importacion.finished_at = timezone.now()
+    importacion.save()
+    logger.info(
+        f"Importacion de {location_id} completada: {importacion.clientes_importados} clientes, "
+        f"{importacion.propiedades_importadas} propiedades, {importacion.matches} matches"
+    )
+    return importacion
+
+
+def _lease():
+    return timezone.now() + timedelta(seconds=settings.IMPORT_LEASE_SECONDS)
+
+
+def _reclamar(importacion):
+    """Lease de la importacion con un UPDATE condicional (un solo proceso a la vez)."""
+    now = timezone.now()
+    reclamada = AgencyImport.objects.filter(
+        Q(lease_until__isnull=True) | Q(lease_until__lt=now), pk=importacion.pk
+    ).update(
+        status=AgencyImport.Status.RUNNING, lease_until=_lease(), last_error='',
+        started_at=importacion.started_at or now,
+    )
+    if not reclamada:
+        raise ImportEnCurso(f"La importacion de {importacion.agencia_id} esta en curso en otro proceso")
+    importacion.refresh_from_db()
+
+
+def _checkpoint(importacion, cursor, **contadores):
+    """Guarda el cursor de la pagina ya importada y renueva el lease."""
+    importacion.cursor = cursor
+    importacion.lease_until = _lease()
+    for campo, n in contadores.items():
+        setattr(importacion, campo, getattr(importacion, campo) + n)
+    importacion.save(update_fields=['cursor', 'lease_until', 'updated_at', *contadores])
+
+
+def _siguiente_fase(importacion, fase):
+    importacion.phase = fase
+    importacion.cursor = {}
+    importacion.save(update_fields=['phase', 'cursor', 'updated_at'])
+
+
+def _importar_clientes(importacion, agencia, access_token, zonas, page_size):
+    """Recorre los contactos de GHL pagina a pagina (cursor startAfterId/startAfter)."""
+    from .utils import ghl_list_contacts, ghl_get_custom_field_keys
+
+    claves = ghl_get_custom_field_keys(access_token, agencia.location_id)
+    if claves is None:
+        raise Exception("No se pudieron leer los custom fields de contacto")
+    if agencia.ghl_custom_field_cliente_zona:
+        claves[agencia.ghl_custom_field_cliente_zona] = 'zonas_deseadas'
+
+    cursor = importacion.cursor
+    while True:
+        pagina = ghl_list_contacts(
+            access_token, agencia.location_id, limit=page_size,
+            start_after_id=cursor.get('startAfterId'), start_after=cursor.get('startAfter'),
+        )
+        if pagina is None:
+            raise Exception("Error leyendo contactos de GHL")
+        contactos, meta = pagina
+
+        filas = _convertir(contactos, lambda contacto: _cliente_desde_ghl(contacto, claves, zonas), 'contacto')
+        _guardar_pagina(Cliente, agencia, filas, CAMPOS_CLIENTE, 'zona_interes')
+
+        cursor = {'startAfterId': meta.get('startAfterId'), 'startAfter': meta.get('startAfter')}
+        _checkpoint(importacion, cursor, clientes_importados=len(filas), registros_saltados=len(contactos) - len(filas))
+        if len(contactos) < page_size or not cursor['startAfterId']:
+            break
+
+    _siguiente_fase(importacion, AgencyImport.Phase.PROPIEDADES)
+
+
+def _importar_propiedades(importacion, agencia, access_token, zonas, page_size):
+    """Recorre los registros del Custom Object Propiedad pagina a pagina."""
+    from .utils import ghl_search_property_records, get_property_object_id
+
+    property_object_id = agencia.property_object_id or get_property_object_id(access_token, agencia.location_id)
+    if not property_object_id:
+        raise Exception("No se pudo obtener property_object_id de GHL")
+
+    page = importacion.cursor.get('page', 1)
+    while True:
+        pagina = ghl_search_property_records(
+            access_token, agencia.location_id, property_object_id, page=page, page_limit=page_size
+        )
+        if pagina is None:
+            raise Exception(f"Error leyendo la pagina {page} de propiedades de GHL")
+        registros, _ = pagina
+
+        filas = _convertir(registros, lambda registro: _propiedad_desde_ghl(registro, zonas), 'propiedad')
+        _guardar_pagina(Propiedad, agencia, filas, CAMPOS_PROPIEDAD, 'zonas')
+
+        page += 1
+        _checkpoint(importacion, {'page': page}, propiedades_importadas=len(filas), registros_saltados=len(registros) - len(filas))
+        if len(registros) < page_size:
+            break
+
+    _siguiente_fase(importacion, AgencyImport.Phase.MATCHING)
+
+
+def _convertir(registros, convertir, tipo):
+    """Filas de una pagina; los registros que no se pueden interpretar se saltan."""
+    filas = []
+    for registro in registros:
+        try:
+            filas.append(convertir(registro))
+        except Exception as e:
+            logger.warning(f"Importacion: {tipo} {registro.get('id')} saltado: {str(e)}")
+    return filas
+
+
+def _valor_moneda(valor):
+    """
+    Los campos monetarios llegan como numero ('300000', '1500.00' o 300000) en la API y
+    como texto ('€1.234,00') en el webhook. Los numeros se pasan al formato del webhook.
+    """
+    if isinstance(valor, str):
+        try:
+            valor = float(valor.strip())
+        except ValueError:
+            return valor
+    return format_currency_eur(valor) if isinstance(valor, (int, float)) else valor
+
+
+def _cliente_desde_ghl(contacto, claves, zonas):
+    """(ghl_id, campos, zona_ids) de un contacto de GHL, con el mismo saneamiento que el webhook."""
+    custom_data = {}
+    for campo in contacto.get('customFields') or []:
+        clave = CAMPOS_CLIENTE_GHL.get(claves.get(campo.get('id')))
+        if clave:
+            custom_data[clave] = campo.get('value')
+    custom_data['presupuesto'] = _valor_moneda(custom_data.get('presupuesto'))
+
+    nombre = contacto.get('contactName') or " ".join(
+        filter(None, [contacto.get('firstName'), contacto.get('lastName')])
+    )
+    custom_data['full_name'] = nombre or "Desconocido"
+    return contacto['id'], parse_cliente_data({}, custom_data), zonas.resolver(custom_data.get('zona_interes'))
+
+
+def _propiedad_desde_ghl(registro, zonas):
+    """(ghl_id, campos, zona_ids) de un registro de Propiedad de GHL."""
+    propiedades = dict(registro.get('properties') or {})
+    propiedades['precio'] = _valor_moneda(propiedades.get('precio'))
+    return registro['id'], parse_property_data(propiedades), zonas.resolver(propiedades.get('zona'))
+
+
+def _guardar_pagina(model, agencia, filas, campos, campo_zonas):
+    """
+    Upsert de una pagina: bulk_create de los nuevos, bulk_update de los existentes
+    y zonas por la tabla intermedia, todo en una transaccion.
+    """
+    if not filas:
+        return
+
+    m2m = getattr(model, campo_zonas)
+    Relacion = m2m.through
+    columna = m2m.field.m2m_field_name() + '_id'
+
+    with transaction.atomic():
+        existentes = dict(
+            model.objects.filter(agencia=agencia, ghl_contact_id__in=[ghl_id for ghl_id, _, _ in filas])
+            .values_list('ghl_contact_id', 'pk')
+        )
+        nuevos, actualizados, vistos = [], [], set()
+        for ghl_id, datos, _ in filas:
+            if ghl_id in existentes:
+                actualizados.append(model(pk=existentes[ghl_id], **datos))
+            elif ghl_id not in vistos:
+                vistos.add(ghl_id)
+                nuevos.append(model(agencia=agencia, ghl_contact_id=ghl_id, sync_status='synced', **datos))
+
+        model.objects.bulk_create(nuevos)
+        model.objects.bulk_update(actualizados, campos)
+
+        pks = dict(
+            model.objects.filter(agencia=agencia, ghl_contact_id__in=[ghl_id for ghl_id, _, _ in filas])
+            .values_list('ghl_contact_id', 'pk')
+        )
+        zonas_por_registro = {ghl_id: zona_ids for ghl_id, _, zona_ids in filas}
+        Relacion.objects.filter(**{f'{columna}__in': list(pks.values())}).delete()
+        Relacion.objects.bulk_create([
+            Relacion(**{columna: pks[ghl_id], 'zona_id': zona_id})
+            for ghl_id, zona_ids in zonas_por_registro.items()
+            for zona_id in zona_ids
+        ])
+        # bulk_* no lanza signals: invalidar a mano los listados cacheados de la agencia
+        if model is Propiedad:
+            versions.incrementar(versions.propiedades(agencia.pk))
+
+
+def _emparejar_y_asociar(importacion, agencia, access_token):
+    """Una sola pasada de matching para toda la agencia y sincronizacion de asociaciones."""
+    from .matching import emparejar_agencia, guardar_emparejamientos
+    from .priority import BACKFILL
+    from .tasks import sync_associations_background
+
+    emparejamientos = emparejar_agencia(agencia)
+    importacion.matches = guardar_emparejamientos(agencia, emparejamientos)
+    importacion.save(update_fields=['matches', 'updated_at'])
+
+    if not agencia.association_type_id:
+        logger.warning(f"Agencia {agencia.location_id} no tiene 'association_type_id'. Asociaciones saltadas.")
+        return
+
+    ids_clientes = dict(
+        Cliente.objects.filter(agencia=agencia, ghl_contact_id__isnull=False).values_list('pk', 'ghl_contact_id')
+    )
+    ids_propiedades = dict(
+        Propiedad.objects.filter(agencia=agencia, ghl_contact_id__isnull=False).values_list('pk', 'ghl_contact_id')
+    )
+    for cliente_pk, propiedad_pks in emparejamientos.items():
+        if cliente_pk not in ids_clientes:
+            continue
+        sync_associations_background(
+            access_token=access_token,
+            location_id=agencia.location_id,
+            origin_record_id=ids_clientes[cliente_pk],
+            target_ids_list=[ids_propiedades[pk] for pk in propiedad_pks if pk in ids_propiedades],
+            association_id_val=agencia.association_type_id,
+            origin_is_contact=True,
+            priority=BACKFILL,
+            # Si la fase se reanuda tras un fallo, los ya encolados no se duplican
+            dedupe_key=f"assoc:{ids_clientes[cliente_pk]}",
+        )
@@ -0,0 +1,80 @@
+"""
+Management command para la importacion inicial GHL → BD de una agencia (ver importer.py).
+Normalmente la encola el callback de OAuth al instalar la app; este comando sirve para
+lanzarla a mano, reanudar una importacion fallida o repetirla desde cero.
+
+Uso:
+  python manage.py import_from_ghl --location-id X            # Importar (o reanudar desde el checkpoint)
+  python manage.py import_from_ghl --location-id X --reset    # Repetir la importacion desde el principio
+  python manage.py import_from_ghl --location-id X --status   # Ver el estado sin importar
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from ghl_middleware.importer import importar_agencia, ImportEnCurso
+from ghl_middleware.models import Agencia, AgencyImport
+from ghl_middleware.priority import prioridad, BACKFILL
+
+
+class Command(BaseCommand):
+    help = 'Importa los contactos y propiedades de una agencia desde GHL'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--location-id',
+            type=str,
+            required=True,
+            help='Agencia a importar (location_id)'
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Descartar el checkpoint y empezar desde la primera pagina'
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=None,
+            help='Registros por pagina de GHL (default: IMPORT_PAGE_SIZE)'
+        )
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='Mostrar el estado de la importacion y salir'
+        )
+
+    def handle(self, *args, **options):
+        location_id = options['location_id']
+        if not Agencia.objects.filter(location_id=location_id).exists():
+            raise CommandError(f'Agencia {location_id} no encontrada')
+
+        if options['status']:
+            self._mostrar_estado(AgencyImport.objects.filter(agencia_id=location_id).first())
+            return
+
+        if options['reset']:
+            AgencyImport.objects.filter(agencia_id=location_id).delete()
+            self.stdout.write(self.style.WARNING(f'Checkpoint de {location_id} descartado'))
+
+        try:
+            # Importacion masiva: cede el presupuesto de rate limit de GHL al trabajo interactivo
+            with prioridad(BACKFILL):
+                importacion = importar_agencia(location_id, page_size=options['page_size'])
+        except ImportEnCurso as e:
+            raise CommandError(str(e))
+        except Exception as e:
+            raise CommandError(f'Importacion fallida (se reanudara desde el checkpoint): {str(e)}')
+
+        self._mostrar_estado(importacion)
+
+    def _mostrar_estado(self, importacion):
+        if importacion is None:
+            self.stdout.write('Sin importacion registrada')
+            return
+        estilo = self.style.SUCCESS if importacion.status == AgencyImport.Status.DONE else self.style.WARNING
+        self.stdout.write(estilo(
+            f'{importacion.agencia_id}: {importacion.status} (fase {importacion.phase}) | '
+            f'Clientes={importacion.clientes_importados} Propiedades={importacion.propiedades_importadas} '
+            f'Matches={importacion.matches} Saltados={importacion.registros_saltados}'
+        ))
+        if importacion.last_error:
+            self.stdout.write(self.style.ERROR(f'Ultimo error: {importacion.last_error}'))
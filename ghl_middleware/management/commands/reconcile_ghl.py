@@ -0,0 +1,71 @@
+"""
+Management command para reconciliar la BD local con GHL (ver reconciler.py).
+El scheduler la lanza cada dia (RECONCILE_CRON) como trabajos del outbox; este comando
+sirve para revisar la deriva de una agencia a mano o repararla sin esperar.
+
+Uso:
+  python manage.py reconcile_ghl --dry-run                    # Informe de todas las agencias sin tocar nada
+  python manage.py reconcile_ghl --location-id X              # Reconciliar y reparar una agencia
+  python manage.py reconcile_ghl --skip-associations          # Sin comprobar asociaciones (una llamada por contacto)
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from ghl_middleware.models import Agencia
+from ghl_middleware.priority import prioridad, MAINTENANCE
+from ghl_middleware.reconciler import agencias_a_reconciliar, reconciliar_agencia
+
+
+class Command(BaseCommand):
+    help = 'Detecta y repara la deriva entre la BD local y GHL'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--location-id',
+            type=str,
+            default=None,
+            help='Reconciliar solo esta agencia (location_id)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Solo informar de la deriva, sin aplicar reparaciones'
+        )
+        parser.add_argument(
+            '--skip-associations',
+            action='store_true',
+            help='No comparar las asociaciones de cada contacto con GHL'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Reparaciones por lote (default: RECONCILE_BATCH_SIZE)'
+        )
+
+    def handle(self, *args, **options):
+        if options['location_id']:
+            if not Agencia.objects.filter(location_id=options['location_id']).exists():
+                raise CommandError(f"Agencia {options['location_id']} no encontrada")
+            location_ids = [options['location_id']]
+        else:
+            location_ids = agencias_a_reconciliar()
+
+        con_error = 0
+        for location_id in location_ids:
+            # Cede el presupuesto de rate limit de GHL a todo lo demas
+            with prioridad(MAINTENANCE):
+                informe = reconciliar_agencia(
+                    location_id,
+                    dry_run=options['dry_run'],
+                    asociaciones=not options['skip_associations'],
+                    batch_size=options['batch_size'],
+                )
+            if informe.error:
+                con_error += 1
+                estilo = self.style.ERROR
+            else:
+                estilo = self.style.WARNING if informe.con_deriva else self.style.SUCCESS
+            self.stdout.write(estilo(str(informe)))
+
+        if con_error:
+            raise CommandError(f'{con_error} de {len(location_ids)} agencias con errores')
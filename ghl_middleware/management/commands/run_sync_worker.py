@@ -0,0 +1,87 @@
+"""
+Management command que ejecuta el worker de sincronizacion DB → GHL como proceso dedicado.
+Pensado para el process type `worker:` del Procfile, con SYNC_WORKER_IN_PROCESS=false en web.
+Ejecuta el scheduler de jobs periodicos (ciclo de sync, reaper, refresco de tokens...).
+
+Uso:
+  python manage.py run_sync_worker                     # Loop continuo
+  python manage.py run_sync_worker --concurrency 8     # 8 syncs en paralelo
+  python manage.py run_sync_worker --interval 60       # Ciclo de seguridad cada 60 segundos
+  python manage.py run_sync_worker --once              # Un solo ciclo de sync y salir
+
+Al recibir SIGTERM/SIGINT deja de empezar jobs y registros nuevos, espera a que acaben
+los syncs en vuelo (hasta GRACEFUL_SHUTDOWN_SECONDS) y devuelve a 'pending' lo que quede
+reclamado (ver shutdown.py).
+"""
+import signal
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ghl_middleware.scheduler import Scheduler, default_jobs
+from ghl_middleware.shutdown import graceful_shutdown, solicitar_apagado
+from ghl_middleware.sync_worker import SYNC_INTERVAL
+from ghl_middleware.wakeup import SyncWakeup
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta el worker de sincronizacion con GHL como proceso dedicado'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.SYNC_WORKER_CONCURRENCY,
+            help=f'Syncs con GHL en paralelo (default: {settings.SYNC_WORKER_CONCURRENCY})'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=SYNC_INTERVAL,
+            help=f'Segundos entre ciclos de sync (default: {SYNC_INTERVAL})'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Ejecutar un solo ciclo de sync y salir'
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        interval = options['interval']
+        stop = threading.Event()
+
+        def _parar(signum, frame):
+            if not stop.is_set():
+                self.stdout.write(self.style.WARNING('Señal de parada recibida. Terminando ciclo en curso...'))
+            stop.set()
+            solicitar_apagado()
+
+        signal.signal(signal.SIGTERM, _parar)
+        signal.signal(signal.SIGINT, _parar)
+
+        self.stdout.write(f'Sync worker arrancado (concurrency={concurrency}, interval={interval}s)')
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ghl_worker_")
+        scheduler = Scheduler(default_jobs(), executor=executor)
+        scheduler.jobs['sync_cycle'].interval = interval
+        wakeup = SyncWakeup()
+
+        try:
+            if options['once']:
+                scheduler.run_job('sync_cycle', force=True)
+            else:
+                # Despierta con NOTIFY (signals/outbox); el intervalo es solo la red de seguridad
+                scheduler.run_forever(stop, wakeup=wakeup)
+        finally:
+            wakeup.close()
+            # Drenado: syncs en vuelo del ciclo y trabajos en background, con limite de espera;
+            # lo que no termine vuelve a la BD para el siguiente proceso
+            solicitar_apagado()
+            executor.shutdown(wait=True)
+            graceful_shutdown()
+
+        self.stdout.write(self.style.SUCCESS('Sync worker detenido correctamente'))
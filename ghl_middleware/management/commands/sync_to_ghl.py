@@ -1,25 +1,52 @@
 """
 Management command para sincronizar registros locales (sin ghl_contact_id) con GHL.
-Maneja registros insertados via SQL que bypasearon Django signals.
+Maneja registros insertados via SQL que bypasearon Django signals y backfills de agencias nuevas.
+
+Procesa el backlog por lotes hasta vaciarlo. Cada lote se reclama como en el sync worker
+(SKIP LOCKED + 'syncing' con lease), se agrupa por agencia (un token por agencia) y se
+reparte en un pool de --workers threads con como maximo --per-agency en paralelo por agencia.
+El ritmo lo marca el presupuesto de rate limit de GHL (clase 'backfill'), no una pausa fija.
+
+Tras cada lote se guarda un checkpoint (ultimo PK procesado por tipo): si la ejecucion se
+interrumpe, la siguiente continua desde ahi con los mismos filtros. Los registros que fallan
+no se reintentan en la misma ejecucion (los recoge el sync worker con su backoff).
 
 Uso:
   python manage.py sync_to_ghl                     # Sync todo pendiente
   python manage.py sync_to_ghl --type cliente       # Solo clientes
   python manage.py sync_to_ghl --type propiedad     # Solo propiedades
   python manage.py sync_to_ghl --location-id X      # Solo una agencia
-  python manage.py sync_to_ghl --batch-size 50      # Procesar en lotes de 50
-  python manage.py sync_to_ghl --retry-errors       # Reintentar errores previos
+  python manage.py sync_to_ghl --workers 8          # 8 syncs en paralelo (backfill de una agencia nueva)
+  python manage.py sync_to_ghl --batch-size 500     # Registros reclamados por lote
+  python manage.py sync_to_ghl --limit 100          # Como maximo 100 registros por tipo
+  python manage.py sync_to_ghl --reset              # Ignorar el checkpoint y empezar de cero
+  python manage.py sync_to_ghl --retry-errors       # Reintentar errores previos ya, sin esperar al backoff
+  python manage.py sync_to_ghl --retry-dead         # Reintentar registros descartados (dead-letter)
   python manage.py sync_to_ghl --dry-run            # Mostrar sin ejecutar
 """
+import json
 import logging
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Value, When
 
 from ghl_middleware.models import Cliente, Propiedad, Agencia
-from ghl_middleware.utils import sync_record_to_ghl, rate_limit_wait
+from ghl_middleware.priority import prioridad, BACKFILL
+from ghl_middleware.shutdown import registrar_en_vuelo, solicitar_apagado, devolver_reclamados
+from ghl_middleware.sync_worker import _sync_agency_group, esperar_lanes
+from ghl_middleware.utils import sync_lease_deadline
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CHECKPOINT = '.sync_to_ghl.checkpoint.json'
+
+ETIQUETAS = {'cliente': 'Clientes', 'propiedad': 'Propiedades'}
+
 
 class Command(BaseCommand):
     help = 'Sincroniza registros locales (sin ghl_contact_id) con GHL'
@@ -37,17 +64,51 @@ class Command(BaseCommand):
             default=None,
             help='Sincronizar solo registros de esta agencia (location_id)'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Syncs con GHL en paralelo (default: 1)'
+        )
+        parser.add_argument(
+            '--per-agency',
+            type=int,
+            default=settings.SYNC_PER_AGENCY_CONCURRENCY,
+            help=f'Maximo de syncs en paralelo de una misma agencia (default: {settings.SYNC_PER_AGENCY_CONCURRENCY})'
+        )
         parser.add_argument(
             '--batch-size',
             type=int,
             default=100,
-            help='Numero maximo de registros a procesar (default: 100)'
+            help='Registros reclamados por lote (default: 100)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=0,
+            help='Maximo de registros a procesar por tipo; 0 = todo el backlog (default: 0)'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            default=DEFAULT_CHECKPOINT,
+            help=f'Fichero de checkpoint para reanudar (default: {DEFAULT_CHECKPOINT})'
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Ignorar el checkpoint existente y empezar desde el principio'
         )
         parser.add_argument(
             '--retry-errors',
             action='store_true',
             help='Reintentar registros con sync_status=error'
         )
+        parser.add_argument(
+            '--retry-dead',
+            action='store_true',
+            help='Reintentar registros con sync_status=dead (reinicia su contador de intentos)'
+        )
         parser.add_argument(
             '--dry-run',
             action='store_true',
@@ -55,10 +116,15 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
+        # Sync masivo: cede el presupuesto de rate limit de GHL al trabajo interactivo
+        with prioridad(BACKFILL):
+            self._sincronizar(options)
+
+    def _sincronizar(self, options):
         record_type = options['type']
         location_id = options['location_id']
-        batch_size = options['batch_size']
         retry_errors = options['retry_errors']
+        retry_dead = options['retry_dead']
         dry_run = options['dry_run']
 
         if dry_run:
@@ -69,11 +135,14 @@ class Command(BaseCommand):
 
         # Tambien capturar registros con ghl_contact_id=NULL que fueron
         # insertados via SQL sin establecer sync_status='pending'
-        sync_filter |= Q(ghl_contact_id__isnull=True)
-        sync_filter |= Q(ghl_contact_id='')
+        # (salvo los que ya se estan sincronizando o estan descartados)
+        sin_id = Q(ghl_contact_id__isnull=True) | Q(ghl_contact_id='')
+        sync_filter |= sin_id & ~Q(sync_status__in=['syncing', 'dead'])
 
         if retry_errors:
             sync_filter |= Q(sync_status='error')
+        if retry_dead:
+            sync_filter |= Q(sync_status='dead')
 
         # Filtro por agencia si se especifica
         agencia_filter = Q()
@@ -86,59 +155,179 @@ class Command(BaseCommand):
                 ))
                 return
 
-        stats = {
-            'clientes_ok': 0, 'clientes_fail': 0,
-            'propiedades_ok': 0, 'propiedades_fail': 0
+        # Clientes primero para que el matching de las propiedades ya los encuentre en GHL
+        tipos = [
+            (tipo, model) for tipo, model in (('cliente', Cliente), ('propiedad', Propiedad))
+            if record_type in ('all', tipo)
+        ]
+        querysets = {
+            tipo: model.objects.filter(sync_filter & agencia_filter, agencia__active=True)
+            for tipo, model in tipos
         }
 
-        # --- Sincronizar Clientes ---
-        if record_type in ('all', 'cliente'):
-            clientes = Cliente.objects.filter(
-                sync_filter & agencia_filter,
-                agencia__active=True
-            ).select_related('agencia')[:batch_size]
-
-            count = clientes.count()
-            self.stdout.write(f'Clientes pendientes de sync: {count}')
-
-            if not dry_run:
-                for i, cliente in enumerate(clientes, 1):
-                    self.stdout.write(f'  [{i}/{count}] Sincronizando Cliente PK={cliente.pk} "{cliente.nombre}"...')
-                    success = sync_record_to_ghl(cliente, 'cliente')
-                    if success:
-                        stats['clientes_ok'] += 1
-                        self.stdout.write(self.style.SUCCESS(f'    -> OK (GHL ID: {cliente.ghl_contact_id})'))
-                    else:
-                        stats['clientes_fail'] += 1
-                        self.stdout.write(self.style.ERROR(f'    -> FALLO: {cliente.sync_error}'))
-                    rate_limit_wait(default_wait=0.3)
-
-        # --- Sincronizar Propiedades ---
-        if record_type in ('all', 'propiedad'):
-            propiedades = Propiedad.objects.filter(
-                sync_filter & agencia_filter,
-                agencia__active=True
-            ).select_related('agencia', 'zona')[:batch_size]
-
-            count = propiedades.count()
-            self.stdout.write(f'Propiedades pendientes de sync: {count}')
-
-            if not dry_run:
-                for i, propiedad in enumerate(propiedades, 1):
-                    self.stdout.write(f'  [{i}/{count}] Sincronizando Propiedad PK={propiedad.pk} (zona: {propiedad.zona})...')
-                    success = sync_record_to_ghl(propiedad, 'propiedad')
-                    if success:
-                        stats['propiedades_ok'] += 1
-                        self.stdout.write(self.style.SUCCESS(f'    -> OK (GHL ID: {propiedad.ghl_contact_id})'))
-                    else:
-                        stats['propiedades_fail'] += 1
-                        self.stdout.write(self.style.ERROR(f'    -> FALLO: {propiedad.sync_error}'))
-                    rate_limit_wait(default_wait=0.3)
+        if dry_run:
+            for tipo, queryset in querysets.items():
+                por_agencia = queryset.order_by().values_list('agencia_id').annotate(n=Count('pk'))
+                self.stdout.write(f'{ETIQUETAS[tipo]} pendientes de sync: {queryset.count()}')
+                for agencia_id, n in sorted(por_agencia, key=lambda x: -x[1]):
+                    self.stdout.write(f'  {agencia_id}: {n}')
+            return
+
+        # La firma identifica la ejecucion: un checkpoint solo vale para los mismos filtros
+        firma = {
+            'type': record_type, 'location_id': location_id,
+            'retry_errors': retry_errors, 'retry_dead': retry_dead,
+        }
+        checkpoint = _Checkpoint(options['checkpoint'], firma)
+        if options['reset']:
+            checkpoint.borrar()
+        elif checkpoint.cargar():
+            self.stdout.write(self.style.WARNING(
+                f'Reanudando desde checkpoint {checkpoint.path}: {checkpoint.cursores}'
+            ))
+
+        workers = max(1, options['workers'])
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync_to_ghl_")
+        try:
+            for tipo, model in tipos:
+                self._sincronizar_tipo(tipo, model, querysets[tipo], checkpoint, executor, options)
+        except KeyboardInterrupt:
+            # Las lanes dejan de empezar registros; lo reclamado sin terminar vuelve a 'pending'
+            solicitar_apagado()
+            executor.shutdown(wait=True)
+            devolver_reclamados()
+            checkpoint.guardar()
+            self.stdout.write(self.style.WARNING(
+                f'Interrumpido. Vuelve a ejecutar el comando para continuar desde {checkpoint.cursores}'
+            ))
+            return
+        finally:
+            executor.shutdown(wait=True)
+
+        checkpoint.borrar()
 
         # --- Resumen ---
+        stats = checkpoint.stats
         self.stdout.write('')
         self.stdout.write(self.style.SUCCESS(
             f'Sync completado: '
-            f'Clientes OK={stats["clientes_ok"]} FAIL={stats["clientes_fail"]} | '
-            f'Propiedades OK={stats["propiedades_ok"]} FAIL={stats["propiedades_fail"]}'
+            f'Clientes OK={stats["cliente_ok"]} FAIL={stats["cliente_fail"]} | '
+            f'Propiedades OK={stats["propiedad_ok"]} FAIL={stats["propiedad_fail"]}'
         ))
+
+    def _sincronizar_tipo(self, tipo, model, queryset, checkpoint, executor, options):
+        """Procesa por lotes los registros de un tipo hasta vaciar el backlog (o llegar a --limit)."""
+        limit = options['limit']
+        batch_size = max(1, options['batch_size'])
+
+        total = queryset.filter(pk__gt=checkpoint.cursor(tipo)).count()
+        if limit:
+            total = min(total, limit)
+        self.stdout.write(f'{ETIQUETAS[tipo]} pendientes de sync: {total}')
+
+        inicio = time.monotonic()
+        procesados = 0
+        while not limit or procesados < limit:
+            n = min(batch_size, limit - procesados) if limit else batch_size
+            claimed = self._reclamar(model, queryset.filter(pk__gt=checkpoint.cursor(tipo)), n)
+            if not claimed:
+                break
+
+            grupos = defaultdict(list)
+            for pk, agencia_id in claimed:
+                grupos[agencia_id].append(pk)
+
+            futures = []
+            for agencia_id, pks in grupos.items():
+                try:
+                    futures += _sync_agency_group(
+                        agencia_id,
+                        pks if tipo == 'cliente' else [],
+                        pks if tipo == 'propiedad' else [],
+                        executor, per_agency=options['per_agency'],
+                    )
+                except Exception as e:
+                    logger.error(f"Error preparando sync de la agencia {agencia_id}: {str(e)}", exc_info=True)
+
+            ok = esperar_lanes(futures, {model: [pk for pk, _ in claimed]})
+
+            procesados += len(claimed)
+            checkpoint.avanzar(tipo, max(pk for pk, _ in claimed), ok, len(claimed) - ok)
+            self._progreso(tipo, procesados, max(total, procesados), inicio, checkpoint.stats)
+
+    def _reclamar(self, model, pendientes, limit):
+        """
+        Reclama en orden de PK hasta `limit` registros (SKIP LOCKED, igual que el sync worker)
+        y los marca como 'syncing' con lease. Los 'dead' reintentados parten de cero intentos.
+        """
+        with transaction.atomic():
+            claimed = list(
+                pendientes.select_for_update(skip_locked=True)
+                .order_by('pk').values_list('pk', 'agencia_id')[:limit]
+            )
+            if claimed:
+                model.objects.filter(pk__in=[pk for pk, _ in claimed]).update(
+                    sync_status='syncing',
+                    sync_lease_until=sync_lease_deadline(),
+                    sync_attempt_count=Case(
+                        When(sync_status='dead', then=Value(0)), default=F('sync_attempt_count')
+                    ),
+                )
+        registrar_en_vuelo(model._meta.model_name, [pk for pk, _ in claimed])
+        return claimed
+
+    def _progreso(self, tipo, hechos, total, inicio, stats):
+        """Linea de progreso con throughput y ETA."""
+        transcurrido = max(time.monotonic() - inicio, 0.001)
+        ritmo = hechos / transcurrido
+        restante = (total - hechos) / ritmo if ritmo else 0
+        minutos, segundos = divmod(int(restante), 60)
+        self.stdout.write(
+            f'  [{tipo}] {hechos}/{total} ({hechos / total * 100:.1f}%) | {ritmo:.1f} reg/s | '
+            f'ETA {minutos}m{segundos:02d}s | OK={stats[f"{tipo}_ok"]} FAIL={stats[f"{tipo}_fail"]}'
+        )
+
+
+class _Checkpoint:
+    """Ultimo PK procesado por tipo y contadores, persistidos en un fichero JSON tras cada lote."""
+
+    def __init__(self, path, firma):
+        self.path = path
+        self.firma = firma
+        self.cursores = {}
+        self.stats = defaultdict(int)
+
+    def cargar(self):
+        """Carga el checkpoint si existe y es de una ejecucion con los mismos filtros."""
+        try:
+            with open(self.path) as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if datos.get('firma') != self.firma:
+            return False
+        self.cursores = datos.get('cursores', {})
+        self.stats.update(datos.get('stats', {}))
+        return True
+
+    def cursor(self, tipo):
+        return self.cursores.get(tipo, 0)
+
+    def avanzar(self, tipo, ultimo_pk, ok, fallos):
+        self.cursores[tipo] = max(self.cursor(tipo), ultimo_pk)
+        self.stats[f'{tipo}_ok'] += ok
+        self.stats[f'{tipo}_fail'] += fallos
+        self.guardar()
+
+    def guardar(self):
+        # Escritura atomica: un corte a mitad no deja un checkpoint corrupto
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'firma': self.firma, 'cursores': self.cursores, 'stats': self.stats}, f)
+        os.replace(tmp, self.path)
+
+    def borrar(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
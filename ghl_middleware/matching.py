@@ -116,3 +116,74 @@ def actualizar_relaciones_cliente(cliente, propiedades_match):
     """
     cliente.propiedades_interes.set(propiedades_match)
     return propiedades_match.count()
+
+
+def emparejar_agencia(agencia):
+    """
+    Matching masivo de TODOS los clientes de una agencia contra sus propiedades activas,
+    con las mismas reglas que buscar_propiedades_para_cliente pero en memoria: cuatro
+    consultas en total en vez de una por cliente (importacion inicial).
+    Retorna un dict {cliente_pk: [propiedad_pk, ...]}.
+    """
+    from collections import defaultdict
+
+    SI = Propiedad.Preferencias1.SI
+    propiedades = {
+        p['pk']: p for p in Propiedad.objects.filter(agencia=agencia, estado=Propiedad.estadoPiso.ACTIVO).values(
+            'pk', 'precio', 'habitaciones', 'metros', 'animales', 'balcon', 'garaje', 'patioInterior'
+        )
+    }
+    por_zona = defaultdict(set)
+    for propiedad_id, zona_id in Propiedad.zonas.through.objects.filter(
+        propiedad_id__in=list(propiedades)
+    ).values_list('propiedad_id', 'zona_id'):
+        por_zona[zona_id].add(propiedad_id)
+
+    zonas_cliente = defaultdict(set)
+    for cliente_id, zona_id in Cliente.zona_interes.through.objects.filter(
+        cliente__agencia=agencia
+    ).values_list('cliente_id', 'zona_id'):
+        zonas_cliente[cliente_id].add(zona_id)
+
+    emparejamientos = {}
+    for c in Cliente.objects.filter(agencia=agencia).values(
+        'pk', 'presupuesto_maximo', 'habitaciones_minimas', 'metrosMinimo',
+        'animales', 'balcon', 'garaje', 'patioInterior'
+    ):
+        # Sin zonas de interes: todas las zonas
+        if zonas_cliente[c['pk']]:
+            candidatas = set().union(*(por_zona[z] for z in zonas_cliente[c['pk']]))
+        else:
+            candidatas = propiedades.keys()
+
+        # Si el cliente REQUIERE algo (SI), la propiedad debe tenerlo
+        requeridos = [campo for campo in ('animales', 'balcon', 'garaje', 'patioInterior') if c[campo] == SI]
+        emparejamientos[c['pk']] = [
+            pk for pk in candidatas
+            if propiedades[pk]['precio'] <= c['presupuesto_maximo']
+            and propiedades[pk]['habitaciones'] >= c['habitaciones_minimas']
+            and propiedades[pk]['metros'] >= c['metrosMinimo']
+            and all(propiedades[pk][campo] == SI for campo in requeridos)
+        ]
+
+    logger.debug(f"Matching masivo de {agencia.location_id}: {len(emparejamientos)} clientes")
+    return emparejamientos
+
+
+def guardar_emparejamientos(agencia, emparejamientos, batch_size=1000):
+    """
+    Sustituye en bloque las relaciones cliente ↔ propiedad de la agencia.
+    Retorna el numero de relaciones guardadas.
+    """
+    from django.db import transaction
+
+    Relacion = Cliente.propiedades_interes.through
+    filas = [
+        Relacion(cliente_id=cliente_id, propiedad_id=propiedad_id)
+        for cliente_id, propiedad_ids in emparejamientos.items()
+        for propiedad_id in propiedad_ids
+    ]
+    with transaction.atomic():
+        Relacion.objects.filter(cliente__agencia=agencia).delete()
+        Relacion.objects.bulk_create(filas, batch_size=batch_size)
+    return len(filas)
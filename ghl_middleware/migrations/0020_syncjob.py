@@ -0,0 +1,32 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0019_remove_agencia_umbral_featured'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_type', models.CharField(choices=[('sync_record', 'Sync de registro (DB -> GHL)'), ('sync_associations', 'Sync de asociaciones')], max_length=50)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('attempts', models.IntegerField(default=0, help_text='Numero de veces que se ha reclamado el trabajo')),
+                ('next_run_at', models.DateTimeField(default=django.utils.timezone.now, help_text='No se ejecuta antes de esta fecha')),
+                ('lease_until', models.DateTimeField(blank=True, help_text='Reclamado por un worker hasta esta fecha', null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('agencia', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_jobs', to='ghl_middleware.agencia')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_run_at', 'lease_until'], name='syncjob_next_run_idx')],
+            },
+        ),
+    ]
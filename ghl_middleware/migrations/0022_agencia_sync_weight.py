@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0020_syncjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agencia',
+            name='sync_weight',
+            field=models.PositiveIntegerField(default=1, help_text='Peso de la agencia en el reparto de capacidad de sync (round-robin ponderado)'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0022_agencia_sync_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='sync_lease_until',
+            field=models.DateTimeField(blank=True, help_text="Lease del worker que lo esta sincronizando; si caduca vuelve a 'pending'", null=True),
+        ),
+        migrations.AddField(
+            model_name='propiedad',
+            name='sync_lease_until',
+            field=models.DateTimeField(blank=True, help_text="Lease del worker que lo esta sincronizando; si caduca vuelve a 'pending'", null=True),
+        ),
+    ]
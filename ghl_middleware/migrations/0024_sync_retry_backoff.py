@@ -0,0 +1,62 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:15
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def programar_errores_existentes(apps, schema_editor):
+    # Los registros que ya estaban en 'error' entran en el ciclo de reintentos con backoff
+    for model_name in ('Cliente', 'Propiedad'):
+        model = apps.get_model('ghl_middleware', model_name)
+        model.objects.filter(sync_status='error', sync_next_attempt_at__isnull=True).update(
+            sync_next_attempt_at=timezone.now()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0023_sync_lease_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='sync_attempt_count',
+            field=models.IntegerField(default=0, help_text='Intentos de sync fallidos consecutivos'),
+        ),
+        migrations.AddField(
+            model_name='cliente',
+            name='sync_next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text="Proximo reintento de un registro en 'error'", null=True),
+        ),
+        migrations.AddField(
+            model_name='propiedad',
+            name='sync_attempt_count',
+            field=models.IntegerField(default=0, help_text='Intentos de sync fallidos consecutivos'),
+        ),
+        migrations.AddField(
+            model_name='propiedad',
+            name='sync_next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text="Proximo reintento de un registro en 'error'", null=True),
+        ),
+        migrations.AlterField(
+            model_name='cliente',
+            name='sync_status',
+            field=models.CharField(choices=[('pending', 'Pendiente de sync'), ('syncing', 'Sincronizando'), ('synced', 'Sincronizado'), ('error', 'Error de sync'), ('dead', 'Descartado tras agotar reintentos')], db_index=True, default='pending', help_text='Estado de sincronizacion con GHL', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='propiedad',
+            name='sync_status',
+            field=models.CharField(choices=[('pending', 'Pendiente de sync'), ('syncing', 'Sincronizando'), ('synced', 'Sincronizado'), ('error', 'Error de sync'), ('dead', 'Descartado tras agotar reintentos')], db_index=True, default='pending', help_text='Estado de sincronizacion con GHL', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['sync_status', 'sync_next_attempt_at'], name='cli_sync_retry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='propiedad',
+            index=models.Index(fields=['sync_status', 'sync_next_attempt_at'], name='prop_sync_retry_idx'),
+        ),
+        migrations.RunPython(programar_errores_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0024_sync_retry_backoff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncjob',
+            name='dedupe_key',
+            field=models.CharField(blank=True, db_index=True, help_text='Trabajos pendientes con la misma clave se fusionan en uno (debounce)', max_length=255, null=True),
+        ),
+    ]
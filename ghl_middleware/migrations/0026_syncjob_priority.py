@@ -0,0 +1,22 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0025_syncjob_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncjob',
+            name='priority',
+            field=models.CharField(choices=[('interactive', 'Interactivo (usuario esperando)'), ('webhook', 'Webhook'), ('backfill', 'Masivo (backfill)'), ('maintenance', 'Mantenimiento')], default='backfill', help_text='Clase de prioridad: se reclama y ejecuta antes que las clases inferiores', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='syncjob',
+            index=models.Index(fields=['priority', 'next_run_at'], name='syncjob_priority_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0026_syncjob_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodicJobState',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('next_run_at', models.DateTimeField(blank=True, help_text='Proxima ejecucion programada', null=True)),
+                ('lease_until', models.DateTimeField(blank=True, help_text='Ejecutandose en un proceso hasta esta fecha', null=True)),
+                ('owner', models.CharField(blank=True, default='', help_text='Proceso de la ultima ejecucion', max_length=255)),
+                ('last_started_at', models.DateTimeField(blank=True, null=True)),
+                ('last_finished_at', models.DateTimeField(blank=True, null=True)),
+                ('last_duration_ms', models.IntegerField(blank=True, null=True)),
+                ('last_status', models.CharField(blank=True, default='', max_length=20)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('run_count', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
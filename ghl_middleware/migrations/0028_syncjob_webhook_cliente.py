@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0027_periodicjobstate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='syncjob',
+            name='job_type',
+            field=models.CharField(choices=[('sync_record', 'Sync de registro (DB -> GHL)'), ('sync_associations', 'Sync de asociaciones'), ('webhook_cliente', 'Webhook de Cliente (GHL -> DB)')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0028_syncjob_webhook_cliente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgencyImport',
+            fields=[
+                ('agencia', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='importacion', serialize=False, to='ghl_middleware.agencia')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('running', 'En curso'), ('done', 'Completada'), ('error', 'Error')], default='pending', max_length=20)),
+                ('phase', models.CharField(choices=[('clientes', 'Contactos'), ('propiedades', 'Propiedades'), ('matching', 'Matching y asociaciones'), ('done', 'Terminada')], default='clientes', max_length=20)),
+                ('cursor', models.JSONField(blank=True, default=dict, help_text='Cursor de paginacion de GHL de la fase actual')),
+                ('clientes_importados', models.IntegerField(default=0)),
+                ('propiedades_importadas', models.IntegerField(default=0)),
+                ('matches', models.IntegerField(default=0)),
+                ('lease_until', models.DateTimeField(blank=True, help_text='Importandose en un proceso hasta esta fecha (se renueva por pagina)', null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='syncjob',
+            name='job_type',
+            field=models.CharField(choices=[('sync_record', 'Sync de registro (DB -> GHL)'), ('sync_associations', 'Sync de asociaciones'), ('webhook_cliente', 'Webhook de Cliente (GHL -> DB)'), ('import_agency', 'Importacion inicial de agencia (GHL -> DB)')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0029_agencyimport'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='syncjob',
+            name='job_type',
+            field=models.CharField(choices=[('sync_record', 'Sync de registro (DB -> GHL)'), ('sync_associations', 'Sync de asociaciones'), ('webhook_cliente', 'Webhook de Cliente (GHL -> DB)'), ('import_agency', 'Importacion inicial de agencia (GHL -> DB)'), ('reconcile_agency', 'Reconciliacion de agencia (DB <-> GHL)')], max_length=50),
+        ),
+    ]
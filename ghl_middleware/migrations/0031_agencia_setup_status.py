@@ -0,0 +1,40 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:41
+
+from django.db import migrations, models
+
+
+def marcar_agencias_configuradas(apps, schema_editor):
+    """Las agencias ya instaladas hicieron el setup dentro del callback de OAuth."""
+    Agencia = apps.get_model('ghl_middleware', 'Agencia')
+    Agencia.objects.filter(property_object_id__isnull=False).update(setup_status='done')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0030_syncjob_reconcile_agency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agencia',
+            name='setup_completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='agencia',
+            name='setup_error',
+            field=models.TextField(blank=True, default='', help_text='Ultimo error del setup inicial'),
+        ),
+        migrations.AddField(
+            model_name='agencia',
+            name='setup_status',
+            field=models.CharField(choices=[('pending', 'Pendiente'), ('running', 'En curso'), ('done', 'Completado'), ('error', 'Error (se reintenta)')], default='pending', help_text='Estado del setup inicial (IDs de objetos, asociacion y custom fields de GHL)', max_length=20),
+        ),
+        migrations.RunPython(marcar_agencias_configuradas, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='syncjob',
+            name='job_type',
+            field=models.CharField(choices=[('sync_record', 'Sync de registro (DB -> GHL)'), ('sync_associations', 'Sync de asociaciones'), ('webhook_cliente', 'Webhook de Cliente (GHL -> DB)'), ('import_agency', 'Importacion inicial de agencia (GHL -> DB)'), ('reconcile_agency', 'Reconciliacion de agencia (DB <-> GHL)'), ('setup_agency', 'Setup inicial de agencia en GHL')], max_length=50),
+        ),
+    ]
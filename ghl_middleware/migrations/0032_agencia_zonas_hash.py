@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0031_agencia_setup_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agencia',
+            name='zonas_hash',
+            field=models.CharField(blank=True, default='', help_text='Hash de las opciones de zona enviadas a GHL; si no cambia no se reenvian', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='syncjob',
+            name='job_type',
+            field=models.CharField(choices=[('sync_record', 'Sync de registro (DB -> GHL)'), ('sync_associations', 'Sync de asociaciones'), ('webhook_cliente', 'Webhook de Cliente (GHL -> DB)'), ('import_agency', 'Importacion inicial de agencia (GHL -> DB)'), ('reconcile_agency', 'Reconciliacion de agencia (DB <-> GHL)'), ('setup_agency', 'Setup inicial de agencia en GHL'), ('zonas_push', 'Push de opciones de zona a GHL')], max_length=50),
+        ),
+    ]
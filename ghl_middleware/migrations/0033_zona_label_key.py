@@ -0,0 +1,35 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:44
+
+from django.db import migrations, models
+
+
+def calcular_etiquetas(apps, schema_editor):
+    # Mismo formato que Zona.etiquetas (el modelo historico no tiene sus metodos)
+    Zona = apps.get_model('ghl_middleware', 'Zona')
+    zonas = list(Zona.objects.select_related('municipio', 'municipio__provincia'))
+    for zona in zonas:
+        nombres = (zona.nombre, zona.municipio.nombre, zona.municipio.provincia.nombre)
+        zona.label = " -- ".join(nombres)
+        zona.key = "__".join(nombres).lower().replace(" ", "_")
+    Zona.objects.bulk_update(zonas, ['label', 'key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0032_agencia_zonas_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zona',
+            name='key',
+            field=models.CharField(blank=True, db_index=True, default='', help_text="Key de la opcion en GHL: 'zona__municipio__provincia'", max_length=300),
+        ),
+        migrations.AddField(
+            model_name='zona',
+            name='label',
+            field=models.CharField(blank=True, db_index=True, default='', help_text="Etiqueta de la opcion en GHL: 'Zona -- Municipio -- Provincia'", max_length=300),
+        ),
+        migrations.RunPython(calcular_etiquetas, migrations.RunPython.noop),
+    ]
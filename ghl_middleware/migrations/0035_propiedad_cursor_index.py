@@ -0,0 +1,17 @@
+# Generated by Django 4.2.27 on 2026-10-19 06:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0034_cacheversion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='propiedad',
+            index=models.Index(fields=['agencia', 'precio', 'id'], name='prop_agencia_precio_id_idx'),
+        ),
+    ]
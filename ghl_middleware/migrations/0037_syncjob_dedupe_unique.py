@@ -0,0 +1,29 @@
+# Generated by Django 4.2.27 on 2026-10-19 07:03
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def quitar_duplicados(apps, schema_editor):
+    # Antes del indice podia haber varios pendientes con la misma clave: se deja el primero
+    SyncJob = apps.get_model('ghl_middleware', 'SyncJob')
+    pendientes = SyncJob.objects.filter(dedupe_key__isnull=False, lease_until__isnull=True)
+    repetidas = pendientes.values('dedupe_key').annotate(n=Count('pk')).filter(n__gt=1)
+    for fila in repetidas:
+        primero = pendientes.filter(dedupe_key=fila['dedupe_key']).order_by('pk').first()
+        pendientes.filter(dedupe_key=fila['dedupe_key']).exclude(pk=primero.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0035_propiedad_cursor_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(quitar_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='syncjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('lease_until__isnull', True)), fields=('dedupe_key',), name='syncjob_dedupe_pendiente_uniq'),
+        ),
+    ]
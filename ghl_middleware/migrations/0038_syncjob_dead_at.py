@@ -0,0 +1,26 @@
+# Generated by Django 4.2.27 on 2026-10-19 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0037_syncjob_dedupe_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='syncjob',
+            name='syncjob_dedupe_pendiente_uniq',
+        ),
+        migrations.AddField(
+            model_name='syncjob',
+            name='dead_at',
+            field=models.DateTimeField(blank=True, help_text='Descartado tras agotar OUTBOX_MAX_ATTEMPTS intentos: no se vuelve a reclamar', null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='syncjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('dead_at__isnull', True), ('lease_until__isnull', True)), fields=('dedupe_key',), name='syncjob_dedupe_pendiente_uniq'),
+        ),
+    ]
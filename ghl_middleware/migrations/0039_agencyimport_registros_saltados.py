@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-19 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ghl_middleware', '0038_syncjob_dead_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agencyimport',
+            name='registros_saltados',
+            field=models.IntegerField(default=0, help_text='Contactos o propiedades de GHL que no se pudieron interpretar y se saltaron'),
+        ),
+    ]
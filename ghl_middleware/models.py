@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # --- 1. MODELO DE INFRAESTRUCTURA (CRUZADO / OAUTH) ---
 
@@ -26,6 +27,12 @@ class Agencia(models.Model):
     """
     Modelo Tenant que representa una agencia inmobiliaria (Subcuenta de GHL).
     """
+    class SetupStatus(models.TextChoices):
+        PENDING = "pending", "Pendiente"
+        RUNNING = "running", "En curso"
+        DONE = "done", "Completado"
+        ERROR = "error", "Error (se reintenta)"
+
     location_id = models.CharField(
         max_length=255, 
         unique=True, 
@@ -65,12 +72,36 @@ class Agencia(models.Model):
         help_text="ID del custom field de zona en Contactos de GHL"
     )
 
+    # Peso en el reparto justo del sync worker (agencias de pago pueden tener mas de 1)
+    sync_weight = models.PositiveIntegerField(
+        default=1,
+        help_text="Peso de la agencia en el reparto de capacidad de sync (round-robin ponderado)"
+    )
+
+    # Setup inicial en GHL tras instalar la app (trabajo SETUP_AGENCY del outbox)
+    setup_status = models.CharField(
+        max_length=20, choices=SetupStatus.choices, default=SetupStatus.PENDING,
+        help_text="Estado del setup inicial (IDs de objetos, asociacion y custom fields de GHL)"
+    )
+    setup_error = models.TextField(blank=True, default='', help_text="Ultimo error del setup inicial")
+    setup_completed_at = models.DateTimeField(blank=True, null=True)
+    zonas_hash = models.CharField(
+        max_length=64, blank=True, default='',
+        help_text="Hash de las opciones de zona enviadas a GHL; si no cambia no se reenvian"
+    )
+
     def __str__(self):
         return f"{self.nombre or 'Agencia Sin Nombre'} ({self.location_id})"
 
 class Provincia(models.Model):
     nombre = models.CharField(max_length=50, unique=True, db_index=True) # Ej: "Barcelona"
 
+    def save(self, *args, **kwargs):
+        creada = self.pk is None
+        super().save(*args, **kwargs)
+        if not creada:
+            Zona.recalcular_etiquetas(Zona.objects.filter(municipio__provincia=self))
+
     def __str__(self):
         return self.nombre
 
@@ -81,6 +112,12 @@ class Municipio(models.Model):
     class Meta:
         unique_together = ('provincia', 'nombre') # Evita duplicar "Madrid" en provincias distintas
 
+    def save(self, *args, **kwargs):
+        creado = self.pk is None
+        super().save(*args, **kwargs)
+        if not creado:
+            Zona.recalcular_etiquetas(self.zonas.all())
+
     def __str__(self):
         return f"{self.nombre} ({self.provincia.nombre})"
 
@@ -88,6 +125,40 @@ class Zona(models.Model):
     municipio = models.ForeignKey(Municipio, on_delete=models.CASCADE, related_name="zonas")
     nombre = models.CharField(max_length=100, db_index=True) # Ej: "Almeda" o "Gràcia"
 
+    # Desnormalizado de zona/municipio/provincia: se mantiene al guardar cualquiera de los tres
+    # (los .update() de queryset no pasan por save: usar Zona.recalcular_etiquetas)
+    label = models.CharField(
+        max_length=300, blank=True, default='', db_index=True,
+        help_text="Etiqueta de la opcion en GHL: 'Zona -- Municipio -- Provincia'"
+    )
+    key = models.CharField(
+        max_length=300, blank=True, default='', db_index=True,
+        help_text="Key de la opcion en GHL: 'zona__municipio__provincia'"
+    )
+
+    @staticmethod
+    def etiquetas(nombre_zona, nombre_municipio, nombre_provincia):
+        """(label, key) de la opcion de GHL de una zona."""
+        label = f"{nombre_zona} -- {nombre_municipio} -- {nombre_provincia}"
+        key = f"{nombre_zona}__{nombre_municipio}__{nombre_provincia}".lower().replace(" ", "_")
+        return label, key
+
+    @classmethod
+    def recalcular_etiquetas(cls, zonas):
+        """Recalcula label y key de un queryset de zonas (tras renombrar municipio o provincia)."""
+        zonas = list(zonas.select_related('municipio', 'municipio__provincia'))
+        for zona in zonas:
+            zona.label, zona.key = cls.etiquetas(zona.nombre, zona.municipio.nombre, zona.municipio.provincia.nombre)
+        cls.objects.bulk_update(zonas, ['label', 'key'], batch_size=500)
+
+    def save(self, *args, **kwargs):
+        self.label, self.key = Zona.etiquetas(
+            self.nombre, self.municipio.nombre, self.municipio.provincia.nombre
+        )
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'label', 'key'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.nombre
 
@@ -109,6 +180,7 @@ class Propiedad(models.Model):
         SYNCING = "syncing", "Sincronizando"
         SYNCED = "synced", "Sincronizado"
         ERROR = "error", "Error de sync"
+        DEAD = "dead", "Descartado tras agotar reintentos"
 
     agencia = models.ForeignKey(Agencia, on_delete=models.CASCADE, related_name='propiedades')
     ghl_contact_id = models.CharField(
@@ -136,6 +208,14 @@ class Propiedad(models.Model):
         db_index=True, help_text="Estado de sincronizacion con GHL"
     )
     sync_error = models.TextField(blank=True, default='', help_text="Ultimo error de sincronizacion")
+    sync_lease_until = models.DateTimeField(
+        blank=True, null=True,
+        help_text="Lease del worker que lo esta sincronizando; si caduca vuelve a 'pending'"
+    )
+    sync_attempt_count = models.IntegerField(default=0, help_text="Intentos de sync fallidos consecutivos")
+    sync_next_attempt_at = models.DateTimeField(
+        blank=True, null=True, help_text="Proximo reintento de un registro en 'error'"
+    )
 
     class Meta:
         constraints = [
@@ -147,6 +227,9 @@ class Propiedad(models.Model):
         ]
         indexes = [
             models.Index(fields=['agencia', 'estado', 'precio'], name='prop_agencia_estado_precio_idx'),
+            # Paginacion por cursor de los listados publicos: rango sobre (precio, id) por agencia
+            models.Index(fields=['agencia', 'precio', 'id'], name='prop_agencia_precio_id_idx'),
+            models.Index(fields=['sync_status', 'sync_next_attempt_at'], name='prop_sync_retry_idx'),
         ]
 
     def __str__(self):
@@ -170,6 +253,7 @@ class Cliente(models.Model):
         SYNCING = "syncing", "Sincronizando"
         SYNCED = "synced", "Sincronizado"
         ERROR = "error", "Error de sync"
+        DEAD = "dead", "Descartado tras agotar reintentos"
 
 
     agencia = models.ForeignKey(Agencia, on_delete=models.CASCADE, related_name='clientes')
@@ -206,6 +290,14 @@ class Cliente(models.Model):
         db_index=True, help_text="Estado de sincronizacion con GHL"
     )
     sync_error = models.TextField(blank=True, default='', help_text="Ultimo error de sincronizacion")
+    sync_lease_until = models.DateTimeField(
+        blank=True, null=True,
+        help_text="Lease del worker que lo esta sincronizando; si caduca vuelve a 'pending'"
+    )
+    sync_attempt_count = models.IntegerField(default=0, help_text="Intentos de sync fallidos consecutivos")
+    sync_next_attempt_at = models.DateTimeField(
+        blank=True, null=True, help_text="Proximo reintento de un registro en 'error'"
+    )
 
     class Meta:
         constraints = [
@@ -217,9 +309,144 @@ class Cliente(models.Model):
         ]
         indexes = [
             models.Index(fields=['agencia', 'presupuesto_maximo'], name='cli_agencia_presupuesto_idx'),
+            models.Index(fields=['sync_status', 'sync_next_attempt_at'], name='cli_sync_retry_idx'),
         ]
 
     def __str__(self):
         return f"Cliente {self.nombre}"
 
 
+# --- 3. MODELOS DE SINCRONIZACION (OUTBOX) ---
+
+class SyncJob(models.Model):
+    """
+    Outbox persistente de trabajos de sincronizacion con GHL.
+    Sobrevive a reinicios de gunicorn y redeploys: los workers reclaman trabajos
+    por lotes (SELECT ... FOR UPDATE SKIP LOCKED) y borran los completados en bloque.
+    """
+    class JobType(models.TextChoices):
+        SYNC_RECORD = "sync_record", "Sync de registro (DB -> GHL)"
+        SYNC_ASSOCIATIONS = "sync_associations", "Sync de asociaciones"
+        WEBHOOK_CLIENTE = "webhook_cliente", "Webhook de Cliente (GHL -> DB)"
+        IMPORT_AGENCY = "import_agency", "Importacion inicial de agencia (GHL -> DB)"
+        RECONCILE_AGENCY = "reconcile_agency", "Reconciliacion de agencia (DB <-> GHL)"
+        SETUP_AGENCY = "setup_agency", "Setup inicial de agencia en GHL"
+        ZONAS_PUSH = "zonas_push", "Push de opciones de zona a GHL"
+
+    class Priority(models.TextChoices):
+        INTERACTIVE = "interactive", "Interactivo (usuario esperando)"
+        WEBHOOK = "webhook", "Webhook"
+        BACKFILL = "backfill", "Masivo (backfill)"
+        MAINTENANCE = "maintenance", "Mantenimiento"
+
+    job_type = models.CharField(max_length=50, choices=JobType.choices)
+    agencia = models.ForeignKey(
+        Agencia, on_delete=models.CASCADE, related_name='sync_jobs', blank=True, null=True
+    )
+    payload = models.JSONField(default=dict, blank=True)
+    priority = models.CharField(
+        max_length=20, choices=Priority.choices, default=Priority.BACKFILL,
+        help_text="Clase de prioridad: se reclama y ejecuta antes que las clases inferiores"
+    )
+    dedupe_key = models.CharField(
+        max_length=255, blank=True, null=True, db_index=True,
+        help_text="Trabajos pendientes con la misma clave se fusionan en uno (debounce)"
+    )
+    attempts = models.IntegerField(default=0, help_text="Numero de veces que se ha reclamado el trabajo")
+    next_run_at = models.DateTimeField(default=timezone.now, help_text="No se ejecuta antes de esta fecha")
+    lease_until = models.DateTimeField(
+        blank=True, null=True, help_text="Reclamado por un worker hasta esta fecha"
+    )
+    last_error = models.TextField(blank=True, default='')
+    dead_at = models.DateTimeField(
+        blank=True, null=True, help_text="Descartado tras agotar OUTBOX_MAX_ATTEMPTS intentos: no se vuelve a reclamar"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_run_at', 'lease_until'], name='syncjob_next_run_idx'),
+            models.Index(fields=['priority', 'next_run_at'], name='syncjob_priority_idx'),
+        ]
+        constraints = [
+            # Como mucho un trabajo pendiente (sin reclamar) por clave: enqueue_job fusiona
+            models.UniqueConstraint(
+                fields=['dedupe_key'], condition=models.Q(lease_until__isnull=True, dead_at__isnull=True),
+                name='syncjob_dedupe_pendiente_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f"SyncJob {self.pk} {self.job_type} (intentos: {self.attempts})"
+
+
+class PeriodicJobState(models.Model):
+    """
+    Estado compartido de un job periodico del scheduler (scheduler.py).
+    La fila hace de candado entre procesos (lease) y guarda la contabilidad de la ultima ejecucion.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    next_run_at = models.DateTimeField(blank=True, null=True, help_text="Proxima ejecucion programada")
+    lease_until = models.DateTimeField(blank=True, null=True, help_text="Ejecutandose en un proceso hasta esta fecha")
+    owner = models.CharField(max_length=255, blank=True, default='', help_text="Proceso de la ultima ejecucion")
+    last_started_at = models.DateTimeField(blank=True, null=True)
+    last_finished_at = models.DateTimeField(blank=True, null=True)
+    last_duration_ms = models.IntegerField(blank=True, null=True)
+    last_status = models.CharField(max_length=20, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    run_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Job {self.name} (proxima: {self.next_run_at}, ultima: {self.last_status or '-'})"
+
+
+class CacheVersion(models.Model):
+    """
+    Contador de version de un conjunto de datos cacheado en memoria (versions.py).
+    Al cambiar los datos se incrementa y todos los procesos descartan su copia.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class AgencyImport(models.Model):
+    """
+    Importacion inicial GHL → BD de una agencia recien instalada (importer.py).
+    Guarda la fase y el cursor de paginacion de GHL tras cada pagina: si falla, se reanuda ahi.
+    """
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pendiente"
+        RUNNING = "running", "En curso"
+        DONE = "done", "Completada"
+        ERROR = "error", "Error"
+
+    class Phase(models.TextChoices):
+        CLIENTES = "clientes", "Contactos"
+        PROPIEDADES = "propiedades", "Propiedades"
+        MATCHING = "matching", "Matching y asociaciones"
+        DONE = "done", "Terminada"
+
+    agencia = models.OneToOneField(Agencia, on_delete=models.CASCADE, primary_key=True, related_name='importacion')
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    phase = models.CharField(max_length=20, choices=Phase.choices, default=Phase.CLIENTES)
+    cursor = models.JSONField(default=dict, blank=True, help_text="Cursor de paginacion de GHL de la fase actual")
+    clientes_importados = models.IntegerField(default=0)
+    propiedades_importadas = models.IntegerField(default=0)
+    matches = models.IntegerField(default=0)
+    registros_saltados = models.IntegerField(
+        default=0, help_text="Contactos o propiedades de GHL que no se pudieron interpretar y se saltaron"
+    )
+    lease_until = models.DateTimeField(
+        blank=True, null=True, help_text="Importandose en un proceso hasta esta fecha (se renueva por pagina)"
+    )
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Importacion {self.agencia_id} ({self.status}, fase {self.phase})"
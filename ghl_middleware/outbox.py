@@ -0,0 +1,353 @@
+"""
+Outbox persistente de trabajos de sincronizacion con GHL (modelo SyncJob).
+
+Entrega at-least-once: un trabajo solo se borra cuando su handler termina sin excepcion.
+Si el proceso muere a mitad, el lease caduca y otro worker lo vuelve a reclamar,
+asi que los handlers deben ser idempotentes.
+"""
+import math
+import time
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import SyncJob
+from .priority import PRIORIDADES, prioridad, mas_alta, current_priority
+from .shutdown import SYNC_JOB, apagando, registrar_en_vuelo, marcar_terminados
+from .utils import CoalescingWindow
+from .wakeup import notify_sync_pending
+
+logger = logging.getLogger(__name__)
+
+# Registro job_type -> funcion(payload). Los handlers se registran en tasks.py.
+JOB_HANDLERS = {}
+# job_type -> merge(payload_previo, payload_nuevo) al fusionar trabajos con la misma dedupe_key
+JOB_MERGES = {}
+
+# Estado single-flight del drenador de cada clase de prioridad
+_drain_lock = threading.Lock()
+_drain_running = set()
+_drain_requested = set()
+
+
+def job_handler(job_type, merge=None):
+    """
+    Decorador que registra el handler de un tipo de trabajo del outbox.
+    merge: como fusionar dos payloads del tipo con la misma dedupe_key (por defecto gana el nuevo).
+    """
+    def decorator(func):
+        JOB_HANDLERS[job_type] = func
+        if merge is not None:
+            JOB_MERGES[job_type] = merge
+        return func
+    return decorator
+
+
+def enqueue_job(job_type, payload, agencia_id=None, delay=0, dedupe_key=None, merge=None, max_delay=None,
+                priority=None):
+    """
+    Guarda un trabajo en el outbox y, cuando la transaccion actual hace commit,
+    despierta al drenador de su clase y notifica al sync worker (aunque sea otro proceso).
+
+    priority: clase de prioridad (priority.py); por defecto la del thread que encola.
+    Al fusionar por dedupe_key el trabajo se queda con la mas alta de las dos.
+
+    Con dedupe_key, si ya hay un trabajo no reclamado con la misma clave se fusiona con el
+    (merge(payload_previo, payload), el merge registrado del tipo o el nuevo payload) y se
+    retrasa hasta now + delay, sin pasar de created_at + max_delay. Asi una rafaga de eventos
+    queda en un solo trabajo. Un indice unico parcial (dedupe_key sin lease) garantiza que dos
+    encolados simultaneos de la misma clave no crean dos trabajos: el que pierde se fusiona.
+    """
+    priority = priority or current_priority()
+    merge = merge or JOB_MERGES.get(job_type)
+    now = timezone.now()
+    run_at = now + timedelta(seconds=delay)
+
+    with transaction.atomic():
+        job = _pendiente(dedupe_key) if dedupe_key else None
+        nuevo = job is None
+        if nuevo:
+            try:
+                with transaction.atomic():
+                    job = SyncJob.objects.create(
+                        job_type=job_type,
+                        agencia_id=agencia_id,
+                        payload=payload,
+                        dedupe_key=dedupe_key,
+                        priority=priority,
+                        next_run_at=run_at,
+                    )
+            except IntegrityError:
+                # Otro proceso ha insertado la misma clave a la vez: fusionar con el suyo
+                job = _pendiente(dedupe_key) if dedupe_key else None
+                if job is None:
+                    raise
+                nuevo = False
+        if not nuevo:
+            if max_delay is not None:
+                run_at = min(run_at, job.created_at + timedelta(seconds=max_delay))
+            job.payload = merge(job.payload, payload) if merge else payload
+            job.next_run_at = run_at
+            job.priority = mas_alta(job.priority, priority)
+            job.save(update_fields=['payload', 'next_run_at', 'priority'])
+
+    espera = (run_at - now).total_seconds()
+    if espera > 0:
+        # Trabajo diferido: despertar al drenador cuando venza, no ahora
+        transaction.on_commit(lambda: _programar_kick(espera))
+    else:
+        clase = job.priority
+        transaction.on_commit(lambda: kick_outbox(clase))
+        notify_sync_pending()
+    return job
+
+
+def _pendiente(dedupe_key):
+    """Trabajo no reclamado con esa clave (como mucho hay uno), bloqueado para fusionarlo."""
+    return SyncJob.objects.select_for_update().filter(
+        dedupe_key=dedupe_key, lease_until__isnull=True, dead_at__isnull=True
+    ).first()
+
+
+def liberar_trabajo(job, **campos):
+    """
+    Quita el lease de un trabajo reclamado (y actualiza `campos`) para que se vuelva a
+    ejecutar. Si mientras corria se encolo otro con la misma dedupe_key, el indice unico no
+    deja tener dos pendientes: este se fusiona en el nuevo (merge del tipo) y se borra.
+    Retorna False si se ha fusionado.
+    """
+    try:
+        with transaction.atomic():
+            SyncJob.objects.filter(pk=job.pk).update(lease_until=None, **campos)
+        return True
+    except IntegrityError:
+        pass
+
+    merge = JOB_MERGES.get(job.job_type)
+    with transaction.atomic():
+        pendiente = _pendiente(job.dedupe_key)
+        if pendiente is not None:
+            if merge:
+                pendiente.payload = merge(job.payload, pendiente.payload)
+            pendiente.priority = mas_alta(pendiente.priority, job.priority)
+            pendiente.save(update_fields=['payload', 'priority'])
+        SyncJob.objects.filter(pk=job.pk).delete()
+    logger.info(f"SyncJob {job.pk} ({job.job_type}) fusionado con el pendiente de la misma clave")
+    return False
+
+
+def _programar_kick(delay):
+    """
+    Drena el outbox cuando venzan los trabajos diferidos. Los vencimientos se agrupan
+    por segundo: como mucho un timer por segundo aunque haya miles de trabajos.
+    """
+    vence = math.ceil(time.time() + delay)
+    _kick_window.submit(vence, True, max(0, vence - time.time()))
+
+
+def claim_jobs(limit=None, lease_seconds=None, priorities=None):
+    """
+    Reclama un lote de trabajos vencidos con SELECT ... FOR UPDATE SKIP LOCKED
+    y les pone un lease. Los trabajos con lease caducado se consideran libres.
+
+    Las clases de prioridad (todas, o las de `priorities`) se recorren de la mas alta a la
+    mas baja: las bajas solo se llevan la capacidad que sobra. Dentro de cada clase el lote
+    se reparte entre agencias por round-robin ponderado y se devuelve intercalado por
+    agencia, para que ningun tenant acapare el pool al despacharlo.
+    """
+    from .fairness import repartir_cuotas, pesos_agencias, intercalar_por_agencia
+
+    limit = limit or settings.OUTBOX_BATCH_SIZE
+    lease_seconds = lease_seconds or settings.OUTBOX_LEASE_SECONDS
+    now = timezone.now()
+
+    vencidos = (
+        SyncJob.objects.filter(next_run_at__lte=now, dead_at__isnull=True)
+        .filter(Q(lease_until__isnull=True) | Q(lease_until__lt=now))
+    )
+    clases = [c for c in PRIORIDADES if priorities is None or c in priorities]
+    vencidos = vencidos.filter(priority__in=clases)
+
+    # Un solo GROUP BY (clase, agencia) para todo el reparto
+    profundidades = defaultdict(dict)
+    for clase, agencia_id, n in (
+        vencidos.order_by().values_list('priority', 'agencia_id').annotate(n=Count('pk'))
+    ):
+        profundidades[clase][agencia_id] = n
+    if not profundidades:
+        return []
+    pesos = pesos_agencias({a for por_agencia in profundidades.values() for a in por_agencia})
+
+    jobs = []
+    with transaction.atomic():
+        for clase in clases:
+            restante = limit - len(jobs)
+            if restante <= 0 or clase not in profundidades:
+                continue
+            de_la_clase = []
+            for agencia_id, cuota in repartir_cuotas(profundidades[clase], restante, pesos).items():
+                de_la_clase += list(
+                    vencidos.select_for_update(skip_locked=True)
+                    .filter(priority=clase, agencia_id=agencia_id)
+                    .order_by('next_run_at')[:cuota]
+                )
+            jobs += intercalar_por_agencia(de_la_clase, key=lambda job: job.agencia_id)
+        if jobs:
+            SyncJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                lease_until=now + timedelta(seconds=lease_seconds),
+                attempts=F('attempts') + 1,
+            )
+
+    for job in jobs:
+        job.attempts += 1
+    # Si el proceso se apaga antes de ejecutarlos, se les quita el lease (shutdown.py)
+    registrar_en_vuelo(SYNC_JOB, [job.pk for job in jobs])
+    return jobs
+
+
+def run_job(job):
+    """Ejecuta el handler de un trabajo. Lanza excepcion si el trabajo ha fallado."""
+    from . import tasks  # noqa: F401  (registra los handlers)
+
+    handler = JOB_HANDLERS.get(job.job_type)
+    if handler is None:
+        raise ValueError(f"No hay handler registrado para el trabajo '{job.job_type}'")
+    with prioridad(job.priority):
+        handler(job.payload)
+
+
+def _reschedule_failed(job, error):
+    """
+    Libera el lease y reprograma el trabajo con backoff exponencial. Tras OUTBOX_MAX_ATTEMPTS
+    intentos se descarta (dead_at): se queda en BD para revisarlo pero no se reclama mas.
+    """
+    from .utils import exponential_backoff
+
+    if job.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        SyncJob.objects.filter(pk=job.pk).update(
+            lease_until=None, dead_at=timezone.now(), last_error=str(error)[:500],
+        )
+        logger.error(f"SyncJob {job.pk} ({job.job_type}) descartado tras {job.attempts} intentos: {error}")
+        return
+
+    delay = exponential_backoff(job.attempts, base_delay=30, max_delay=3600)
+    if not liberar_trabajo(job, next_run_at=timezone.now() + timedelta(seconds=delay), last_error=str(error)[:500]):
+        return
+    logger.warning(f"SyncJob {job.pk} ({job.job_type}) fallido, reintento en {delay:.0f}s: {error}")
+
+
+def process_outbox(limit=None, executor=None, priorities=None):
+    """
+    Reclama un lote de trabajos y los ejecuta (en paralelo si se pasa un executor).
+    Los completados se borran en bloque. Retorna el numero de trabajos reclamados.
+    """
+    jobs = claim_jobs(limit, priorities=priorities)
+    if not jobs:
+        return 0
+
+    completados = []
+
+    def _ejecutar(job):
+        try:
+            run_job(job)
+            return True
+        except Exception as e:
+            logger.error(f"Error ejecutando SyncJob {job.pk} ({job.job_type}): {str(e)}", exc_info=True)
+            _reschedule_failed(job, e)
+            marcar_terminados(SYNC_JOB, [job.pk])
+            return False
+
+    if executor is not None:
+        resultados = zip(jobs, executor.map(_ejecutar, jobs))
+    else:
+        resultados = ((job, _ejecutar(job)) for job in jobs)
+
+    for job, ok in resultados:
+        if ok:
+            completados.append(job.pk)
+
+    if completados:
+        SyncJob.objects.filter(pk__in=completados).delete()
+        marcar_terminados(SYNC_JOB, completados)
+
+    logger.info(f"Outbox: {len(completados)}/{len(jobs)} trabajos completados")
+    return len(jobs)
+
+
+def drain_outbox(executor=None, priorities=None, max_batches=None):
+    """
+    Procesa lotes hasta vaciar los trabajos vencidos (o no poder reclamar mas), como mucho
+    `max_batches` lotes si se indica. Retorna el numero de trabajos reclamados.
+    Durante el apagado no se reclaman lotes nuevos: los trabajos esperan en BD al siguiente proceso.
+    """
+    total = lotes = 0
+    while not apagando() and (max_batches is None or lotes < max_batches):
+        procesados = process_outbox(executor=executor, priorities=priorities)
+        total += procesados
+        lotes += 1
+        if procesados < settings.OUTBOX_BATCH_SIZE:
+            break
+    return total
+
+
+_kick_window = CoalescingWindow(on_flush=lambda vence, _: kick_outbox())
+
+
+def kick_outbox(priority=None):
+    """
+    Pide al proceso actual que drene el outbox en background.
+    Cada clase de prioridad tiene su propio drenador, asi un lote de backfill en curso
+    no retrasa un trabajo interactivo. Sin `priority` se despiertan todas las clases.
+    Single-flight por clase: si ya hay un drenaje en curso solo se marca que hay que repetirlo.
+    """
+    for clase in ([priority] if priority else PRIORIDADES):
+        _kick_clase(clase)
+
+
+def _kick_clase(clase):
+    from .background import runner, JobRejected
+
+    if apagando():
+        return  # Los trabajos siguen en BD: los recogera el siguiente proceso
+
+    with _drain_lock:
+        if clase in _drain_running:
+            _drain_requested.add(clase)
+            return
+        _drain_running.add(clase)
+        _drain_requested.discard(clase)
+
+    def _drenar():
+        while True:
+            try:
+                # Cada trabajo va al tipo del runner de su clase (topes de workers por clase)
+                drain_outbox(
+                    executor=runner.executor(lambda job: f"outbox_{job.priority}"),
+                    priorities=[clase],
+                )
+            except JobRejected:
+                # Runner cerrado (apagado): lo reclamado y no ejecutado se devuelve a la BD
+                with _drain_lock:
+                    _drain_running.discard(clase)
+                return
+            except Exception as e:
+                logger.error(f"Error drenando outbox ({clase}): {str(e)}", exc_info=True)
+
+            with _drain_lock:
+                if clase not in _drain_requested:
+                    _drain_running.discard(clase)
+                    return
+                _drain_requested.discard(clase)
+
+    try:
+        runner.submit('outbox_drain', _drenar)
+    except Exception as e:
+        # Sin drenaje en este proceso: los trabajos siguen en BD y los recogera el sync worker
+        logger.warning(f"No se pudo lanzar el drenaje del outbox: {str(e)}")
+        with _drain_lock:
+            _drain_running.discard(clase)
@@ -0,0 +1,109 @@
+"""
+Clases de prioridad del trabajo en background y presupuesto de rate limit de GHL.
+
+De mayor a menor prioridad:
+- interactive: lo que un usuario esta esperando (guardar una propiedad desde el dashboard).
+- webhook: eventos de GHL que hay que reflejar en casi tiempo real.
+- backfill: sync masivo (sync worker, sync_to_ghl, importaciones).
+- maintenance: tareas periodicas (push de zonas, reconciliacion, reapers).
+
+La prioridad viaja en un contexto por thread: el runner de background la fija segun el
+tipo de trabajo, el outbox segun SyncJob.priority, y las llamadas HTTP a GHL la usan
+para consumir el presupuesto de rate limit (las clases bajas dejan margen a las altas).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+INTERACTIVE = 'interactive'
+WEBHOOK = 'webhook'
+BACKFILL = 'backfill'
+MAINTENANCE = 'maintenance'
+
+# De mayor a menor prioridad
+PRIORIDADES = (INTERACTIVE, WEBHOOK, BACKFILL, MAINTENANCE)
+
+_local = threading.local()
+
+
+def rango(clase):
+    """Posicion de la clase (0 = la mas prioritaria). Las desconocidas van al final."""
+    return PRIORIDADES.index(clase) if clase in PRIORIDADES else len(PRIORIDADES)
+
+
+def mas_alta(a, b):
+    """La mas prioritaria de dos clases."""
+    return a if rango(a) <= rango(b) else b
+
+
+def current_priority():
+    """Clase del thread actual. Los threads sin etiquetar (requests HTTP) son interactivos."""
+    return getattr(_local, 'prioridad', INTERACTIVE)
+
+
+@contextmanager
+def prioridad(clase):
+    """Ejecuta el bloque con la clase de prioridad indicada."""
+    previa = getattr(_local, 'prioridad', None)
+    _local.prioridad = clase
+    try:
+        yield
+    finally:
+        if previa is None:
+            del _local.prioridad
+        else:
+            _local.prioridad = previa
+
+
+class RateBudget:
+    """
+    Token bucket del proceso para las llamadas a GHL, con reservas por clase.
+
+    Una clase solo puede gastar un token si, tras gastarlo, quedan al menos los tokens
+    reservados para las clases mas prioritarias. Asi el backfill consume la capacidad
+    sobrante sin dejar sin margen a las peticiones interactivas.
+    """
+    def __init__(self, rate, burst, reserves=None):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.reserves = dict(reserves or {})
+        self._tokens = self.burst
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.GHL_RATE_PER_SECOND, settings.GHL_RATE_BURST, settings.GHL_RATE_RESERVES)
+
+    def _umbral(self, clase):
+        """Tokens que la clase debe dejar intactos (reservas de las clases superiores)."""
+        superiores = PRIORIDADES[:rango(clase)]
+        return self.burst * sum(self.reserves.get(c, 0) for c in superiores)
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (ahora - self._ultimo) * self.rate)
+        self._ultimo = ahora
+
+    def try_acquire(self, clase):
+        """Gasta un token si hay margen para la clase. Retorna los segundos a esperar (0 = concedido)."""
+        with self._lock:
+            self._rellenar()
+            umbral = self._umbral(clase)
+            if self._tokens - 1 >= umbral:
+                self._tokens -= 1
+                return 0
+            return (umbral + 1 - self._tokens) / self.rate
+
+    def acquire(self, clase=None):
+        """Bloquea hasta poder gastar un token con la clase indicada (o la del thread)."""
+        clase = clase or current_priority()
+        while True:
+            espera = self.try_acquire(clase)
+            if not espera:
+                return
+            time.sleep(min(espera, 1.0))
+
+
+ghl_rate_budget = RateBudget.from_settings()
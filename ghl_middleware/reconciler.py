@@ -0,0 +1,449 @@
+"""
+Reconciliacion BD local ↔ GHL: detecta y repara la deriva que dejan los webhooks
+perdidos y los syncs abandonados (contactos borrados en GHL, registros locales que
+nunca llegaron a GHL, asociaciones distintas del matching local).
+
+Por agencia, para contactos y para registros de Propiedad:
+- Los IDs de GHL se leen en streaming, pagina a pagina. Los listados de GHL no vienen
+  ordenados por ID, asi que se ordenan por tramos de RECONCILE_RUN_SIZE en memoria, cada
+  tramo se vuelca ordenado a un fichero temporal y los tramos se mezclan con heapq.merge
+  (ordenacion externa: la memoria no crece con el tamaño de la agencia).
+- Los registros locales se recorren con un iterator ordenado por ghl_contact_id y las dos
+  secuencias ordenadas se cruzan por ID sin cargar ninguna entera.
+- Las reparaciones se acumulan y se aplican por lotes de RECONCILE_BATCH_SIZE:
+  * requeue: registros locales sin ID de GHL o en 'dead' vuelven a 'pending' para el worker.
+  * delete: registros cuyo ID ya no existe en GHL (se confirma uno a uno antes de borrar,
+    por si se han creado en GHL despues de leer el listado).
+  * import: registros de GHL que no existen en local, guardados como en la importacion inicial.
+  * reassociate: contactos cuyas asociaciones en GHL no coinciden con el matching local.
+Con dry_run solo se calcula el informe, sin escribir nada.
+"""
+import heapq
+import logging
+import tempfile
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.functions import Collate
+
+from .importer import (
+    CAMPOS_CLIENTE, CAMPOS_PROPIEDAD,
+    _cliente_desde_ghl, _propiedad_desde_ghl, _guardar_pagina,
+)
+from .models import AgencyImport, Agencia, Cliente, Propiedad
+from .zonas import zona_resolver
+
+logger = logging.getLogger(__name__)
+
+# Acciones de reparacion
+REQUEUE = 'requeue'
+DELETE = 'delete'
+IMPORT = 'import'
+REASSOCIATE = 'reassociate'
+
+CLIENTE = 'cliente'
+PROPIEDAD = 'propiedad'
+
+
+class InformeReconciliacion:
+    """Resultado de reconciliar una agencia: registros revisados y acciones por tipo."""
+    MUESTRA = 5
+
+    def __init__(self, location_id, dry_run):
+        self.location_id = location_id
+        self.dry_run = dry_run
+        self.revisados = Counter()
+        self.acciones = Counter()
+        self.aplicadas = Counter()
+        # Registros que no se han podido comparar (GHL fallo al leerlos): ni deriva ni al dia
+        self.sin_comprobar = Counter()
+        self.muestras = defaultdict(list)
+        self.error = ''
+
+    def anotar(self, tipo, accion, ghl_id):
+        self.acciones[(tipo, accion)] += 1
+        if ghl_id and len(self.muestras[(tipo, accion)]) < self.MUESTRA:
+            self.muestras[(tipo, accion)].append(ghl_id)
+
+    @property
+    def con_deriva(self):
+        return any(self.acciones.values())
+
+    def lineas(self):
+        modo = ' (dry-run)' if self.dry_run else ''
+        lineas = [
+            f"{self.location_id}{modo}: {self.revisados[CLIENTE]} clientes y "
+            f"{self.revisados[PROPIEDAD]} propiedades revisados"
+        ]
+        for (tipo, accion), n in sorted(self.acciones.items()):
+            aplicadas = '' if self.dry_run else f" ({self.aplicadas[(tipo, accion)]} aplicadas)"
+            muestra = ', '.join(self.muestras[(tipo, accion)])
+            lineas.append(f"  {tipo} {accion}: {n}{aplicadas} [{muestra}]")
+        for tipo, n in sorted(self.sin_comprobar.items()):
+            lineas.append(f"  {tipo} sin comprobar (error de GHL): {n}")
+        if self.error:
+            lineas.append(f"  error: {self.error}")
+        return lineas
+
+    def __str__(self):
+        return '\n'.join(self.lineas())
+
+
+def agencias_a_reconciliar():
+    """
+    location_id de las agencias activas que se reconcilian en la pasada periodica.
+    Las que tienen la importacion inicial a medias se saltan: la importacion ya las pone al dia.
+    """
+    pendientes = AgencyImport.objects.exclude(status=AgencyImport.Status.DONE).values('agencia_id')
+    return list(
+        Agencia.objects.filter(active=True).exclude(location_id__in=pendientes)
+        .values_list('location_id', flat=True)
+    )
+
+
+def reconciliar_agencia(location_id, dry_run=False, asociaciones=True, page_size=None, batch_size=None):
+    """
+    Reconcilia una agencia. Retorna el InformeReconciliacion; un fallo de GHL a mitad
+    queda en informe.error (lo ya aplicado se queda, la siguiente pasada sigue el resto).
+    """
+    from .utils import get_valid_token
+
+    agencia = Agencia.objects.get(location_id=location_id)
+    informe = InformeReconciliacion(location_id, dry_run)
+    access_token = get_valid_token(location_id)
+    if not access_token:
+        informe.error = 'sin token valido'
+        return informe
+
+    reconciliacion = _Reconciliacion(
+        agencia, access_token, informe, dry_run,
+        page_size or settings.IMPORT_PAGE_SIZE, batch_size or settings.RECONCILE_BATCH_SIZE,
+    )
+    try:
+        reconciliacion.clientes(asociaciones=asociaciones and bool(agencia.association_type_id))
+        reconciliacion.propiedades()
+    except Exception as e:
+        informe.error = str(e)[:500]
+        logger.error(f"Reconciliacion de {location_id} interrumpida: {str(e)}", exc_info=True)
+    return informe
+
+
+def _orden_binario(campo):
+    """
+    Orden por ID en la BD igual al de las cadenas en Python, que es el del merge.
+    En PostgreSQL depende de la collation de la BD; 'C' compara por bytes.
+    """
+    if connection.vendor == 'postgresql':
+        return Collate(campo, 'C').asc()
+    return F(campo).asc()
+
+
+def _ids_ordenados(paginas, run_size):
+    """
+    IDs unicos y ordenados de una secuencia de paginas de IDs, con memoria acotada:
+    tramos de run_size ordenados en memoria, volcados a ficheros temporales y mezclados.
+    """
+    tramos, tramo = [], []
+    try:
+        for ids in paginas:
+            tramo.extend(ids)
+            if len(tramo) >= run_size:
+                tramos.append(_volcar_tramo(tramo))
+                tramo = []
+        tramo.sort()
+
+        anterior = None
+        for ghl_id in heapq.merge(*[_leer_tramo(f) for f in tramos], tramo):
+            if ghl_id != anterior:
+                yield ghl_id
+                anterior = ghl_id
+    finally:
+        for f in tramos:
+            f.close()
+
+
+def _volcar_tramo(ids):
+    f = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+    f.writelines(f"{ghl_id}\n" for ghl_id in sorted(ids))
+    f.seek(0)
+    return f
+
+
+def _leer_tramo(f):
+    for linea in f:
+        yield linea.rstrip('\n')
+
+
+def _cruzar(locales, remotos):
+    """
+    Merge por ID de dos secuencias ordenadas: locales genera (ghl_id, fila) y remotos ghl_id.
+    Genera (ghl_id, fila_local o None, esta_en_ghl).
+    """
+    # Primero GHL: el listado se lee entero antes de abrir el cursor de la BD
+    remoto, local = next(remotos, None), next(locales, None)
+    while local is not None or remoto is not None:
+        if remoto is None or (local is not None and local[0] < remoto):
+            yield local[0], local[1], False
+            local = next(locales, None)
+        elif local is None or remoto < local[0]:
+            yield remoto, None, True
+            remoto = next(remotos, None)
+        else:
+            yield remoto, local[1], True
+            local, remoto = next(locales, None), next(remotos, None)
+
+
+class _Reconciliacion:
+    """Estado de la reconciliacion de una agencia: lotes de reparacion pendientes de aplicar."""
+
+    def __init__(self, agencia, access_token, informe, dry_run, page_size, batch_size):
+        self.agencia = agencia
+        self.access_token = access_token
+        self.informe = informe
+        self.dry_run = dry_run
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.lotes = defaultdict(list)
+        self._zonas = None
+        self._claves = None
+        self._property_object_id = agencia.property_object_id
+
+    # --- Recorrido ---
+
+    def clientes(self, asociaciones=True):
+        from .utils import ghl_list_contacts
+
+        def paginas():
+            cursor = {}
+            while True:
+                pagina = ghl_list_contacts(
+                    self.access_token, self.agencia.location_id, limit=self.page_size,
+                    start_after_id=cursor.get('startAfterId'), start_after=cursor.get('startAfter'),
+                )
+                if pagina is None:
+                    raise Exception("Error leyendo contactos de GHL")
+                contactos, meta = pagina
+                yield [contacto['id'] for contacto in contactos]
+                cursor = {'startAfterId': meta.get('startAfterId'), 'startAfter': meta.get('startAfter')}
+                if len(contactos) < self.page_size or not cursor['startAfterId']:
+                    break
+
+        self._recorrer(CLIENTE, Cliente, paginas(), asociaciones=asociaciones)
+
+    def propiedades(self):
+        from .utils import ghl_search_property_records, get_property_object_id
+
+        if not self._property_object_id:
+            self._property_object_id = get_property_object_id(self.access_token, self.agencia.location_id)
+        if not self._property_object_id:
+            raise Exception("No se pudo obtener property_object_id de GHL")
+
+        def paginas():
+            page = 1
+            while True:
+                pagina = ghl_search_property_records(
+                    self.access_token, self.agencia.location_id, self._property_object_id,
+                    page=page, page_limit=self.page_size,
+                )
+                if pagina is None:
+                    raise Exception(f"Error leyendo la pagina {page} de propiedades de GHL")
+                registros, _ = pagina
+                yield [registro['id'] for registro in registros]
+                page += 1
+                if len(registros) < self.page_size:
+                    break
+
+        self._recorrer(PROPIEDAD, Propiedad, paginas())
+
+    def _recorrer(self, tipo, model, paginas, asociaciones=False):
+        registros = model.objects.filter(agencia=self.agencia)
+        # Igual que pending_sync_filter: un ID vacio es un registro sin ID de GHL
+        sin_id = Q(ghl_contact_id__isnull=True) | Q(ghl_contact_id='')
+
+        # Creados en local que nunca llegaron a GHL y ya no estan en la cola del worker
+        for pk in (
+            registros.filter(sin_id, sync_status__in=['synced', 'dead'])
+            .values_list('pk', flat=True).iterator(chunk_size=self.batch_size)
+        ):
+            self.informe.revisados[tipo] += 1
+            self._anotar(tipo, REQUEUE, pk, None)
+
+        remotos = _ids_ordenados(paginas, settings.RECONCILE_RUN_SIZE)
+        locales = (
+            (ghl_id, (pk, sync_status)) for pk, ghl_id, sync_status in
+            registros.exclude(sin_id)
+            .order_by(_orden_binario('ghl_contact_id'))
+            .values_list('pk', 'ghl_contact_id', 'sync_status').iterator(chunk_size=self.batch_size)
+        )
+        for ghl_id, fila, en_ghl in _cruzar(locales, remotos):
+            self.informe.revisados[tipo] += 1
+            if fila is None:
+                self._anotar(tipo, IMPORT, ghl_id, ghl_id)
+                continue
+            pk, sync_status = fila
+            if not en_ghl:
+                # Un registro en 'syncing' lo esta tocando el worker ahora mismo
+                if sync_status != 'syncing':
+                    self._anotar(tipo, DELETE, (pk, ghl_id), ghl_id)
+            elif sync_status == 'dead':
+                self._anotar(tipo, REQUEUE, pk, ghl_id)
+            elif asociaciones:
+                self.lotes[(tipo, 'asociaciones')].append((pk, ghl_id))
+                if len(self.lotes[(tipo, 'asociaciones')]) >= self.batch_size:
+                    self._comprobar_asociaciones(self.lotes.pop((tipo, 'asociaciones')))
+
+        if asociaciones and self.lotes.get((tipo, 'asociaciones')):
+            self._comprobar_asociaciones(self.lotes.pop((tipo, 'asociaciones')))
+        for accion in (REQUEUE, DELETE, IMPORT):
+            self._aplicar(tipo, accion)
+
+    def _anotar(self, tipo, accion, valor, ghl_id):
+        self.informe.anotar(tipo, accion, ghl_id)
+        if self.dry_run:
+            return
+        self.lotes[(tipo, accion)].append(valor)
+        if len(self.lotes[(tipo, accion)]) >= self.batch_size:
+            self._aplicar(tipo, accion)
+
+    # --- Reparaciones ---
+
+    def _aplicar(self, tipo, accion):
+        valores = self.lotes.pop((tipo, accion), [])
+        if not valores:
+            return
+        model = Cliente if tipo == CLIENTE else Propiedad
+        if accion == REQUEUE:
+            aplicadas = self._requeue(model, valores)
+        elif accion == DELETE:
+            aplicadas = self._borrar(tipo, model, valores)
+        else:
+            aplicadas = self._importar(tipo, model, valores)
+        self.informe.aplicadas[(tipo, accion)] += aplicadas
+
+    def _requeue(self, model, pks):
+        """Devuelve los registros a la cola del worker de sync con los intentos a cero."""
+        from .wakeup import notify_sync_pending
+
+        n = model.objects.filter(pk__in=pks).exclude(sync_status='syncing').update(
+            sync_status='pending', sync_error='', sync_lease_until=None,
+            sync_attempt_count=0, sync_next_attempt_at=None,
+        )
+        if n:
+            notify_sync_pending()
+        return n
+
+    def _borrar(self, tipo, model, filas):
+        """Borra los registros que GHL confirma que ya no existen (404)."""
+        from .utils import ghl_get_contact, ghl_get_property_record
+
+        confirmados = []
+        for pk, ghl_id in filas:
+            if not ghl_id:
+                # Con un ID vacio la URL no es la del registro: su 404 no confirma nada
+                continue
+            if tipo == CLIENTE:
+                remoto = ghl_get_contact(self.access_token, ghl_id)
+            else:
+                remoto = ghl_get_property_record(self.access_token, self._property_object_id, ghl_id)
+            if remoto is False:
+                confirmados.append(pk)
+        model.objects.filter(pk__in=confirmados).exclude(sync_status='syncing').delete()
+        return len(confirmados)
+
+    def _importar(self, tipo, model, ghl_ids):
+        """Guarda en local los registros que solo estan en GHL y recalcula su matching."""
+        from .utils import ghl_get_contact, ghl_get_property_record, ghl_get_custom_field_keys
+
+        if self._zonas is None:
+            self._zonas = zona_resolver()
+        if tipo == CLIENTE and self._claves is None:
+            self._claves = ghl_get_custom_field_keys(self.access_token, self.agencia.location_id)
+            if self._claves is None:
+                raise Exception("No se pudieron leer los custom fields de contacto")
+            if self.agencia.ghl_custom_field_cliente_zona:
+                self._claves[self.agencia.ghl_custom_field_cliente_zona] = 'zonas_deseadas'
+
+        filas = []
+        for ghl_id in ghl_ids:
+            if tipo == CLIENTE:
+                remoto = ghl_get_contact(self.access_token, ghl_id)
+                if remoto:
+                    filas.append(_cliente_desde_ghl(remoto, self._claves, self._zonas))
+            else:
+                remoto = ghl_get_property_record(self.access_token, self._property_object_id, ghl_id)
+                if remoto:
+                    filas.append(_propiedad_desde_ghl(remoto, self._zonas))
+
+        if tipo == CLIENTE:
+            _guardar_pagina(Cliente, self.agencia, filas, CAMPOS_CLIENTE, 'zona_interes')
+        else:
+            _guardar_pagina(Propiedad, self.agencia, filas, CAMPOS_PROPIEDAD, 'zonas')
+
+        importados = model.objects.filter(
+            agencia=self.agencia, ghl_contact_id__in=[ghl_id for ghl_id, _, _ in filas]
+        )
+        for record in importados:
+            self._emparejar(tipo, record)
+        return len(filas)
+
+    def _emparejar(self, tipo, record):
+        """Matching de un registro importado y sus asociaciones, como tras un sync."""
+        from .matching import (
+            buscar_clientes_para_propiedad, buscar_propiedades_para_cliente,
+            actualizar_relaciones_propiedad, actualizar_relaciones_cliente,
+        )
+
+        if tipo == CLIENTE:
+            matches = buscar_propiedades_para_cliente(record, self.agencia)
+            actualizar_relaciones_cliente(record, matches)
+        elif record.estado == Propiedad.estadoPiso.ACTIVO:
+            matches = buscar_clientes_para_propiedad(record, self.agencia)
+            actualizar_relaciones_propiedad(record, matches)
+        else:
+            return
+        if self.agencia.association_type_id:
+            self._reasociar(record.ghl_contact_id, [m.ghl_contact_id for m in matches if m.ghl_contact_id],
+                            origin_is_contact=tipo == CLIENTE)
+
+    def _comprobar_asociaciones(self, clientes):
+        """
+        Compara las asociaciones en GHL de un lote de contactos con su matching local
+        y encola la resincronizacion de los que no coinciden. Si GHL falla al leer las de
+        un contacto, se cuenta como sin comprobar (no como deriva).
+        """
+        from .utils import ghl_get_current_associations
+
+        Relacion = Cliente.propiedades_interes.through
+        esperadas = defaultdict(set)
+        for cliente_pk, propiedad_ghl_id in Relacion.objects.filter(
+            cliente_id__in=[pk for pk, _ in clientes], propiedad__ghl_contact_id__isnull=False
+        ).values_list('cliente_id', 'propiedad__ghl_contact_id'):
+            esperadas[cliente_pk].add(propiedad_ghl_id)
+
+        for pk, ghl_id in clientes:
+            actuales = ghl_get_current_associations(self.access_token, self.agencia.location_id, ghl_id)
+            if actuales is None:
+                self.informe.sin_comprobar[CLIENTE] += 1
+                continue
+            if set(actuales) == esperadas[pk]:
+                continue
+            self.informe.anotar(CLIENTE, REASSOCIATE, ghl_id)
+            if not self.dry_run:
+                self._reasociar(ghl_id, sorted(esperadas[pk]), origin_is_contact=True)
+                self.informe.aplicadas[(CLIENTE, REASSOCIATE)] += 1
+
+    def _reasociar(self, origin_record_id, target_ids, origin_is_contact):
+        from .priority import MAINTENANCE
+        from .tasks import sync_associations_background
+
+        sync_associations_background(
+            access_token=self.access_token,
+            location_id=self.agencia.location_id,
+            origin_record_id=origin_record_id,
+            target_ids_list=target_ids,
+            association_id_val=self.agencia.association_type_id,
+            origin_is_contact=origin_is_contact,
+            priority=MAINTENANCE,
+            dedupe_key=f"assoc:{origin_record_id}",
+        )
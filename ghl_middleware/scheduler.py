@@ -0,0 +1,271 @@
+"""
+Scheduler de tareas periodicas del proceso (un solo thread para todas).
+
+Cada job es de intervalo (segundos) o de tipo cron ("m h dom mon dow"), con jitter para
+que varios procesos no coincidan. La fila PeriodicJobState de cada job hace de candado
+entre procesos (lease) y guarda la ultima ejecucion: aunque corran varios schedulers
+(gunicorn workers + proceso worker), cada job se ejecuta una vez por vencimiento.
+Mientras el job corre, un thread renueva el lease cada timeout / 3 (heartbeat): un job
+que tarda mas que su timeout no lo coge otro proceso a la vez.
+
+Un job que retorna True indica que le queda trabajo y se repite sin esperar al intervalo.
+Los jobs con wake_on_notify se adelantan cuando llega una notificacion de trabajo nuevo.
+"""
+import os
+import uuid
+import socket
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+from django.db.models import F, Min, Q
+from django.utils import timezone
+
+from .models import PeriodicJobState
+from .priority import prioridad, MAINTENANCE
+
+logger = logging.getLogger(__name__)
+
+# Identificador unico de este proceso (owner del lease de PeriodicJobState)
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Espera maxima entre comprobaciones aunque no venza nada (recoge jobs de otros procesos)
+MAX_WAIT_SECONDS = 60
+
+
+class CronExpr:
+    """
+    Expresion cron de 5 campos: minuto, hora, dia del mes, mes y dia de la semana (0 = domingo).
+    Admite '*', '*/n', 'a-b', 'a-b/n' y listas separadas por comas. Se evalua en UTC.
+    """
+    _RANGOS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expr):
+        campos = expr.split()
+        if len(campos) != 5:
+            raise ValueError(f"Expresion cron invalida (se esperan 5 campos): '{expr}'")
+        self.expr = expr
+        self.minutos, self.horas, self.dias, self.meses, self.dias_semana = (
+            self._parse(campo, *rango) for campo, rango in zip(campos, self._RANGOS)
+        )
+        # Como en cron: si se restringen dia del mes y dia de la semana, basta con uno
+        self._dia_y_semana = campos[2] != '*' and campos[4] != '*'
+
+    @staticmethod
+    def _parse(campo, minimo, maximo):
+        valores = set()
+        for parte in campo.split(','):
+            paso = 1
+            if '/' in parte:
+                parte, paso = parte.split('/')
+                paso = int(paso)
+            if parte == '*':
+                inicio, fin = minimo, maximo
+            elif '-' in parte:
+                inicio, fin = (int(x) for x in parte.split('-'))
+            else:
+                inicio = fin = int(parte)
+            if inicio < minimo or fin > maximo:
+                raise ValueError(f"Valor cron fuera de rango [{minimo}-{maximo}]: '{campo}'")
+            valores.update(range(inicio, fin + 1, paso))
+        return valores
+
+    def _dia_valido(self, dt):
+        en_mes = dt.day in self.dias
+        en_semana = (dt.weekday() + 1) % 7 in self.dias_semana
+        return (en_mes or en_semana) if self._dia_y_semana else (en_mes and en_semana)
+
+    def next_after(self, dt):
+        """Primer instante (minuto exacto) posterior a dt que cumple la expresion."""
+        dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = dt + timedelta(days=366 * 5)
+        while dt < limite:
+            if dt.month not in self.meses:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._dia_valido(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.horas:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutos:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"La expresion cron '{self.expr}' no tiene proxima ejecucion")
+
+
+class PeriodicJob:
+    """
+    Definicion de un job periodico.
+    func(executor) recibe el executor del proceso (o None) y puede retornar True si le queda trabajo.
+    """
+    def __init__(self, name, func, interval=None, cron=None, jitter=0.1, timeout=600,
+                 priority=MAINTENANCE, wake_on_notify=False):
+        if (interval is None) == (cron is None):
+            raise ValueError(f"El job '{name}' necesita interval o cron (solo uno)")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronExpr(cron) if cron else None
+        self.jitter = jitter
+        self.timeout = timeout
+        self.priority = priority
+        self.wake_on_notify = wake_on_notify
+
+    def next_run(self, desde):
+        """Proxima ejecucion tras `desde`, con jitter aleatorio."""
+        if self.cron:
+            # En cron el jitter solo retrasa (hasta jitter minutos), nunca adelanta
+            return self.cron.next_after(desde) + timedelta(seconds=random.uniform(0, self.jitter * 60))
+        factor = 1 + random.uniform(-self.jitter, self.jitter)
+        return desde + timedelta(seconds=self.interval * factor)
+
+
+def renovar_lease(name, timeout):
+    """Alarga el lease de un job si sigue siendo de este proceso. Retorna False si lo ha perdido."""
+    return bool(PeriodicJobState.objects.filter(
+        name=name, owner=PROCESS_ID, lease_until__isnull=False
+    ).update(lease_until=timezone.now() + timedelta(seconds=timeout)))
+
+
+def _latido(name, timeout, parar):
+    """Thread de heartbeat: renueva el lease de un job en marcha hasta que se activa `parar`."""
+    from django.db import connection
+
+    try:
+        while not parar.wait(timeout / 3):
+            if not renovar_lease(name, timeout):
+                logger.warning(f"Job periodico '{name}': lease perdido mientras se ejecutaba")
+                return
+    except Exception as e:
+        logger.error(f"Error renovando el lease del job '{name}': {str(e)}", exc_info=True)
+    finally:
+        connection.close()
+
+
+class Scheduler:
+    """Ejecuta en un solo thread los jobs periodicos registrados."""
+    def __init__(self, jobs, executor=None):
+        self.jobs = {job.name: job for job in jobs}
+        self.executor = executor
+        self._forzados = set()
+
+    def trigger(self, *names):
+        """Pide ejecutar estos jobs en la siguiente pasada aunque no hayan vencido."""
+        self._forzados.update(names)
+
+    def run_job(self, name, force=False):
+        """
+        Ejecuta un job si ha vencido (o force) y ningun otro proceso lo tiene.
+        Retorna True si se ejecuto.
+        """
+        job = self.jobs[name]
+        now = timezone.now()
+        PeriodicJobState.objects.get_or_create(
+            name=name, defaults={'next_run_at': now if job.interval else job.next_run(now)}
+        )
+
+        # Reclamar la fila = candado entre procesos + comprobacion de vencimiento en un UPDATE
+        vencido = Q() if force else Q(next_run_at__lte=now)
+        reclamado = PeriodicJobState.objects.filter(
+            vencido, Q(lease_until__isnull=True) | Q(lease_until__lt=now), name=name
+        ).update(lease_until=now + timedelta(seconds=job.timeout), owner=PROCESS_ID, last_started_at=now)
+        if not reclamado:
+            return False
+
+        inicio = time.monotonic()
+        estado, error, queda_trabajo = 'ok', '', False
+        parar = threading.Event()
+        latido = threading.Thread(
+            target=_latido, args=(name, job.timeout, parar), name=f"lease_{name}", daemon=True
+        )
+        latido.start()
+        try:
+            with prioridad(job.priority):
+                queda_trabajo = job.func(self.executor) is True
+        except Exception as e:
+            estado, error = 'error', str(e)[:500]
+            logger.error(f"Error en job periodico '{name}': {str(e)}", exc_info=True)
+        finally:
+            parar.set()
+            latido.join()
+
+        fin = timezone.now()
+        # Solo si el lease sigue siendo nuestro: no pisar el de otro proceso
+        PeriodicJobState.objects.filter(name=name, owner=PROCESS_ID).update(
+            lease_until=None,
+            next_run_at=fin if queda_trabajo else job.next_run(fin),
+            last_finished_at=fin,
+            last_duration_ms=int((time.monotonic() - inicio) * 1000),
+            last_status=estado,
+            last_error=error,
+            run_count=F('run_count') + 1,
+        )
+        return True
+
+    def run_due(self):
+        """Ejecuta los jobs vencidos o forzados. Retorna los segundos hasta el siguiente vencimiento."""
+        forzados, self._forzados = self._forzados, set()
+        for name in self.jobs:
+            try:
+                self.run_job(name, force=name in forzados)
+            except Exception as e:
+                logger.error(f"Error planificando job '{name}': {str(e)}", exc_info=True)
+
+        proximo = PeriodicJobState.objects.filter(name__in=list(self.jobs)).aggregate(
+            proximo=Min('next_run_at')
+        )['proximo']
+        if proximo is None:
+            return MAX_WAIT_SECONDS
+        return min(MAX_WAIT_SECONDS, max(0.0, (proximo - timezone.now()).total_seconds()))
+
+    def run_forever(self, stop_event, wakeup=None):
+        """Loop del scheduler hasta stop_event. Con wakeup, NOTIFY adelanta los jobs wake_on_notify."""
+        from django.db import close_old_connections
+
+        while not stop_event.is_set():
+            close_old_connections()
+            espera = self.run_due()
+            if espera <= 0:
+                continue  # Hay jobs con trabajo pendiente: siguiente pasada sin esperar
+            if wakeup is not None:
+                notificado = wakeup.wait(espera, stop_event=stop_event)
+            else:
+                notificado = False
+                stop_event.wait(espera)
+            if notificado:
+                self.trigger(*[name for name, job in self.jobs.items() if job.wake_on_notify])
+
+
+def default_jobs():
+    """Jobs periodicos de la aplicacion (compartidos por el thread in-process y run_sync_worker)."""
+    from django.conf import settings
+    from .priority import BACKFILL
+    from .sync_worker import run_worker_cycle, reap_expired_leases, SYNC_INTERVAL
+    from .tasks import actualizar_zonas_agencias, encolar_reconciliaciones
+    from .utils import refresh_expiring_tokens
+
+    return [
+        PeriodicJob(
+            'sync_cycle', run_worker_cycle, interval=SYNC_INTERVAL,
+            timeout=SYNC_INTERVAL * 2 + 60, priority=BACKFILL, wake_on_notify=True,
+        ),
+        PeriodicJob(
+            'lease_reaper', lambda executor: reap_expired_leases(),
+            interval=settings.SYNC_REAPER_INTERVAL_SECONDS,
+        ),
+        PeriodicJob(
+            'token_refresher',
+            # Margen de dos intervalos: ningun token caduca entre dos pasadas
+            lambda executor: refresh_expiring_tokens(settings.TOKEN_REFRESH_INTERVAL_SECONDS * 2),
+            interval=settings.TOKEN_REFRESH_INTERVAL_SECONDS,
+        ),
+        PeriodicJob(
+            'zonas_push', lambda executor: actualizar_zonas_agencias(),
+            cron=settings.ZONAS_PUSH_CRON, jitter=5,
+        ),
+        PeriodicJob(
+            'reconciliation', lambda executor: encolar_reconciliaciones(),
+            cron=settings.RECONCILE_CRON, jitter=5,
+        ),
+    ]
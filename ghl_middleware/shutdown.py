@@ -0,0 +1,128 @@
+"""
+Apagado ordenado del proceso: un redeploy no debe perder trabajo de sincronizacion.
+
+Lo invocan el hook worker_exit de gunicorn (gunicorn.conf.py), el comando run_sync_worker
+y, como red de seguridad, atexit. El protocolo es:
+1. Dejar de admitir trabajo: se para el scheduler, los drenadores del outbox y las lanes
+   del sync worker dejan de empezar registros nuevos.
+2. Persistir lo que solo vive en memoria: los webhooks agrupados en la ventana pasan al outbox.
+3. Esperar a lo que esta en vuelo (llamadas a GHL a medias) hasta GRACEFUL_SHUTDOWN_SECONDS.
+4. Devolver a la BD lo reclamado por este proceso que no ha terminado: los SyncJobs pierden
+   el lease y los registros en 'syncing' vuelven a 'pending', sin esperar a que caduquen.
+
+Lo reclamado se apunta aqui (registrar_en_vuelo) al reclamarlo y se borra al terminarlo.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Tipos de lo reclamado en vuelo
+SYNC_JOB = 'syncjob'
+CLIENTE = 'cliente'
+PROPIEDAD = 'propiedad'
+
+_lock = threading.Lock()
+_en_vuelo = defaultdict(set)
+_apagando = threading.Event()
+_apagado = False
+
+
+def registrar_en_vuelo(tipo, pks):
+    """Apunta registros o trabajos reclamados por este proceso."""
+    with _lock:
+        _en_vuelo[tipo].update(pks)
+
+
+def marcar_terminados(tipo, pks):
+    """Quita de la lista en vuelo lo que ya ha terminado (con exito o reprogramado)."""
+    with _lock:
+        _en_vuelo[tipo].difference_update(pks)
+
+
+def apagando():
+    """True en cuanto empieza el apagado: no hay que reclamar ni empezar trabajo nuevo."""
+    return _apagando.is_set()
+
+
+def solicitar_apagado():
+    """Paso 1 sin esperas: marca el proceso como apagandose (p.ej. desde un handler de SIGTERM)."""
+    _apagando.set()
+
+
+def devolver_reclamados():
+    """
+    Devuelve a la BD lo reclamado por este proceso que sigue sin terminar.
+    Retorna (trabajos, registros) devueltos.
+    """
+    from .models import SyncJob, Cliente, Propiedad
+
+    with _lock:
+        reclamados = {tipo: list(pks) for tipo, pks in _en_vuelo.items() if pks}
+        _en_vuelo.clear()
+
+    trabajos = registros = 0
+    if reclamados.get(SYNC_JOB):
+        from . import tasks  # noqa: F401  (registra los merges de cada tipo)
+        from .outbox import liberar_trabajo
+
+        # Sin lease el trabajo vuelve a estar disponible ya para otro proceso
+        for job in SyncJob.objects.filter(pk__in=reclamados[SYNC_JOB], lease_until__isnull=False):
+            liberar_trabajo(job)
+            trabajos += 1
+    for tipo, model in ((CLIENTE, Cliente), (PROPIEDAD, Propiedad)):
+        if reclamados.get(tipo):
+            registros += model.objects.filter(pk__in=reclamados[tipo], sync_status='syncing').update(
+                sync_status='pending', sync_lease_until=None
+            )
+    return trabajos, registros
+
+
+def graceful_shutdown(timeout=None):
+    """
+    Ejecuta el protocolo de apagado completo. Idempotente: solo la primera llamada hace algo.
+    timeout: segundos para el trabajo en vuelo (por defecto GRACEFUL_SHUTDOWN_SECONDS).
+    """
+    global _apagado
+    from django.conf import settings
+    from .background import runner
+    from .sync_worker import stop_sync_loop, join_sync_loop
+    from .tasks import persistir_webhooks_agrupados
+
+    with _lock:
+        if _apagado:
+            return
+        _apagado = True
+
+    timeout = settings.GRACEFUL_SHUTDOWN_SECONDS if timeout is None else timeout
+    limite = time.monotonic() + timeout
+    solicitar_apagado()
+    stop_sync_loop()
+
+    try:
+        persistidos = persistir_webhooks_agrupados()
+    except Exception as e:
+        persistidos = 0
+        logger.error(f"Apagado: error persistiendo webhooks agrupados: {str(e)}", exc_info=True)
+
+    # El runner deja de admitir trabajos y termina lo que ya tenia, hasta el limite
+    runner.shutdown(wait=False)
+    terminado = runner.join(timeout=max(0.0, limite - time.monotonic()))
+    join_sync_loop(timeout=max(0.0, limite - time.monotonic()))
+    if not terminado:
+        # Lo que sigue en cola son syncs ya persistidos (outbox/registros): se descarta
+        # y lo reclamado se devuelve abajo
+        runner.shutdown(wait=False, cancel_pending=True)
+
+    try:
+        trabajos, registros = devolver_reclamados()
+    except Exception as e:
+        trabajos = registros = 0
+        logger.error(f"Apagado: error devolviendo trabajo reclamado: {str(e)}", exc_info=True)
+
+    logger.info(
+        f"Apagado ordenado: {persistidos} webhooks agrupados al outbox, {trabajos} trabajos y "
+        f"{registros} registros devueltos a pendiente{'' if terminado else ' (limite de espera alcanzado)'}"
+    )
@@ -1,13 +1,17 @@
 import logging
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Cliente, Propiedad
+from . import versions
+from .models import Cliente, Propiedad, Zona, Municipio, Provincia
 
 logger = logging.getLogger(__name__)
 
 # Campos internos del sistema de sync: un save que solo toca estos campos NO debe
 # relanzar el sync (evita bucle infinito).
-_INTERNAL_SYNC_FIELDS = {'sync_status', 'sync_error', 'ghl_contact_id'}
+_INTERNAL_SYNC_FIELDS = {
+    'sync_status', 'sync_error', 'sync_lease_until',
+    'sync_attempt_count', 'sync_next_attempt_at', 'ghl_contact_id',
+}
 
 
 @receiver(post_save, sender=Cliente)
@@ -28,12 +32,12 @@ def sync_cliente_to_ghl(sender, instance, created, **kwargs):
     if not instance.ghl_contact_id and instance.sync_status == 'pending':
         # CREATE: no existe aún en GHL
         logger.info(f"Signal: Cliente PK={instance.pk} sin ghl_contact_id, lanzando sync CREATE background")
-        sync_to_ghl_background(instance.pk, 'cliente', created=True)
+        sync_to_ghl_background(instance.pk, 'cliente', created=True, agencia_id=instance.agencia_id)
 
     elif not created and instance.ghl_contact_id:
         # UPDATE: ya existe en GHL, hay que actualizar
         logger.info(f"Signal: Cliente PK={instance.pk} actualizado, lanzando sync UPDATE background")
-        sync_to_ghl_background(instance.pk, 'cliente', created=False)
+        sync_to_ghl_background(instance.pk, 'cliente', created=False, agencia_id=instance.agencia_id)
 
 
 @receiver(post_save, sender=Propiedad)
@@ -54,9 +58,46 @@ def sync_propiedad_to_ghl(sender, instance, created, **kwargs):
     if not instance.ghl_contact_id and instance.sync_status == 'pending':
         # CREATE: no existe aún en GHL
         logger.info(f"Signal: Propiedad PK={instance.pk} sin ghl_contact_id, lanzando sync CREATE background")
-        sync_to_ghl_background(instance.pk, 'propiedad', created=True)
+        sync_to_ghl_background(instance.pk, 'propiedad', created=True, agencia_id=instance.agencia_id)
 
     elif not created and instance.ghl_contact_id:
         # UPDATE: ya existe en GHL, hay que actualizar
         logger.info(f"Signal: Propiedad PK={instance.pk} actualizada, lanzando sync UPDATE background")
-        sync_to_ghl_background(instance.pk, 'propiedad', created=False)
+        sync_to_ghl_background(instance.pk, 'propiedad', created=False, agencia_id=instance.agencia_id)
+
+
+@receiver(post_save, sender=Zona)
+@receiver(post_delete, sender=Zona)
+@receiver(post_save, sender=Municipio)
+@receiver(post_delete, sender=Municipio)
+@receiver(post_save, sender=Provincia)
+@receiver(post_delete, sender=Provincia)
+def invalidar_zonas(sender, **kwargs):
+    """Las copias en memoria de las zonas (zonas.py) dejan de valer en todos los procesos."""
+    versions.incrementar(versions.ZONAS)
+
+
+@receiver(post_save, sender=Propiedad)
+@receiver(post_delete, sender=Propiedad)
+def invalidar_propiedades_agencia(sender, instance, **kwargs):
+    """Los listados cacheados de la agencia (ubicaciones en uso) dejan de valer."""
+    update_fields = kwargs.get('update_fields')
+    # ghl_contact_id es interno para el sync pero sale en los listados (ghl_id): si invalida
+    if update_fields and set(update_fields) <= _INTERNAL_SYNC_FIELDS - {'ghl_contact_id'}:
+        return
+    versions.incrementar(versions.propiedades(instance.agencia_id))
+
+
+@receiver(m2m_changed, sender=Propiedad.zonas.through)
+def invalidar_zonas_de_propiedad(sender, instance, action, reverse, pk_set, **kwargs):
+    """Cambio de las zonas de una propiedad (o de las propiedades de una zona)."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        versions.incrementar(versions.propiedades(instance.agencia_id))
+    elif pk_set:
+        for agencia_id in Propiedad.objects.filter(pk__in=pk_set).values_list('agencia_id', flat=True).distinct():
+            versions.incrementar(versions.propiedades(agencia_id))
+    else:
+        # zona.propiedades.clear(): sin la lista de propiedades, se invalida todo lo de zonas
+        versions.incrementar(versions.ZONAS)
@@ -1,16 +1,26 @@
 """
 Worker automatico que sincroniza registros locales con GHL cada N segundos.
-Corre como thread daemon dentro del proceso web (no requiere servicio extra en Railway).
+Corre como thread daemon dentro del proceso web (no requiere servicio extra en Railway)
+o como proceso dedicado con `python manage.py run_sync_worker`.
+
+El ciclo de sync es un job mas del scheduler periodico (scheduler.py), junto con el
+reaper de leases y el refresco de tokens: un solo thread para todas las tareas periodicas.
+Con varios procesos (gunicorn workers + run_sync_worker) el ciclo lo ejecuta uno solo a la
+vez: el que tiene el lease de 'sync_cycle' en PeriodicJobState, renovado mientras corre.
 """
 import os
-import time
 import logging
 import threading
 
 logger = logging.getLogger(__name__)
 
 _worker_started = False
+_worker_thread = None
 _worker_lock = threading.Lock()
+_stop_event = threading.Event()
+
+# Tamaño de lote adaptativo (entre SYNC_BATCH_MIN y SYNC_BATCH_MAX segun el backlog)
+_batch_size = int(os.environ.get('SYNC_BATCH_MIN', 50))
 
 # Intervalo configurable via variable de entorno (default: 300 segundos = 5 minutos)
 SYNC_INTERVAL = int(os.environ.get('SYNC_INTERVAL_SECONDS', 300))
@@ -18,114 +28,335 @@ SYNC_INTERVAL = int(os.environ.get('SYNC_INTERVAL_SECONDS', 300))
 
 def _sync_loop():
     """
-    Loop principal del worker. Busca registros pendientes y los sincroniza con GHL.
-    Corre indefinidamente como thread daemon.
+    Loop principal del thread in-process: ejecuta el scheduler de jobs periodicos
+    hasta que se llame a stop_sync_loop. Con varios gunicorn workers cada job se
+    ejecuta en un solo proceso a la vez (candado por job en PeriodicJobState).
     """
     # Esperar 30 segundos al arrancar para dar tiempo a que la app se inicialice
-    time.sleep(30)
+    if _stop_event.wait(30):
+        return
     logger.info(f"Sync worker iniciado. Intervalo: {SYNC_INTERVAL}s")
 
-    while True:
-        try:
-            _run_sync_cycle()
-        except Exception as e:
-            logger.error(f"Error en ciclo de sync worker: {str(e)}", exc_info=True)
+    from .scheduler import Scheduler, default_jobs
+    from .wakeup import SyncWakeup
 
-        time.sleep(SYNC_INTERVAL)
+    # Despierta en cuanto se notifica trabajo nuevo; el intervalo es solo la red de seguridad
+    wakeup = SyncWakeup()
+    try:
+        Scheduler(default_jobs()).run_forever(_stop_event, wakeup=wakeup)
+    finally:
+        wakeup.close()
 
 
-def _run_sync_cycle():
+def run_worker_cycle(executor=None):
     """
-    Ejecuta un ciclo de sincronizacion con candados de BD (Database Locking).
-    Preparado para multiples workers concurrentes (Enterprise).
+    Un ciclo completo del worker: registros pendientes y trabajos del outbox.
+    Compartido por el thread in-process y por el comando run_sync_worker.
+    Retorna True si queda backlog (registros o trabajos) y conviene repetir sin esperar.
+    El outbox se drena como mucho SYNC_CYCLE_OUTBOX_BATCHES lotes por ciclo: el ciclo
+    tiene una duracion acotada y el resto se recoge en la siguiente pasada.
+    """
+    from django.conf import settings
+
+    hay_mas = False
+    try:
+        hay_mas = _run_sync_cycle(executor=executor)
+    except Exception as e:
+        logger.error(f"Error en ciclo de sync worker: {str(e)}", exc_info=True)
+
+    # Recoger trabajos del outbox que quedaron pendientes (redeploys, procesos caidos)
+    try:
+        from .outbox import drain_outbox
+        lotes = settings.SYNC_CYCLE_OUTBOX_BATCHES
+        if drain_outbox(executor=executor, max_batches=lotes) >= lotes * settings.OUTBOX_BATCH_SIZE:
+            hay_mas = True
+    except Exception as e:
+        logger.error(f"Error drenando outbox en sync worker: {str(e)}", exc_info=True)
+
+    return hay_mas
+
+
+def reap_expired_leases():
+    """
+    Devuelve a 'pending' los registros en 'syncing' cuyo lease ha caducado
+    (el proceso que los reclamo murio a mitad). Un UPDATE en bloque por modelo.
+    Los 'syncing' sin lease son anteriores a los leases y se tratan como caducados.
     """
     from django.db.models import Q
-    from django.db import transaction  # <-- Importamos el control de transacciones
+    from django.utils import timezone
     from .models import Cliente, Propiedad
-    from .utils import sync_record_to_ghl, rate_limit_wait
 
-    sync_filter = Q(sync_status='pending') | Q(ghl_contact_id__isnull=True) | Q(ghl_contact_id='')
+    caducado = Q(sync_lease_until__lt=timezone.now()) | Q(sync_lease_until__isnull=True)
+    liberados = 0
+    for model in (Cliente, Propiedad):
+        liberados += model.objects.filter(caducado, sync_status='syncing').update(
+            sync_status='pending', sync_lease_until=None
+        )
+    if liberados:
+        logger.warning(f"Reaper: {liberados} registros con lease caducado devueltos a 'pending'")
+    return liberados
+
 
-    # Contar pendientes para los logs (esto no bloquea la base de datos)
-    clientes_pendientes = Cliente.objects.filter(sync_filter, agencia__active=True).count()
-    propiedades_pendientes = Propiedad.objects.filter(sync_filter, agencia__active=True).count()
+def pending_sync_filter():
+    """
+    Filtro de los registros que el worker debe sincronizar: pendientes y errores cuyo
+    reintento ya ha vencido (indice sync_status + sync_next_attempt_at). Los 'dead' no entran.
+    """
+    from django.db.models import Q
+    from django.utils import timezone
 
-    if clientes_pendientes == 0 and propiedades_pendientes == 0:
-        return  # Nada que hacer
+    # 'synced' sin ghl_contact_id: estado inconsistente (p.ej. insercion SQL), hay que crearlo en GHL
+    sin_id = Q(ghl_contact_id__isnull=True) | Q(ghl_contact_id='')
+    return (
+        Q(sync_status='pending')
+        | Q(sync_status='error', sync_next_attempt_at__lte=timezone.now())
+        | (sin_id & Q(sync_status='synced'))
+    )
 
-    logger.info(f"Sync worker detectó: {clientes_pendientes} clientes y {propiedades_pendientes} propiedades pendientes")
 
-    # --- 1. PROCESAR CLIENTES CON CANDADO (LOCK) ---
-    cliente_ids_to_process = []
-    
+def _claim_pending(model, limit):
+    """
+    Reclama hasta `limit` registros pendientes con candado de BD (SKIP LOCKED)
+    y los marca como 'syncing'. Retorna [(pk, agencia_id), ...].
+
+    El lote se reparte entre agencias por round-robin ponderado (fairness.py):
+    una agencia con 20k pendientes no deja sin hueco a las demas.
+    """
+    from django.db import transaction
+    from .fairness import repartir_cuotas, pesos_agencias, profundidad_por_agencia
+    from .shutdown import registrar_en_vuelo
+    from .utils import sync_lease_deadline
+
+    pendientes = model.objects.filter(pending_sync_filter(), agencia__active=True)
+    profundidades = profundidad_por_agencia(pendientes)
+    if not profundidades:
+        return []
+    cuotas = repartir_cuotas(profundidades, limit, pesos_agencias(profundidades))
+
     # Abrimos una transacción rápida para poner el candado
+    claimed = []
     with transaction.atomic():
-        # skip_locked=True es la magia: ignora los que otro worker ya haya agarrado
-        clientes_locked = Cliente.objects.select_for_update(skip_locked=True).filter(
-            sync_filter, agencia__active=True
-        )[:50]
-        
-        for c in clientes_locked:
-            cliente_ids_to_process.append(c.pk)
-        
+        for agencia_id, cuota in cuotas.items():
+            # skip_locked=True es la magia: ignora los que otro worker ya haya agarrado
+            claimed += list(
+                pendientes.select_for_update(skip_locked=True)
+                .filter(agencia_id=agencia_id)
+                .values_list('pk', 'agencia_id')[:cuota]
+            )
+
         # Los marcamos rapidísimo como 'syncing' para liberar la BD
-        if cliente_ids_to_process:
-            Cliente.objects.filter(pk__in=cliente_ids_to_process).update(sync_status='syncing')
-
-    # Ahora los enviamos a GHL con calma, fuera del candado de la BD para no saturar
-    clientes_ok = 0
-    if cliente_ids_to_process:
-        clientes = Cliente.objects.filter(pk__in=cliente_ids_to_process).select_related('agencia')
-        for cliente in clientes:
-            is_new = not bool(cliente.ghl_contact_id)
-            if sync_record_to_ghl(cliente, 'cliente', created=is_new):
-                clientes_ok += 1
-            rate_limit_wait(default_wait=0.3)
-
-    # --- 2. PROCESAR PROPIEDADES CON CANDADO (LOCK) ---
-    propiedad_ids_to_process = []
-    
-    with transaction.atomic():
-        propiedades_locked = Propiedad.objects.select_for_update(skip_locked=True).filter(
-            sync_filter, agencia__active=True
-        )[:50]
-        
-        for p in propiedades_locked:
-            propiedad_ids_to_process.append(p.pk)
-        
-        if propiedad_ids_to_process:
-            Propiedad.objects.filter(pk__in=propiedad_ids_to_process).update(sync_status='syncing')
-
-    propiedades_ok = 0
-    if propiedad_ids_to_process:
-        propiedades = Propiedad.objects.filter(pk__in=propiedad_ids_to_process).select_related('agencia')
-        for propiedad in propiedades:
-            is_new = not bool(propiedad.ghl_contact_id)
-            if sync_record_to_ghl(propiedad, 'propiedad', created=is_new):
-                propiedades_ok += 1
-            rate_limit_wait(default_wait=0.3)
-
-    # Log de resumen solo si realmente se procesó algo
-    if cliente_ids_to_process or propiedad_ids_to_process:
-        logger.info(
-            f"Sync worker completado: "
-            f"Clientes {clientes_ok}/{len(cliente_ids_to_process)} | "
-            f"Propiedades {propiedades_ok}/{len(propiedad_ids_to_process)}"
-        )
+        if claimed:
+            model.objects.filter(pk__in=[pk for pk, _ in claimed]).update(
+                sync_status='syncing', sync_lease_until=sync_lease_deadline()
+            )
+
+    # Si el proceso se apaga antes de sincronizarlos, se devuelven a 'pending' (shutdown.py)
+    registrar_en_vuelo(model._meta.model_name, [pk for pk, _ in claimed])
+    return claimed
+
+
+def _renovar_leases(reclamados):
+    """Heartbeat: alarga el lease de los registros reclamados ({model: pks}) que siguen en 'syncing'."""
+    from .utils import sync_lease_deadline
+
+    deadline = sync_lease_deadline()
+    for model, pks in reclamados.items():
+        if pks:
+            model.objects.filter(pk__in=pks, sync_status='syncing').update(sync_lease_until=deadline)
+
+
+def esperar_lanes(futures, reclamados):
+    """
+    Espera a las lanes de un lote y retorna cuantos registros salieron OK. Mientras tanto
+    renueva cada SYNC_LEASE_SECONDS / 3 el lease de todo el lote ({model: pks}): los
+    registros que esperan turno en una lane lenta no caducan ni los coge otro worker.
+    Compartido por el sync worker y el comando sync_to_ghl.
+    """
+    from concurrent.futures import wait
+    from django.conf import settings
+
+    pendientes = set(futures)
+    while pendientes:
+        _, pendientes = wait(pendientes, timeout=settings.SYNC_LEASE_SECONDS / 3)
+        if pendientes:
+            _renovar_leases(reclamados)
+
+    ok = 0
+    for future in futures:
+        try:
+            ok += future.result()
+        except Exception as e:
+            logger.error(f"Error en lane de sync: {str(e)}", exc_info=True)
+    return ok
+
+
+def _reafirmar_lease(record):
+    """
+    Vuelve a reclamar un registro justo antes de sincronizarlo: solo si sigue en 'syncing'
+    con el lease vigente. Si caduco (el reaper lo devolvio a 'pending' y quiza lo tiene otro
+    worker) retorna False y la lane lo salta.
+    """
+    from django.utils import timezone
+    from .utils import sync_lease_deadline
+
+    return bool(type(record).objects.filter(
+        pk=record.pk, sync_status='syncing', sync_lease_until__gte=timezone.now()
+    ).update(sync_lease_until=sync_lease_deadline()))
+
+
+def _sync_agency_lane(agencia, access_token, records):
+    """
+    Sincroniza secuencialmente una parte de los registros de una agencia. Retorna los OK.
+    Es trabajo masivo: corre con prioridad 'backfill' y deja margen de rate limit al interactivo.
+    Si el proceso se esta apagando no empieza registros nuevos (el apagado los devuelve a 'pending').
+    Los leases los renueva quien reparte el lote (esperar_lanes).
+    """
+    from django.db import connection
+    from .priority import prioridad, BACKFILL
+    from .shutdown import apagando, marcar_terminados
+    from .utils import sync_record_to_ghl
+
+    ok = 0
+    try:
+        with prioridad(BACKFILL):
+            for record_type, record in records:
+                if apagando():
+                    break
+                if not _reafirmar_lease(record):
+                    logger.warning(f"Lease perdido de {record_type} PK={record.pk}: lo salta esta lane")
+                    marcar_terminados(record_type, [record.pk])
+                    continue
+                record.agencia = agencia
+                is_new = not bool(record.ghl_contact_id)
+                if sync_record_to_ghl(record, record_type, created=is_new, access_token=access_token):
+                    ok += 1
+                marcar_terminados(record_type, [record.pk])
+    finally:
+        # Los threads del pool no pasan por el ciclo request/response de Django
+        connection.close()
+    return ok
+
+
+def _sync_agency_group(agencia_id, cliente_pks, propiedad_pks, executor, per_agency=None):
+    """
+    Sincroniza los registros reclamados de UNA agencia: resuelve agencia y token una sola vez
+    y reparte el trabajo en como maximo `per_agency` (SYNC_PER_AGENCY_CONCURRENCY) lanes en paralelo.
+    Retorna una lista de futures (o de resultados si no hay executor).
+    """
+    from django.conf import settings
+    from .models import Agencia, Cliente, Propiedad
+    from .shutdown import marcar_terminados
+    from .utils import get_valid_token, aplazar_sin_token
+
+    agencia = Agencia.objects.get(pk=agencia_id)
+    access_token = get_valid_token(agencia.location_id)
+
+    if not access_token:
+        # Un solo UPDATE para todo el grupo en vez de un intento por registro
+        logger.error(f"No se pudo obtener token para la agencia {agencia_id}. {len(cliente_pks) + len(propiedad_pks)} registros a error")
+        for model, pks in ((Cliente, cliente_pks), (Propiedad, propiedad_pks)):
+            aplazar_sin_token(model, pks)
+            marcar_terminados(model._meta.model_name, pks)
+        return []
+
+    # Clientes primero para que el matching de las propiedades ya los encuentre en GHL
+    records = [('cliente', c) for c in Cliente.objects.filter(pk__in=cliente_pks)]
+    records += [('propiedad', p) for p in Propiedad.objects.filter(pk__in=propiedad_pks)]
+
+    lanes = max(1, min(per_agency or settings.SYNC_PER_AGENCY_CONCURRENCY, len(records)))
+    chunks = [records[i::lanes] for i in range(lanes)]
+    return [executor.submit(_sync_agency_lane, agencia, access_token, chunk) for chunk in chunks]
+
+
+def _run_sync_cycle(executor=None):
+    """
+    Ejecuta un ciclo de sincronizacion con candados de BD (Database Locking).
+    Preparado para multiples workers concurrentes (Enterprise).
+
+    El lote reclamado se agrupa por agencia y los grupos se procesan en paralelo.
+    El tamaño del lote se adapta al backlog: crece mientras los lotes salen llenos.
+    Retorna True si probablemente queda mas trabajo pendiente.
+    """
+    global _batch_size
+    from collections import defaultdict
+    from concurrent.futures import ThreadPoolExecutor
+    from django.conf import settings
+    from .models import Cliente, Propiedad
+
+    batch_size = _batch_size
+    clientes = _claim_pending(Cliente, batch_size)
+    propiedades = _claim_pending(Propiedad, batch_size)
+
+    lote_lleno = len(clientes) >= batch_size or len(propiedades) >= batch_size
+    if lote_lleno:
+        _batch_size = min(batch_size * 2, settings.SYNC_BATCH_MAX)
+    else:
+        _batch_size = max(settings.SYNC_BATCH_MIN, batch_size // 2)
+
+    if not clientes and not propiedades:
+        return False  # Nada que hacer
+
+    grupos = defaultdict(lambda: ([], []))
+    for pk, agencia_id in clientes:
+        grupos[agencia_id][0].append(pk)
+    for pk, agencia_id in propiedades:
+        grupos[agencia_id][1].append(pk)
+
+    logger.info(
+        f"Sync worker reclamó {len(clientes)} clientes y {len(propiedades)} propiedades "
+        f"de {len(grupos)} agencias (lote {batch_size})"
+    )
+
+    pool = executor or ThreadPoolExecutor(
+        max_workers=settings.SYNC_WORKER_CONCURRENCY, thread_name_prefix="ghl_cycle_"
+    )
+    try:
+        futures = []
+        for agencia_id, (cliente_pks, propiedad_pks) in grupos.items():
+            try:
+                futures += _sync_agency_group(agencia_id, cliente_pks, propiedad_pks, pool)
+            except Exception as e:
+                logger.error(f"Error preparando sync de la agencia {agencia_id}: {str(e)}", exc_info=True)
+
+        ok = esperar_lanes(futures, {
+            Cliente: [pk for pk, _ in clientes], Propiedad: [pk for pk, _ in propiedades],
+        })
+    finally:
+        if executor is None:
+            pool.shutdown(wait=True)
+
+    logger.info(f"Sync worker completado: {ok}/{len(clientes) + len(propiedades)} registros OK")
+    return lote_lleno
+
 
 def start_sync_loop():
     """
     Arranca el worker de sync como thread daemon.
     Solo arranca una vez (protegido con lock para gunicorn multi-worker).
     """
-    global _worker_started
+    global _worker_started, _worker_thread
 
     with _worker_lock:
         if _worker_started:
             return
         _worker_started = True
 
-    thread = threading.Thread(target=_sync_loop, name="ghl_sync_worker", daemon=True)
-    thread.start()
+    _worker_thread = threading.Thread(target=_sync_loop, name="ghl_sync_worker", daemon=True)
+    _worker_thread.start()
     logger.info("Sync worker thread lanzado")
 
+
+def stop_sync_loop():
+    """Pide al thread del worker que termine tras el ciclo en curso."""
+    from .wakeup import interrupt_waiters
+
+    _stop_event.set()
+    interrupt_waiters()
+
+
+def join_sync_loop(timeout=None):
+    """Espera a que el thread del worker termine el job en curso. Retorna True si ha terminado."""
+    if _worker_thread is None:
+        return True
+    _worker_thread.join(timeout)
+    return not _worker_thread.is_alive()
@@ -1,140 +1,416 @@
+import hashlib
+import json
 import logging
-import atexit
-from concurrent.futures import ThreadPoolExecutor
-from .utils import ghl_associate_records, ghl_get_current_associations, ghl_delete_association, ghlActualizarZonaAPI, get_valid_token
-from .models import Zona, Agencia, GHLToken
+from django.conf import settings
+from .utils import (
+    ghl_associate_records, ghl_get_current_associations, ghl_delete_association,
+    ghlActualizarZonaAPI, get_valid_token, CoalescingWindow
+)
+from .models import Zona, Agencia, SyncJob
+from .outbox import enqueue_job, job_handler
+from .priority import WEBHOOK, BACKFILL, MAINTENANCE
 
 
 logger = logging.getLogger(__name__)
 
-# Pool de hilos global con limite de workers
-_executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix="ghl_sync_")
 
-# Registrar shutdown automatico al apagar el proceso
-atexit.register(lambda: _executor.shutdown(wait=False))
-
-
-def sync_associations_background(access_token, location_id, origin_record_id, target_ids_list, association_id_val, origin_is_contact=False):
+def sync_associations_background(access_token, location_id, origin_record_id, target_ids_list, association_id_val, origin_is_contact=False, priority=None,
+                                 dedupe_key=None):
     """
-    Sincroniza asociaciones en background usando ThreadPoolExecutor.
+    Encola en el outbox la sincronizacion de asociaciones de un registro.
     origin_is_contact=True implica que origin_record_id es el Contacto y target_ids_list son Propiedades.
+    El access_token no se persiste: el handler obtiene uno valido al ejecutarse.
+    priority: clase de prioridad; por defecto la del thread (hereda la del sync que la origina).
+    dedupe_key: si ya hay un trabajo pendiente con la misma clave, se sustituye su lista de destinos.
     """
-    def _worker_process():
-        try:
-            current_map = ghl_get_current_associations(access_token, location_id, origin_record_id)
-            current_ids = set(current_map.keys())
-            target_ids = set(target_ids_list)
-
-            ids_to_add = target_ids - current_ids
-            ids_to_remove = current_ids - target_ids
-
-            logger.info(f"Sync {'Cliente' if origin_is_contact else 'Propiedad'} {origin_record_id}: +{len(ids_to_add)} | -{len(ids_to_remove)}")
-
-            for target_id in ids_to_remove:
-                rel_info = current_map.get(target_id)
-                if rel_info and rel_info.get('id'):
-                    ghl_delete_association(access_token, location_id, rel_info.get('id'))
-
-            for target_id in ids_to_add:
-                if origin_is_contact:
-                    # Origin es Cliente (contact_id), Target es Propiedad (property_id)
-                    ghl_associate_records(access_token, location_id, target_id, origin_record_id, association_id_val)
-                else:
-                    # Origin es Propiedad (property_id), Target es Cliente (contact_id)
-                    ghl_associate_records(access_token, location_id, origin_record_id, target_id, association_id_val)
+    payload = {
+        'location_id': location_id,
+        'origin_record_id': origin_record_id,
+        'target_ids': list(target_ids_list),
+        'association_id': association_id_val,
+        'origin_is_contact': origin_is_contact,
+    }
+    enqueue_job(SyncJob.JobType.SYNC_ASSOCIATIONS, payload, agencia_id=location_id, priority=priority, dedupe_key=dedupe_key)
+
+
+@job_handler(SyncJob.JobType.SYNC_ASSOCIATIONS)
+def _run_sync_associations(payload):
+    """
+    Handler del outbox: calcula el diff de asociaciones contra GHL y lo aplica.
+    Es idempotente; si alguna llamada falla se lanza excepcion para reintentar el trabajo.
+    """
+    location_id = payload['location_id']
+    origin_record_id = payload['origin_record_id']
+    association_id_val = payload['association_id']
+    origin_is_contact = payload.get('origin_is_contact', False)
+
+    access_token = get_valid_token(location_id)
+    if not access_token:
+        raise Exception(f"No se pudo obtener token para asociaciones de {origin_record_id}")
+
+    current_map = ghl_get_current_associations(access_token, location_id, origin_record_id)
+    if current_map is None:
+        raise Exception(f"No se pudieron leer las asociaciones actuales de {origin_record_id}")
+    current_ids = set(current_map.keys())
+    target_ids = set(payload.get('target_ids', []))
+
+    ids_to_add = target_ids - current_ids
+    ids_to_remove = current_ids - target_ids
+
+    logger.info(f"Sync {'Cliente' if origin_is_contact else 'Propiedad'} {origin_record_id}: +{len(ids_to_add)} | -{len(ids_to_remove)}")
+
+    fallos = 0
+    for target_id in ids_to_remove:
+        rel_info = current_map.get(target_id)
+        if rel_info and rel_info.get('id'):
+            if not ghl_delete_association(access_token, location_id, rel_info.get('id')):
+                fallos += 1
+
+    for target_id in ids_to_add:
+        if origin_is_contact:
+            # Origin es Cliente (contact_id), Target es Propiedad (property_id)
+            ok = ghl_associate_records(access_token, location_id, target_id, origin_record_id, association_id_val)
+        else:
+            # Origin es Propiedad (property_id), Target es Cliente (contact_id)
+            ok = ghl_associate_records(access_token, location_id, origin_record_id, target_id, association_id_val)
+        if not ok:
+            fallos += 1
+
+    if fallos:
+        raise Exception(f"{fallos} operaciones de asociacion fallidas para {origin_record_id}")
+
+
+def opciones_zonas():
+    """Opciones de los custom fields de zona en GHL: (Propiedad, Contacto)."""
+    opciones_propiedad = []
+    opciones_cliente = []
+    for key, label in Zona.objects.order_by('pk').values_list('key', 'label'):
+        # Los nombres de abajo han de ser así. No estan mal puestos.
+        opciones_propiedad.append({
+            "key": key,
+            "label": label
+        })
+        opciones_cliente.append(label)
+    return opciones_propiedad, opciones_cliente
+
+
+def _hash_zonas(agencia, opciones_hash):
+    """Hash de lo que se enviaria a la agencia: opciones + IDs de sus custom fields de zona."""
+    contenido = f"{opciones_hash}:{agencia.ghl_custom_field_propiedad_zona}:{agencia.ghl_custom_field_cliente_zona}"
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def actualizar_zonas_agencias(location_ids=None):
+    """
+    Envia a GHL las opciones de zona de las agencias activas (o solo de location_ids).
+    Lee los IDs de campos personalizados desde el modelo Agencia (dinamico, sin hardcodear).
 
+    Solo se envia a las agencias cuyo hash (Agencia.zonas_hash) no coincide con el de las
+    opciones actuales, con ZONAS_PUSH_CONCURRENCY agencias en paralelo. El hash se guarda
+    cuando los dos PUTs salen bien: una agencia fallida se reintenta en el siguiente push.
+    Retorna (enviadas, fallidas).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from .priority import current_priority, prioridad
+
+    opciones_propiedad, opciones_cliente = opciones_zonas()
+    opciones_hash = hashlib.sha256(
+        json.dumps([opciones_propiedad, opciones_cliente], sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+    agencias = Agencia.objects.filter(active=True)
+    if location_ids is not None:
+        agencias = agencias.filter(location_id__in=location_ids)
+    pendientes = []
+    for agencia in agencias:
+        # Saltar agencias que no tienen IDs de campos personalizados configurados
+        if not agencia.ghl_custom_field_propiedad_zona or not agencia.ghl_custom_field_cliente_zona:
+            logger.warning(f"Agencia {agencia.location_id} no tiene custom field IDs de zona configurados. Saltando.")
+            continue
+        nuevo_hash = _hash_zonas(agencia, opciones_hash)
+        if agencia.zonas_hash != nuevo_hash:
+            pendientes.append((agencia, nuevo_hash))
+    if not pendientes:
+        return 0, 0
+
+    clase = current_priority()
+
+    def _enviar(agencia):
+        from django.db import connection
+
+        location_id = agencia.location_id
+        try:
+            with prioridad(clase):
+                token = get_valid_token(location_id)
+                if not token:
+                    logger.warning(f"No se pudo obtener token válido para agencia {location_id}")
+                    return False
+
+                url_propiedad = f"https://services.leadconnectorhq.com/custom-fields/{agencia.ghl_custom_field_propiedad_zona}/"
+                url_cliente = f"https://services.leadconnectorhq.com/locations/{location_id}/customFields/{agencia.ghl_custom_field_cliente_zona}/"
+
+                ok_propiedad = ghlActualizarZonaAPI(location_id, opciones_propiedad, token, url_propiedad, True)
+                ok_cliente = ghlActualizarZonaAPI(location_id, opciones_cliente, token, url_cliente, False)
+                return ok_propiedad is not None and ok_cliente is not None
         except Exception as e:
-            logger.error(f"Error en sync_associations para {origin_record_id}: {str(e)}", exc_info=True)
+            logger.error(f"Error actualizando zonas de la agencia {location_id}: {str(e)}", exc_info=True)
+            return False
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=settings.ZONAS_PUSH_CONCURRENCY, thread_name_prefix="ghl_zonas_") as pool:
+        resultados = list(pool.map(_enviar, [agencia for agencia, _ in pendientes]))
 
-    future = _executor.submit(_worker_process)
-    future.add_done_callback(lambda f: f.result() if not f.exception() else logger.error(f"Task failed: {f.exception()}"))
+    enviadas = 0
+    for (agencia, nuevo_hash), ok in zip(pendientes, resultados):
+        if ok:
+            Agencia.objects.filter(pk=agencia.pk).update(zonas_hash=nuevo_hash)
+            enviadas += 1
+    fallidas = len(pendientes) - enviadas
+    logger.info(f"Push de zonas: {enviadas} agencias actualizadas, {fallidas} fallidas")
+    return enviadas, fallidas
 
 
 def funcionAsyncronaZonas():
     """
-    Actualiza las zonas en GHL para todas las agencias.
-    Lee los IDs de campos personalizados desde el modelo Agencia (dinamico, sin hardcodear).
+    Actualiza las zonas en GHL para todas las agencias, en background.
+    Un solo trabajo pendiente en el outbox: dar de alta muchas zonas seguidas
+    produce un unico push por agencia cuando la rafaga termina.
     """
-    def actualizacion_zonas_agencias():
-        try:
-            opciones_propiedad = []
-            opciones_cliente = []
-            for zona in Zona.objects.select_related('municipio', 'municipio__provincia').all():
-                nombre_zona = zona.nombre
-                nombre_municipio = zona.municipio.nombre
-                nombre_provincia = zona.municipio.provincia.nombre
-
-                label = f"{nombre_zona} -- {nombre_municipio} -- {nombre_provincia}"
-                value = f"{nombre_zona}__{nombre_municipio}__{nombre_provincia}".lower().replace(" ", "_")
-
-                # Los nombres de abajo han de ser así. No estan mal puestos.
-                opciones_propiedad.append({
-                    "key": value,
-                    "label": label
-                })
-                opciones_cliente.append(label)
-
-            for agencia in Agencia.objects.filter(active=True):
-                location_id = agencia.location_id
-                if not location_id:
-                    continue
-
-                # Saltar agencias que no tienen IDs de campos personalizados configurados
-                if not agencia.ghl_custom_field_propiedad_zona or not agencia.ghl_custom_field_cliente_zona:
-                    logger.warning(f"Agencia {location_id} no tiene custom field IDs de zona configurados. Saltando.")
-                    continue
-
-                try:
-                    token = get_valid_token(location_id)
-                    if not token:
-                        logger.warning(f"No se pudo obtener token válido para agencia {location_id}")
-                        continue
-
-                    url_propiedad = f"https://services.leadconnectorhq.com/custom-fields/{agencia.ghl_custom_field_propiedad_zona}/"
-                    url_cliente = f"https://services.leadconnectorhq.com/locations/{location_id}/customFields/{agencia.ghl_custom_field_cliente_zona}/"
-
-                    ghlActualizarZonaAPI(location_id, opciones_propiedad, token, url_propiedad, True)
-                    ghlActualizarZonaAPI(location_id, opciones_cliente, token, url_cliente, False)
-
-                except Exception as e:
-                    logger.error(f"Error obteniendo token para agencia {location_id}: {str(e)}")
+    enqueue_job(
+        SyncJob.JobType.ZONAS_PUSH, {}, delay=settings.ZONAS_PUSH_DEBOUNCE_SECONDS,
+        dedupe_key="zonas_push", max_delay=settings.ZONAS_PUSH_DEBOUNCE_MAX_SECONDS,
+        priority=MAINTENANCE,
+    )
 
-        except Exception as e:
-            logger.error(f"Error actualizando zonas: {str(e)}", exc_info=True)
 
-    _executor.submit(actualizacion_zonas_agencias)
+@job_handler(SyncJob.JobType.ZONAS_PUSH)
+def _run_zonas_push(payload):
+    """Handler del outbox: push de zonas. Si alguna agencia falla se reintenta (solo las fallidas)."""
+    _, fallidas = actualizar_zonas_agencias()
+    if fallidas:
+        raise Exception(f"Push de zonas fallido en {fallidas} agencias")
 
 
-def sync_to_ghl_background(record_pk, record_type, created=True):
+def sync_to_ghl_background(record_pk, record_type, created=True, agencia_id=None, priority=WEBHOOK):
     """
-    Envia un registro local a GHL en background.
+    Encola en el outbox el envio de un registro local a GHL.
     Usado por Django signals cuando se crea o actualiza un registro via ORM sin ghl_contact_id.
 
     record_type: 'cliente' o 'propiedad'
     created: True si es un registro nuevo, False si es una actualizacion
+    priority: 'interactive' si hay un usuario esperando (dashboard); por defecto 'webhook'
     """
-    def _worker():
-        from .models import Cliente, Propiedad
-        from .utils import sync_record_to_ghl
+    payload = {'record_type': record_type, 'record_pk': record_pk, 'created': created}
+    # Un solo trabajo pendiente por registro: los saves seguidos se agrupan (debounce)
+    enqueue_job(
+        SyncJob.JobType.SYNC_RECORD, payload, agencia_id=agencia_id,
+        delay=settings.SIGNAL_DEBOUNCE_SECONDS,
+        dedupe_key=f"sync_record:{record_type}:{record_pk}",
+        max_delay=settings.SIGNAL_DEBOUNCE_MAX_SECONDS,
+        priority=priority,
+    )
 
-        try:
-            if record_type == 'cliente':
-                record = Cliente.objects.get(pk=record_pk)
-            else:
-                record = Propiedad.objects.get(pk=record_pk)
 
-            sync_record_to_ghl(record, record_type, created=created)
+def _merge_sync_record(previo, nuevo):
+    """Fusiona dos syncs del mismo registro: si alguno era un CREATE, el resultado tambien."""
+    return {**nuevo, 'created': bool(previo.get('created')) or bool(nuevo.get('created'))}
 
-        except (Cliente.DoesNotExist, Propiedad.DoesNotExist):
-            logger.error(f"Registro {record_type} PK={record_pk} no encontrado para sync")
-        except Exception as e:
-            logger.error(f"Error en sync background {record_type} PK={record_pk}: {str(e)}", exc_info=True)
 
-    future = _executor.submit(_worker)
-    future.add_done_callback(lambda f: f.result() if not f.exception() else logger.error(f"Sync task failed: {f.exception()}"))
+@job_handler(SyncJob.JobType.SYNC_RECORD, merge=_merge_sync_record)
+def _run_sync_record(payload):
+    """
+    Handler del outbox: sincroniza un Cliente o Propiedad con GHL.
+    Los fallos de GHL quedan reflejados en sync_status del registro, asi que
+    el trabajo se da por completado aunque sync_record_to_ghl devuelva False.
+    Si el registro esta en 'syncing' (lo tiene otro worker) se vuelve a encolar para dentro
+    de SYNC_RETRY_BASE_SECONDS: los cambios que trae este trabajo no se pierden.
+    """
+    from .models import Cliente, Propiedad
+    from .shutdown import registrar_en_vuelo, marcar_terminados
+    from .utils import sync_record_to_ghl, sync_lease_deadline
+
+    record_type = payload['record_type']
+    record_pk = payload['record_pk']
+    model = Cliente if record_type == 'cliente' else Propiedad
+
+    # Reclamar el registro: si el sync worker ya lo esta sincronizando, no duplicarlo en GHL
+    reclamado = model.objects.filter(pk=record_pk).exclude(sync_status='syncing').update(
+        sync_status='syncing', sync_lease_until=sync_lease_deadline()
+    )
+    if not reclamado:
+        agencia_id = model.objects.filter(pk=record_pk).values_list('agencia_id', flat=True).first()
+        if agencia_id is None:
+            logger.info(f"Registro {record_type} PK={record_pk} no encontrado. Saltando.")
+            return
+        logger.info(f"Registro {record_type} PK={record_pk} ya en sync. Se reintenta en {settings.SYNC_RETRY_BASE_SECONDS}s")
+        # Este trabajo aun tiene lease: el nuevo queda pendiente aparte (o se fusiona con otro)
+        enqueue_job(
+            SyncJob.JobType.SYNC_RECORD, payload, agencia_id=agencia_id,
+            delay=settings.SYNC_RETRY_BASE_SECONDS,
+            dedupe_key=f"sync_record:{record_type}:{record_pk}",
+        )
+        return
+
+    registrar_en_vuelo(record_type, [record_pk])
+    try:
+        record = model.objects.select_related('agencia').get(pk=record_pk)
+        # Si entre tanto el sync worker ya lo creo en GHL, el CREATE pasa a ser un UPDATE
+        created = payload.get('created', True) and not record.ghl_contact_id
+        sync_record_to_ghl(record, record_type, created=created)
+    finally:
+        marcar_terminados(record_type, [record_pk])
+
+
+def _procesar_webhook_cliente_agrupado(key, data):
+    """
+    Encola en el outbox el ultimo estado de una rafaga de webhooks de un mismo contacto.
+    Desde aqui el webhook es persistente: sobrevive a un redeploy aunque no se haya procesado.
+    """
+    location_id, ghl_contact_id = key
+    enqueue_job(
+        SyncJob.JobType.WEBHOOK_CLIENTE,
+        {'location_id': location_id, 'contact_id': ghl_contact_id, 'data': data},
+        agencia_id=location_id,
+        # Si ya hay uno pendiente del mismo contacto, el estado nuevo lo sustituye
+        dedupe_key=f"webhook_cliente:{location_id}:{ghl_contact_id}",
+        priority=WEBHOOK,
+    )
+
+
+@job_handler(SyncJob.JobType.WEBHOOK_CLIENTE)
+def _run_webhook_cliente(payload):
+    """Handler del outbox: aplica en la BD local un webhook de Cliente ya agrupado."""
+    from .webhook_handler import process_cliente_webhook
+
+    location_id, ghl_contact_id = payload['location_id'], payload['contact_id']
+    try:
+        agencia = Agencia.objects.get(location_id=location_id)
+    except Agencia.DoesNotExist:
+        logger.error(f"Agencia {location_id} no encontrada al procesar webhook agrupado de {ghl_contact_id}")
+        return
+
+    resultado = process_cliente_webhook(agencia, ghl_contact_id, payload['data'])
+    logger.info(f"Webhook Cliente {ghl_contact_id} procesado tras agrupar rafaga: {resultado}")
+
+
+# Ventana de agrupacion de webhooks de Cliente por (location_id, contact_id)
+_webhook_window = CoalescingWindow(on_flush=_procesar_webhook_cliente_agrupado)
+
+
+def encolar_webhook_cliente(location_id, ghl_contact_id, data):
+    """
+    Encola un webhook de Cliente en la ventana de agrupacion.
+    Los webhooks del mismo contacto que lleguen dentro de WEBHOOK_COALESCE_SECONDS
+    se fusionan y solo se procesa el ultimo (un matching y un diff de asociaciones por rafaga).
+    """
+    nueva = _webhook_window.submit(
+        (location_id, ghl_contact_id), dict(data), settings.WEBHOOK_COALESCE_SECONDS
+    )
+    if not nueva:
+        logger.info(f"Webhook Cliente {ghl_contact_id} agrupado con uno pendiente")
+
+
+def configurar_agencia_background(location_id):
+    """
+    Encola el setup inicial en GHL de una agencia recien instalada. El callback de OAuth
+    solo guarda los tokens y responde; el estado se consulta en Agencia.setup_status.
+    """
+    from .priority import INTERACTIVE
+
+    Agencia.objects.filter(location_id=location_id).update(
+        setup_status=Agencia.SetupStatus.PENDING, setup_error=''
+    )
+    enqueue_job(
+        SyncJob.JobType.SETUP_AGENCY, {'location_id': location_id}, agencia_id=location_id,
+        dedupe_key=f"setup_agency:{location_id}", priority=INTERACTIVE,
+    )
+
+
+@job_handler(SyncJob.JobType.SETUP_AGENCY)
+def _run_setup_agency(payload):
+    """
+    Handler del outbox: setup de la agencia en GHL. Si falla queda en 'error' y el outbox
+    lo reintenta. Cuando termina encola la importacion inicial y, ya fuera del camino
+    critico, envia las zonas y prueba la escritura con registros dummy.
+    """
+    from django.utils import timezone
+    from .utils import initialize_ghl_setup, probar_registros_dummy
+
+    location_id = payload['location_id']
+    agencia = Agencia.objects.get(location_id=location_id)
+    Agencia.objects.filter(pk=location_id).update(setup_status=Agencia.SetupStatus.RUNNING)
+    try:
+        access_token = get_valid_token(location_id)
+        if not access_token:
+            raise Exception(f"No se pudo obtener token para el setup de {location_id}")
+        if not initialize_ghl_setup(access_token, location_id, agencia):
+            raise Exception("No se encontro el Custom Object 'Propiedad' en GHL")
+    except Exception as e:
+        Agencia.objects.filter(pk=location_id).update(
+            setup_status=Agencia.SetupStatus.ERROR, setup_error=str(e)[:500]
+        )
+        raise
+
+    Agencia.objects.filter(pk=location_id).update(
+        setup_status=Agencia.SetupStatus.DONE, setup_error='', setup_completed_at=timezone.now()
+    )
+    # Traer en bloque los contactos y propiedades que la agencia ya tiene en GHL
+    importar_agencia_background(location_id)
+
+    actualizar_zonas_agencias(location_ids=[location_id])
+    probar_registros_dummy(access_token, location_id, agencia.property_object_id)
+
+
+def importar_agencia_background(location_id):
+    """
+    Encola la importacion inicial GHL → BD de una agencia recien instalada (importer.py).
+    Un solo trabajo pendiente por agencia; si falla, el outbox lo reintenta y se reanuda
+    desde el checkpoint.
+    """
+    enqueue_job(
+        SyncJob.JobType.IMPORT_AGENCY, {'location_id': location_id}, agencia_id=location_id,
+        dedupe_key=f"import_agency:{location_id}", priority=BACKFILL,
+    )
+
+
+@job_handler(SyncJob.JobType.IMPORT_AGENCY)
+def _run_import_agency(payload):
+    """Handler del outbox: ejecuta o reanuda la importacion inicial de la agencia."""
+    from .importer import importar_agencia
+
+    importar_agencia(payload['location_id'])
+
+
+def encolar_reconciliaciones():
+    """
+    Job periodico 'reconciliation': un trabajo del outbox por agencia (reconciler.py),
+    con prioridad de mantenimiento para no quitar presupuesto de GHL al trabajo normal.
+    """
+    from .reconciler import agencias_a_reconciliar
+
+    for location_id in agencias_a_reconciliar():
+        enqueue_job(
+            SyncJob.JobType.RECONCILE_AGENCY, {'location_id': location_id}, agencia_id=location_id,
+            dedupe_key=f"reconcile_agency:{location_id}", priority=MAINTENANCE,
+        )
+
+
+@job_handler(SyncJob.JobType.RECONCILE_AGENCY)
+def _run_reconcile_agency(payload):
+    """
+    Handler del outbox: reconcilia la agencia y deja el informe en el log.
+    Un fallo a mitad no se reintenta: la siguiente pasada periodica continua.
+    """
+    from .reconciler import reconciliar_agencia
+
+    informe = reconciliar_agencia(payload['location_id'])
+    if informe.con_deriva or informe.error:
+        logger.warning(f"Reconciliacion con deriva:\n{informe}")
+    else:
+        logger.info(f"Reconciliacion sin deriva: {informe}")
 
 
-def shutdown_executor():
-    """Cierra el pool de hilos limpiamente."""
-    _executor.shutdown(wait=True)
-    logger.info("ThreadPoolExecutor cerrado correctamente")
+def persistir_webhooks_agrupados():
+    """Apagado: cierra ya las ventanas de agrupacion abiertas y pasa sus webhooks al outbox."""
+    return _webhook_window.flush_all()
@@ -2,21 +2,59 @@
 Tests unitarios para el proyecto CRM.
 Cubre: matching, helpers, API publica.
 """
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone as dt_tz
 from decimal import Decimal
-from django.test import TestCase, Client as HttpClient
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client as HttpClient, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 
-from .models import Agencia, Propiedad, Cliente, Zona, Municipio, Provincia
+from GHL_Front.pagination import PropiedadCursorPagination
+
+from . import outbox, sync_worker, versions
+from .models import (
+    Agencia, Propiedad, Cliente, Zona, Municipio, Provincia,
+    SyncJob, PeriodicJobState, AgencyImport
+)
 from .helpers import (
     clean_currency, clean_int, preferenciasTraductor1,
     preferenciasTraductor2, estadoPropTrad, guardadorURL
 )
 from .matching import (
     buscar_clientes_para_propiedad, buscar_propiedades_para_cliente,
-    actualizar_relaciones_propiedad, actualizar_relaciones_cliente
+    actualizar_relaciones_propiedad, actualizar_relaciones_cliente, emparejar_agencia
+)
+from .background import BackgroundJobRunner, JobRejected
+from .fairness import repartir_cuotas, intercalar_por_agencia
+from .importer import importar_agencia, _emparejar_y_asociar
+from .outbox import (
+    JOB_HANDLERS, JOB_MERGES, enqueue_job, claim_jobs, process_outbox, drain_outbox, _reschedule_failed
 )
+from .priority import RateBudget, current_priority
+from .reconciler import reconciliar_agencia, InformeReconciliacion, _Reconciliacion, _ids_ordenados, _cruzar
+from .scheduler import Scheduler, PeriodicJob, CronExpr, PROCESS_ID, renovar_lease
+from .shutdown import devolver_reclamados
+from .sync_worker import _claim_pending
+from .tasks import (
+    sync_to_ghl_background, encolar_webhook_cliente, persistir_webhooks_agrupados,
+    actualizar_zonas_agencias, funcionAsyncronaZonas, _run_setup_agency
+)
+from .utils import CoalescingWindow, registrar_fallo_sync, sync_record_to_ghl
+from .wakeup import SyncWakeup, _notify_now
+from .zonas import resolver_zonas
 
 
 # =============================================================================
@@ -283,3 +321,1155 @@ class ZonasAPITests(TestCase):
         self.assertIn('zonas', data)
         self.assertEqual(len(data['zonas']), 1)
         self.assertEqual(data['zonas'][0]['provincia'], 'Madrid')
+
+
+# =============================================================================
+# TESTS PARA PROCESAMIENTO EN BACKGROUND
+# =============================================================================
+
+class CoalescingWindowTests(TestCase):
+    def test_rafaga_misma_clave_procesa_solo_el_ultimo(self):
+        procesados = []
+        hecho = threading.Event()
+
+        def on_flush(key, value):
+            procesados.append((key, value))
+            hecho.set()
+
+        ventana = CoalescingWindow(on_flush=on_flush)
+        self.assertTrue(ventana.submit(('loc', 'c1'), {'v': 1}, 0.2))
+        self.assertFalse(ventana.submit(('loc', 'c1'), {'v': 2}, 0.2))
+        self.assertFalse(ventana.submit(('loc', 'c1'), {'v': 3}, 0.2))
+
+        self.assertTrue(hecho.wait(2))
+        self.assertEqual(procesados, [(('loc', 'c1'), {'v': 3})])
+        self.assertEqual(len(ventana), 0)
+
+    def test_merge_personalizado(self):
+        hecho = threading.Event()
+        resultado = {}
+
+        def on_flush(key, value):
+            resultado['value'] = value
+            hecho.set()
+
+        ventana = CoalescingWindow(on_flush=on_flush, merge=lambda a, b: a + b)
+        ventana.submit('k', 1, 0.1)
+        ventana.submit('k', 2, 0.1)
+
+        self.assertTrue(hecho.wait(2))
+        self.assertEqual(resultado['value'], 3)
+
+
+class WebhookClienteCoalescingTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc-webhook", active=True)
+
+    def test_webhook_se_encola_en_ventana(self):
+        payload = {'id': 'contact-1', 'location': {'id': 'loc-webhook'}, 'customData': {}}
+        with mock.patch('ghl_middleware.views.encolar_webhook_cliente') as encolar:
+            response = self.client.post('/webhooks/cliente/', payload, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        encolar.assert_called_once()
+        self.assertEqual(encolar.call_args[0][:2], ('loc-webhook', 'contact-1'))
+
+
+class OutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc-outbox", active=True)
+
+    def setUp(self):
+        self.ejecutados = []
+        JOB_HANDLERS['test_ok'] = lambda payload: self.ejecutados.append(payload)
+        JOB_HANDLERS['test_fallo'] = self._handler_fallido
+        self.addCleanup(JOB_HANDLERS.pop, 'test_ok', None)
+        self.addCleanup(JOB_HANDLERS.pop, 'test_fallo', None)
+
+    @staticmethod
+    def _handler_fallido(payload):
+        raise Exception("GHL caido")
+
+    def test_trabajo_completado_se_borra(self):
+        enqueue_job('test_ok', {'n': 1}, agencia_id=self.agencia.pk)
+        self.assertEqual(process_outbox(), 1)
+        self.assertEqual(self.ejecutados, [{'n': 1}])
+        self.assertFalse(SyncJob.objects.filter(job_type='test_ok').exists())
+
+    def test_trabajo_fallido_se_reprograma(self):
+        job = enqueue_job('test_fallo', {}, agencia_id=self.agencia.pk)
+        process_outbox()
+
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(job.lease_until)
+        self.assertGreater(job.next_run_at, timezone.now())
+        self.assertIn("GHL caido", job.last_error)
+
+    def test_trabajo_con_lease_vigente_no_se_reclama(self):
+        enqueue_job('test_ok', {}, agencia_id=self.agencia.pk)
+        self.assertEqual(len(claim_jobs()), 1)
+        self.assertEqual(len(claim_jobs()), 0)
+
+    def test_drenado_acotado_por_lotes(self):
+        for n in range(5):
+            enqueue_job('test_ok', {'n': n}, agencia_id=self.agencia.pk)
+        with override_settings(OUTBOX_BATCH_SIZE=2):
+            self.assertEqual(drain_outbox(max_batches=1), 2)
+            self.assertEqual(drain_outbox(), 3)
+
+    def test_trabajo_descartado_tras_max_intentos(self):
+        job = enqueue_job('test_fallo', {}, agencia_id=self.agencia.pk, dedupe_key='k')
+        SyncJob.objects.filter(pk=job.pk).update(attempts=2)
+        with override_settings(OUTBOX_MAX_ATTEMPTS=3):
+            process_outbox()
+
+        job.refresh_from_db()
+        self.assertIsNotNone(job.dead_at)
+        self.assertIsNone(job.lease_until)
+        SyncJob.objects.filter(pk=job.pk).update(next_run_at=job.created_at)
+        self.assertEqual(claim_jobs(), [])
+        # Un descartado no bloquea ni absorbe los trabajos nuevos con su clave
+        nuevo = enqueue_job('test_fallo', {}, agencia_id=self.agencia.pk, dedupe_key='k')
+        self.assertNotEqual(nuevo.pk, job.pk)
+
+    def test_encolado_simultaneo_se_fusiona(self):
+        outbox.enqueue_job('test_ok', {'v': 1}, agencia_id=self.agencia.pk, dedupe_key='k')
+        # Otro proceso inserta la clave entre la busqueda y el create: salta el indice unico
+        real = outbox._pendiente
+        with mock.patch('ghl_middleware.outbox._pendiente', side_effect=[None, real('k')]):
+            outbox.enqueue_job('test_ok', {'v': 2}, agencia_id=self.agencia.pk, dedupe_key='k')
+
+        jobs = SyncJob.objects.filter(dedupe_key='k')
+        self.assertEqual(jobs.count(), 1)
+        self.assertEqual(jobs.get().payload, {'v': 2})
+
+    def test_fallo_con_pendiente_de_la_misma_clave_se_fusiona(self):
+        JOB_MERGES['test_fallo'] = lambda previo, nuevo: {'v': previo['v'] + nuevo['v']}
+        self.addCleanup(JOB_MERGES.pop, 'test_fallo', None)
+
+        enqueue_job('test_fallo', {'v': 1}, agencia_id=self.agencia.pk, dedupe_key='k')
+        job = claim_jobs()[0]
+        enqueue_job('test_fallo', {'v': 2}, agencia_id=self.agencia.pk, dedupe_key='k')
+        _reschedule_failed(job, Exception("GHL caido"))
+
+        jobs = SyncJob.objects.filter(dedupe_key='k')
+        self.assertEqual(jobs.count(), 1)
+        self.assertEqual(jobs.get().payload, {'v': 3})
+
+
+class SyncWakeupTests(TestCase):
+    def test_notificacion_despierta_al_worker(self):
+        wakeup = SyncWakeup()
+        _notify_now()
+        self.assertTrue(wakeup.wait(1))
+        # La notificacion se consume: la siguiente espera agota el timeout
+        self.assertFalse(wakeup.wait(0.05))
+
+    def test_stop_event_corta_la_espera(self):
+        stop = threading.Event()
+        stop.set()
+        self.assertFalse(SyncWakeup().wait(10, stop_event=stop))
+
+
+class _ExecutorSincrono:
+    """Executor de pruebas: ejecuta en el mismo thread (misma transaccion de test)."""
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class SyncCycleAgrupadoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia_a = Agencia.objects.create(location_id="loc-a", active=True)
+        cls.agencia_b = Agencia.objects.create(location_id="loc-b", active=True)
+        for i in range(3):
+            Cliente.objects.create(agencia=cls.agencia_a, nombre=f"A{i}")
+        Cliente.objects.create(agencia=cls.agencia_b, nombre="B0")
+        Propiedad.objects.create(agencia=cls.agencia_b)
+
+    def _run_cycle(self):
+        with mock.patch('ghl_middleware.utils.get_valid_token', side_effect=lambda loc: f"token-{loc}") as token, \
+                mock.patch('ghl_middleware.utils.sync_record_to_ghl', return_value=True) as sync, \
+                mock.patch.object(connection, 'close'):
+            sync_worker._run_sync_cycle(executor=_ExecutorSincrono())
+        return token, sync
+
+    def test_token_se_resuelve_una_vez_por_agencia(self):
+        token, sync = self._run_cycle()
+
+        self.assertEqual(token.call_count, 2)
+        self.assertEqual(sync.call_count, 5)
+        tokens_usados = {c.kwargs['access_token'] for c in sync.call_args_list}
+        self.assertEqual(tokens_usados, {"token-loc-a", "token-loc-b"})
+
+    def test_registros_reclamados_no_se_vuelven_a_coger(self):
+        self._run_cycle()
+        _, sync = self._run_cycle()
+        self.assertEqual(sync.call_count, 0)
+        self.assertEqual(Cliente.objects.filter(sync_status='syncing').count(), 4)
+
+    def test_lane_salta_registros_con_lease_perdido(self):
+        sync_worker._claim_pending(Cliente, 10)
+        # El reaper lo devolvio a 'pending' (y quiza ya lo tiene otro worker)
+        perdido = Cliente.objects.filter(agencia=self.agencia_a).first()
+        Cliente.objects.filter(pk=perdido.pk).update(sync_status='pending', sync_lease_until=None)
+        records = [('cliente', c) for c in Cliente.objects.filter(agencia=self.agencia_a)]
+
+        with mock.patch('ghl_middleware.utils.sync_record_to_ghl', return_value=True) as sync, \
+                mock.patch.object(connection, 'close'):
+            self.assertEqual(sync_worker._sync_agency_lane(self.agencia_a, "token", records), 2)
+
+        self.assertNotIn(perdido.pk, [c.args[0].pk for c in sync.call_args_list])
+
+    def test_esperar_lanes_renueva_el_lease_del_lote(self):
+        cliente = Cliente.objects.filter(agencia=self.agencia_a).first()
+        anterior = timezone.now() - timedelta(seconds=1)
+        Cliente.objects.filter(pk=cliente.pk).update(sync_status='syncing', sync_lease_until=anterior)
+
+        lane = Future()
+        threading.Timer(0.3, lane.set_result, (1,)).start()
+        # Renovacion cada SYNC_LEASE_SECONDS / 3 = 0.05s mientras la lane sigue en marcha
+        with override_settings(SYNC_LEASE_SECONDS=0.15):
+            self.assertEqual(sync_worker.esperar_lanes([lane], {Cliente: [cliente.pk]}), 1)
+
+        cliente.refresh_from_db()
+        self.assertGreater(cliente.sync_lease_until, anterior)
+
+
+class RepartoJustoTests(TestCase):
+    def test_agencia_grande_no_acapara_el_lote(self):
+        cuotas = repartir_cuotas({'grande': 20000, 'b': 5, 'c': 5}, 50)
+        self.assertEqual(cuotas, {'grande': 40, 'b': 5, 'c': 5})
+
+    def test_pesos_reparten_proporcionalmente(self):
+        cuotas = repartir_cuotas({'pago': 1000, 'basica': 1000}, 40, pesos={'pago': 3})
+        self.assertEqual(cuotas, {'pago': 30, 'basica': 10})
+
+    def test_mas_agencias_que_capacidad_rota_el_turno(self):
+        elegidas = set()
+        for _ in range(3):
+            elegidas |= set(repartir_cuotas({'a': 10, 'b': 10, 'c': 10}, 1))
+        self.assertEqual(elegidas, {'a', 'b', 'c'})
+
+    def test_intercalar_por_agencia(self):
+        items = [('a', 1), ('a', 2), ('a', 3), ('b', 1)]
+        self.assertEqual(
+            intercalar_por_agencia(items, key=lambda item: item[0]),
+            [('a', 1), ('b', 1), ('a', 2), ('a', 3)]
+        )
+
+    def test_claim_pending_reparte_entre_agencias(self):
+        grande = Agencia.objects.create(location_id="loc-grande", active=True)
+        pequena = Agencia.objects.create(location_id="loc-pequena", active=True)
+        Cliente.objects.bulk_create([Cliente(agencia=grande, nombre=f"G{i}") for i in range(30)])
+        Cliente.objects.create(agencia=pequena, nombre="P0")
+
+        reclamados = sync_worker._claim_pending(Cliente, 10)
+
+        agencias = [agencia_id for _, agencia_id in reclamados]
+        self.assertEqual(len(reclamados), 10)
+        self.assertEqual(agencias.count("loc-pequena"), 1)
+
+    def test_sync_status_expone_profundidad_por_agencia(self):
+        agencia = Agencia.objects.create(location_id="loc-status", active=True, sync_weight=2)
+        Cliente.objects.create(agencia=agencia, nombre="C0")
+        Propiedad.objects.create(agencia=agencia)
+        admin = get_user_model().objects.create_user('admin', password='x', is_staff=True)
+
+        client = HttpClient()
+        self.assertEqual(client.get('/sync/status/').status_code, 403)
+        client.force_login(admin)
+        data = client.get('/sync/status/').json()
+
+        fila = next(a for a in data['agencias'] if a['location_id'] == "loc-status")
+        self.assertEqual((fila['clientes'], fila['propiedades'], fila['sync_weight']), (1, 1, 2))
+
+
+class SyncLeaseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc-lease", active=True)
+
+    def test_claim_pone_lease(self):
+        cliente = Cliente.objects.create(agencia=self.agencia, nombre="C0")
+        sync_worker._claim_pending(Cliente, 10)
+
+        cliente.refresh_from_db()
+        self.assertEqual(cliente.sync_status, 'syncing')
+        self.assertIsNotNone(cliente.sync_lease_until)
+
+    def test_reaper_devuelve_leases_caducados_a_pending(self):
+        ahora = timezone.now()
+        caducado = Cliente.objects.create(agencia=self.agencia, nombre="Caducado")
+        vigente = Propiedad.objects.create(agencia=self.agencia)
+        Cliente.objects.filter(pk=caducado.pk).update(
+            sync_status='syncing', sync_lease_until=ahora - timedelta(seconds=1)
+        )
+        Propiedad.objects.filter(pk=vigente.pk).update(
+            sync_status='syncing', sync_lease_until=ahora + timedelta(minutes=5)
+        )
+
+        self.assertEqual(sync_worker.reap_expired_leases(), 1)
+        caducado.refresh_from_db()
+        vigente.refresh_from_db()
+        self.assertEqual((caducado.sync_status, caducado.sync_lease_until), ('pending', None))
+        self.assertEqual(vigente.sync_status, 'syncing')
+
+    def test_trabajo_de_registro_ocupado_se_reprograma(self):
+        cliente = Cliente.objects.create(agencia=self.agencia, nombre="Ocupado")
+        SyncJob.objects.all().delete()
+        Cliente.objects.filter(pk=cliente.pk).update(sync_status='syncing')
+        sync_to_ghl_background(cliente.pk, 'cliente', agencia_id=self.agencia.pk)
+        SyncJob.objects.update(next_run_at=timezone.now())
+
+        with mock.patch('ghl_middleware.utils.sync_record_to_ghl') as sync:
+            process_outbox()
+
+        sync.assert_not_called()
+        job = SyncJob.objects.get(dedupe_key=f"sync_record:cliente:{cliente.pk}")
+        self.assertGreater(job.next_run_at, timezone.now())
+        self.assertEqual(claim_jobs(), [])
+
+
+class SyncRetryBackoffTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc-retry", active=True)
+
+    def test_fallo_programa_reintento_y_acaba_en_dead(self):
+        cliente = Cliente.objects.create(agencia=self.agencia, nombre="Veneno")
+        with override_settings(SYNC_MAX_ATTEMPTS=2):
+            registrar_fallo_sync(cliente, "GHL 500")
+            cliente.refresh_from_db()
+            self.assertEqual((cliente.sync_status, cliente.sync_attempt_count), ('error', 1))
+            self.assertGreater(cliente.sync_next_attempt_at, timezone.now())
+
+            registrar_fallo_sync(cliente, "GHL 500")
+            cliente.refresh_from_db()
+            self.assertEqual(cliente.sync_status, 'dead')
+            self.assertIsNone(cliente.sync_next_attempt_at)
+
+    def test_sin_token_no_cuenta_para_el_dead_letter(self):
+        cliente = Cliente.objects.create(agencia=self.agencia, nombre="Sin token")
+        with mock.patch('ghl_middleware.utils.get_valid_token', return_value=None):
+            self.assertFalse(sync_record_to_ghl(cliente, 'cliente'))
+
+        cliente.refresh_from_db()
+        self.assertEqual((cliente.sync_status, cliente.sync_attempt_count), ('error', 0))
+        self.assertGreater(cliente.sync_next_attempt_at, timezone.now())
+
+    def test_claim_solo_coge_errores_vencidos(self):
+        ahora = timezone.now()
+        vencido = Cliente.objects.create(agencia=self.agencia, nombre="Vencido")
+        futuro = Cliente.objects.create(agencia=self.agencia, nombre="Futuro")
+        muerto = Cliente.objects.create(agencia=self.agencia, nombre="Muerto")
+        Cliente.objects.filter(pk=vencido.pk).update(sync_status='error', sync_next_attempt_at=ahora - timedelta(seconds=1))
+        Cliente.objects.filter(pk=futuro.pk).update(sync_status='error', sync_next_attempt_at=ahora + timedelta(hours=1))
+        Cliente.objects.filter(pk=muerto.pk).update(sync_status='dead')
+
+        reclamados = [pk for pk, _ in sync_worker._claim_pending(Cliente, 10)]
+        self.assertEqual(reclamados, [vencido.pk])
+
+
+class SignalDebounceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc-debounce", active=True)
+
+    def test_saves_seguidos_dejan_un_solo_trabajo(self):
+        propiedad = Propiedad.objects.create(agencia=self.agencia)
+        for precio in (100, 200, 300):
+            propiedad.precio = precio
+            propiedad.save()
+
+        jobs = SyncJob.objects.filter(dedupe_key=f"sync_record:propiedad:{propiedad.pk}")
+        self.assertEqual(jobs.count(), 1)
+        # El CREATE inicial no se pierde al fusionarse con los saves posteriores
+        self.assertTrue(jobs.get().payload['created'])
+
+    def test_fusion_retrasa_sin_pasar_del_maximo(self):
+        job = enqueue_job('test_ok', {'n': 1}, delay=2, dedupe_key='k', max_delay=30)
+        SyncJob.objects.filter(pk=job.pk).update(created_at=job.created_at - timedelta(seconds=60))
+        fusionado = enqueue_job('test_ok', {'n': 2}, delay=2, dedupe_key='k', max_delay=30)
+
+        self.assertEqual(fusionado.pk, job.pk)
+        self.assertEqual(fusionado.payload, {'n': 2})
+        self.assertLessEqual(fusionado.next_run_at, fusionado.created_at + timedelta(seconds=30))
+
+
+class BackgroundJobRunnerTests(TestCase):
+    def setUp(self):
+        self.liberar = threading.Event()
+        self.runner = BackgroundJobRunner(
+            max_workers=1, max_queue=1,
+            policies={'shed': 'shed_oldest', 'inline': 'caller_runs'},
+        )
+        self.addCleanup(self.runner.shutdown, wait=True, cancel_pending=True)
+        self.addCleanup(self.liberar.set)
+
+    def _ocupar_worker(self):
+        empezado = threading.Event()
+
+        def _bloqueante():
+            empezado.set()
+            self.liberar.wait(5)
+
+        self.runner.submit('lento', _bloqueante)
+        self.assertTrue(empezado.wait(5))
+
+    def test_cola_llena_rechaza(self):
+        self._ocupar_worker()
+        self.runner.submit('otro', lambda: None)
+        with self.assertRaises(JobRejected):
+            self.runner.submit('otro', lambda: None)
+        self.assertEqual(self.runner.stats()['rechazados'], 1)
+
+    def test_shed_oldest_sustituye_al_trabajo_en_cola(self):
+        self._ocupar_worker()
+        viejo = self.runner.submit('shed', lambda: 'viejo')
+        nuevo = self.runner.submit('shed', lambda: 'nuevo')
+
+        self.assertTrue(viejo.cancelled())
+        self.liberar.set()
+        self.assertEqual(nuevo.result(timeout=5), 'nuevo')
+
+    def test_caller_runs_ejecuta_en_el_thread_que_envia(self):
+        self._ocupar_worker()
+        self.runner.submit('otro', lambda: None)
+        future = self.runner.submit('inline', threading.current_thread)
+        self.assertIs(future.result(timeout=0), threading.current_thread())
+
+    def test_metricas(self):
+        self._ocupar_worker()
+        self.runner.submit('otro', lambda: None)
+
+        stats = self.runner.stats()
+        self.assertEqual((stats['cola'], stats['activos']), (1, 1))
+        self.assertEqual(stats['activos_por_tipo'], {'lento': 1})
+
+
+class PrioridadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc-prio", active=True)
+
+    def test_presupuesto_reserva_margen_a_clases_altas(self):
+        budget = RateBudget(rate=0.001, burst=10, reserves={'interactive': 0.2, 'webhook': 0.2})
+        concedidos = 0
+        while not budget.try_acquire('backfill'):
+            concedidos += 1
+        # backfill deja intactos los 4 tokens reservados a interactive + webhook
+        self.assertEqual(concedidos, 6)
+        self.assertEqual(budget.try_acquire('webhook'), 0)
+        self.assertEqual(budget.try_acquire('webhook'), 0)
+        self.assertGreater(budget.try_acquire('webhook'), 0)
+        self.assertEqual(budget.try_acquire('interactive'), 0)
+
+    def test_claim_reclama_primero_las_clases_altas(self):
+        for _ in range(3):
+            enqueue_job('test_ok', {}, agencia_id=self.agencia.pk, priority='backfill')
+        enqueue_job('test_ok', {}, agencia_id=self.agencia.pk, priority='interactive')
+
+        jobs = claim_jobs(limit=2)
+        self.assertEqual([job.priority for job in jobs], ['interactive', 'backfill'])
+
+    def test_fusion_conserva_la_prioridad_mas_alta(self):
+        propiedad = Propiedad.objects.create(agencia=self.agencia)
+
+        sync_to_ghl_background(propiedad.pk, 'propiedad', created=True, priority='interactive')
+        job = SyncJob.objects.get(dedupe_key=f"sync_record:propiedad:{propiedad.pk}")
+        self.assertEqual(job.priority, 'interactive')
+
+    def test_runner_atiende_la_cola_por_prioridad(self):
+        runner = BackgroundJobRunner(
+            max_workers=1, max_queue=10,
+            priorities={'bulk': 'backfill', 'ui': 'interactive'},
+        )
+        liberar = threading.Event()
+        self.addCleanup(runner.shutdown, wait=True)
+        self.addCleanup(liberar.set)
+
+        runner.submit('bloqueo', liberar.wait, 5)
+        orden = []
+        runner.submit('bulk', lambda: orden.append(current_priority()))
+        ultimo = runner.submit('ui', lambda: orden.append(current_priority()))
+        liberar.set()
+        ultimo.result(timeout=5)
+        runner.shutdown(wait=True)
+
+        self.assertEqual(orden, ['interactive', 'backfill'])
+
+
+class SchedulerTests(TestCase):
+    def test_cron_proxima_ejecucion(self):
+        desde = datetime(2024, 1, 1, 4, 30, tzinfo=dt_tz.utc)  # lunes
+        self.assertEqual(CronExpr('0 4 * * *').next_after(desde), datetime(2024, 1, 2, 4, 0, tzinfo=dt_tz.utc))
+        self.assertEqual(CronExpr('*/15 * * * *').next_after(desde), datetime(2024, 1, 1, 4, 45, tzinfo=dt_tz.utc))
+        # Solo dias laborables (1-5): del sabado se salta al lunes
+        sabado = datetime(2024, 1, 6, 12, 0, tzinfo=dt_tz.utc)
+        self.assertEqual(CronExpr('0 9 * * 1-5').next_after(sabado), datetime(2024, 1, 8, 9, 0, tzinfo=dt_tz.utc))
+        with self.assertRaises(ValueError):
+            CronExpr('0 25 * * *')
+
+    def test_job_vencido_se_ejecuta_una_vez_y_se_reprograma(self):
+        llamadas = []
+        scheduler = Scheduler([PeriodicJob('prueba', lambda executor: llamadas.append(1), interval=3600)])
+
+        self.assertTrue(scheduler.run_job('prueba'))
+        self.assertFalse(scheduler.run_job('prueba'))  # No vence hasta dentro de una hora
+        self.assertEqual(len(llamadas), 1)
+
+        estado = PeriodicJobState.objects.get(name='prueba')
+        self.assertEqual((estado.last_status, estado.run_count), ('ok', 1))
+        self.assertIsNone(estado.lease_until)
+
+    def test_job_con_lease_de_otro_proceso_no_se_ejecuta(self):
+        PeriodicJobState.objects.create(
+            name='prueba', next_run_at=timezone.now(),
+            lease_until=timezone.now() + timedelta(minutes=5), owner='otro',
+        )
+        scheduler = Scheduler([PeriodicJob('prueba', lambda executor: None, interval=60)])
+        self.assertFalse(scheduler.run_job('prueba', force=True))
+
+    def test_lease_caducado_y_reclamado_por_otro_no_se_pisa(self):
+        otro_lease = timezone.now() + timedelta(minutes=5)
+
+        def job_lento(executor):
+            # Mientras corre, su lease caduca y otro proceso reclama el job
+            PeriodicJobState.objects.filter(name='prueba').update(owner='otro', lease_until=otro_lease)
+            self.assertFalse(renovar_lease('prueba', 60))
+
+        scheduler = Scheduler([PeriodicJob('prueba', job_lento, interval=60)])
+        self.assertTrue(scheduler.run_job('prueba'))
+
+        estado = PeriodicJobState.objects.get(name='prueba')
+        self.assertEqual((estado.owner, estado.lease_until, estado.run_count), ('otro', otro_lease, 0))
+
+    def test_renovar_lease_propio(self):
+        ahora = timezone.now()
+        PeriodicJobState.objects.create(name='prueba', next_run_at=ahora, lease_until=ahora, owner=PROCESS_ID)
+        self.assertTrue(renovar_lease('prueba', 600))
+        self.assertGreater(PeriodicJobState.objects.get(name='prueba').lease_until, ahora)
+
+    def test_job_con_trabajo_pendiente_repite_sin_esperar(self):
+        scheduler = Scheduler([PeriodicJob('prueba', lambda executor: True, interval=3600)])
+        self.assertTrue(scheduler.run_job('prueba'))
+        self.assertTrue(scheduler.run_job('prueba'))
+
+    def test_error_queda_registrado(self):
+        def falla(executor):
+            raise RuntimeError("boom")
+
+        Scheduler([PeriodicJob('prueba', falla, interval=60)]).run_job('prueba')
+        estado = PeriodicJobState.objects.get(name='prueba')
+        self.assertEqual((estado.last_status, estado.last_error), ('error', 'boom'))
+
+
+class GracefulShutdownTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc-apagado", active=True)
+
+    def test_flush_all_procesa_las_ventanas_abiertas_al_momento(self):
+        procesados = []
+        ventana = CoalescingWindow(on_flush=lambda key, value: procesados.append((key, value)))
+        ventana.submit('a', 1, 60)
+        ventana.submit('b', 2, 60)
+
+        self.assertEqual(ventana.flush_all(), 2)
+        self.assertEqual(sorted(procesados), [('a', 1), ('b', 2)])
+        self.assertEqual(len(ventana), 0)
+
+    def test_webhooks_agrupados_pasan_al_outbox(self):
+        with mock.patch('ghl_middleware.outbox.kick_outbox'):
+            encolar_webhook_cliente('loc-apagado', 'contact-1', {'v': 1})
+            encolar_webhook_cliente('loc-apagado', 'contact-1', {'v': 2})
+            self.assertEqual(persistir_webhooks_agrupados(), 1)
+
+        job = SyncJob.objects.get(job_type='webhook_cliente')
+        self.assertEqual(job.payload['data'], {'v': 2})
+        self.assertEqual(job.priority, 'webhook')
+
+    def test_devuelve_lo_reclamado_sin_terminar(self):
+        devolver_reclamados()  # Partir sin nada en vuelo de otros tests
+        Propiedad.objects.create(agencia=self.agencia)
+        SyncJob.objects.all().delete()  # El sync diferido del signal no interesa aqui
+        enqueue_job('test_ok', {}, agencia_id=self.agencia.pk)
+        self.assertEqual(len(claim_jobs(limit=10)), 1)
+        self.assertEqual(len(_claim_pending(Propiedad, 10)), 1)
+
+        self.assertEqual(devolver_reclamados(), (1, 1))
+        self.assertIsNone(SyncJob.objects.get().lease_until)
+        propiedad = Propiedad.objects.get()
+        self.assertEqual(propiedad.sync_status, 'pending')
+        self.assertIsNone(propiedad.sync_lease_until)
+
+    def test_durante_el_apagado_no_se_reclaman_lotes(self):
+        enqueue_job('test_ok', {}, agencia_id=self.agencia.pk)
+        apagando = threading.Event()
+        apagando.set()
+        with mock.patch('ghl_middleware.shutdown._apagando', apagando):
+            self.assertEqual(drain_outbox(), 0)
+        self.assertIsNone(SyncJob.objects.get().lease_until)
+
+
+class SyncToGhlCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc-backfill", active=True)
+        cls.clientes = [Cliente.objects.create(agencia=cls.agencia, nombre=f"C{i}") for i in range(5)]
+        Propiedad.objects.create(agencia=cls.agencia)
+
+    def setUp(self):
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+
+    def _ejecutar(self, *args):
+        salida = io.StringIO()
+        with mock.patch('ghl_middleware.management.commands.sync_to_ghl.ThreadPoolExecutor',
+                        lambda **kwargs: _ExecutorSincrono()), \
+                mock.patch('ghl_middleware.utils.get_valid_token', return_value="token"), \
+                mock.patch('ghl_middleware.utils.sync_record_to_ghl', return_value=True) as sync, \
+                mock.patch.object(connection, 'close'):
+            call_command('sync_to_ghl', '--checkpoint', self.checkpoint, '--workers', '4', *args, stdout=salida)
+        return sync, salida.getvalue()
+
+    def test_procesa_por_lotes_hasta_vaciar_el_backlog(self):
+        sync, salida = self._ejecutar('--batch-size', '2')
+
+        self.assertEqual(sync.call_count, 6)
+        self.assertIn('ETA', salida)
+        self.assertIn('Clientes OK=5 FAIL=0', salida)
+        self.assertFalse(os.path.exists(self.checkpoint))  # Ejecucion completa: sin checkpoint
+
+    def test_reanuda_desde_el_checkpoint(self):
+        firma = {'type': 'cliente', 'location_id': None, 'retry_errors': False, 'retry_dead': False}
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'firma': firma, 'cursores': {'cliente': self.clientes[2].pk}, 'stats': {'cliente_ok': 3}}, f)
+
+        sync, salida = self._ejecutar('--type', 'cliente')
+
+        self.assertEqual(sync.call_count, 2)
+        self.assertIn('Reanudando', salida)
+        self.assertIn('Clientes OK=5', salida)
+
+
+class ImportacionInicialTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc-import", active=True, property_object_id="obj-1")
+        provincia = Provincia.objects.create(nombre="Barcelona")
+        municipio = Municipio.objects.create(nombre="Barcelona", provincia=provincia)
+        cls.gracia = Zona.objects.create(nombre="Gracia", municipio=municipio)
+        cls.sants = Zona.objects.create(nombre="Sants", municipio=municipio)
+
+    def _contacto(self, ghl_id, presupuesto, zona):
+        return {
+            'id': ghl_id, 'contactName': f"Cliente {ghl_id}",
+            'customFields': [
+                {'id': 'cf-presupuesto', 'value': presupuesto},
+                {'id': 'cf-zonas', 'value': [zona]},
+            ],
+        }
+
+    def _importar(self, contactos_por_pagina, propiedades):
+        claves = {'cf-presupuesto': 'presupuesto_mximo', 'cf-zonas': 'zonas_deseadas'}
+        with mock.patch('ghl_middleware.utils.get_valid_token', return_value="token"), \
+                mock.patch('ghl_middleware.utils.ghl_get_custom_field_keys', return_value=claves), \
+                mock.patch('ghl_middleware.utils.ghl_list_contacts', side_effect=contactos_por_pagina) as listar, \
+                mock.patch('ghl_middleware.utils.ghl_search_property_records', return_value=(propiedades, len(propiedades))), \
+                mock.patch('ghl_middleware.outbox.kick_outbox'):
+            return importar_agencia(self.agencia.location_id, page_size=2), listar
+
+    def test_importa_paginas_y_empareja_en_una_pasada(self):
+        paginas = [
+            ([self._contacto('c1', 300000, 'Gracia -- Barcelona -- Barcelona'),
+              self._contacto('c2', 100000, 'gracia__barcelona__barcelona')], {'startAfterId': 'c2', 'startAfter': 2}),
+            ([self._contacto('c3', 500000, 'Sants')], {'startAfterId': 'c3', 'startAfter': 3}),
+        ]
+        propiedades = [{'id': 'p1', 'properties': {'precio': 250000, 'estado': 'activo', 'zona': 'Gracia'}}]
+
+        importacion, listar = self._importar(paginas, propiedades)
+
+        self.assertEqual(importacion.status, 'done')
+        self.assertEqual((importacion.clientes_importados, importacion.propiedades_importadas), (3, 1))
+        self.assertEqual(listar.call_args_list[1].kwargs['start_after_id'], 'c2')
+        c1 = Cliente.objects.get(ghl_contact_id='c1')
+        self.assertEqual(c1.sync_status, 'synced')
+        self.assertEqual(list(c1.zona_interes.all()), [self.gracia])
+        # Solo c1 tiene la zona y el presupuesto de p1
+        self.assertEqual(importacion.matches, 1)
+        self.assertEqual(list(c1.propiedades_interes.values_list('ghl_contact_id', flat=True)), ['p1'])
+
+    def test_importes_en_texto_y_registros_invalidos(self):
+        paginas = [([self._contacto('c1', "300000", 'Gracia'), self._contacto('c2', "caro", 'Sants')], {})]
+        propiedades = [{'id': 'p1', 'properties': {'precio': "1500.00", 'estado': 'activo', 'zona': 'Gracia'}}]
+
+        importacion, _ = self._importar(paginas, propiedades)
+
+        self.assertEqual(importacion.status, 'done')
+        self.assertEqual((importacion.clientes_importados, importacion.registros_saltados), (1, 1))
+        self.assertEqual(Cliente.objects.get(ghl_contact_id='c1').presupuesto_maximo, 300000)
+        self.assertEqual(Propiedad.objects.get(ghl_contact_id='p1').precio, 1500)
+        self.assertFalse(Cliente.objects.filter(ghl_contact_id='c2').exists())
+
+    def test_importacion_fallida_se_reanuda_desde_el_checkpoint(self):
+        primera = ([self._contacto('c1', 300000, 'Gracia'), self._contacto('c2', 100000, 'Sants')],
+                   {'startAfterId': 'c2', 'startAfter': 2})
+        with self.assertRaises(Exception):
+            self._importar([primera, None], [])
+        estado = AgencyImport.objects.get(agencia=self.agencia)
+        self.assertEqual((estado.status, estado.cursor['startAfterId']), ('error', 'c2'))
+
+        importacion, listar = self._importar([([], {})], [])
+        self.assertEqual(listar.call_args.kwargs['start_after_id'], 'c2')
+        self.assertEqual((importacion.status, importacion.clientes_importados), ('done', 2))
+
+    def test_reanudar_el_matching_no_duplica_asociaciones(self):
+        self.agencia.association_type_id = "assoc-1"
+        cliente = Cliente.objects.create(agencia=self.agencia, nombre="X", ghl_contact_id="c1", presupuesto_maximo=200000)
+        cliente.zona_interes.set([self.gracia])
+        Propiedad.objects.create(agencia=self.agencia, precio=150000, ghl_contact_id="p1").zonas.set([self.gracia])
+        importacion = AgencyImport.objects.create(agencia=self.agencia)
+
+        with mock.patch('ghl_middleware.outbox.kick_outbox'):
+            _emparejar_y_asociar(importacion, self.agencia, "token")
+            _emparejar_y_asociar(importacion, self.agencia, "token")
+        jobs = SyncJob.objects.filter(job_type=SyncJob.JobType.SYNC_ASSOCIATIONS)
+        self.assertEqual(list(jobs.values_list('dedupe_key', flat=True)), ["assoc:c1"])
+
+    def test_matching_masivo_coincide_con_el_individual(self):
+        cliente = Cliente.objects.create(agencia=self.agencia, nombre="X", presupuesto_maximo=200000, balcon='si')
+        cliente.zona_interes.set([self.gracia])
+        for precio, balcon, zona in ((150000, 'si', self.gracia), (150000, 'no', self.gracia),
+                                     (250000, 'si', self.gracia), (150000, 'si', self.sants)):
+            Propiedad.objects.create(agencia=self.agencia, precio=precio, balcon=balcon).zonas.set([zona])
+        sin_zonas = Cliente.objects.create(agencia=self.agencia, nombre="Y", presupuesto_maximo=200000)
+
+        emparejamientos = emparejar_agencia(self.agencia)
+        for c in (cliente, sin_zonas):
+            esperadas = set(buscar_propiedades_para_cliente(c, self.agencia).values_list('pk', flat=True))
+            self.assertEqual(set(emparejamientos[c.pk]), esperadas)
+
+
+class ReconciliacionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(
+            location_id="loc-rec", active=True, property_object_id="obj-1", association_type_id="assoc-1"
+        )
+
+    def setUp(self):
+        Cliente.objects.create(agencia=self.agencia, ghl_contact_id='c1', nombre="Sigue", sync_status='synced')
+        Cliente.objects.create(agencia=self.agencia, ghl_contact_id='c2', nombre="Borrado en GHL", sync_status='synced')
+        Cliente.objects.create(agencia=self.agencia, ghl_contact_id='c3', nombre="Dead", sync_status='dead')
+        Cliente.objects.create(agencia=self.agencia, nombre="Nunca sincronizado", sync_status='dead')
+
+    def _reconciliar(self, dry_run):
+        contactos = [{'id': ghl_id} for ghl_id in ('c4', 'c3', 'c1')]
+        remotos = {'c1': {'id': 'c1'}, 'c3': {'id': 'c3'}, 'c4': {'id': 'c4', 'contactName': "Solo en GHL"}}
+        with mock.patch('ghl_middleware.utils.get_valid_token', return_value="token"), \
+                mock.patch('ghl_middleware.utils.ghl_list_contacts', return_value=(contactos, {})), \
+                mock.patch('ghl_middleware.utils.ghl_search_property_records', return_value=([], 0)), \
+                mock.patch('ghl_middleware.utils.ghl_get_contact', side_effect=lambda t, i: remotos.get(i, False)), \
+                mock.patch('ghl_middleware.utils.ghl_get_custom_field_keys', return_value={}), \
+                mock.patch('ghl_middleware.utils.ghl_get_current_associations',
+                           side_effect=lambda t, l, i: {'p-huerfana': {'id': 'r1'}} if i == 'c1' else {}), \
+                mock.patch('ghl_middleware.outbox.kick_outbox'):
+            return reconciliar_agencia(self.agencia.location_id, dry_run=dry_run, page_size=10, batch_size=2)
+
+    def test_error_de_ghl_en_asociaciones_no_es_deriva(self):
+        informe = InformeReconciliacion(self.agencia.location_id, dry_run=False)
+        reconciliacion = _Reconciliacion(self.agencia, "token", informe, dry_run=False, page_size=10, batch_size=2)
+        cliente = Cliente.objects.get(ghl_contact_id='c1')
+        with mock.patch('ghl_middleware.utils.ghl_get_current_associations', return_value=None), \
+                mock.patch('ghl_middleware.tasks.sync_associations_background') as reasociar:
+            reconciliacion._comprobar_asociaciones([(cliente.pk, 'c1')])
+        self.assertFalse(informe.con_deriva)
+        self.assertEqual(informe.sin_comprobar['cliente'], 1)
+        reasociar.assert_not_called()
+
+    def test_id_vacio_se_reencola_y_no_se_borra(self):
+        vacio = Propiedad.objects.create(agencia=self.agencia, ghl_contact_id='', sync_status='synced')
+
+        informe = self._reconciliar(dry_run=False)
+
+        vacio.refresh_from_db()
+        self.assertEqual(vacio.sync_status, 'pending')
+        self.assertEqual(informe.acciones[('propiedad', 'requeue')], 1)
+        self.assertEqual(informe.acciones[('propiedad', 'delete')], 0)
+
+    def test_ids_de_ghl_se_ordenan_por_tramos_y_se_cruzan(self):
+        remotos = _ids_ordenados(iter([['c', 'a'], ['e', 'b'], ['a', 'd']]), run_size=2)
+        locales = iter([('b', 1), ('f', 2)])
+        self.assertEqual(list(_cruzar(locales, remotos)), [
+            ('a', None, True), ('b', 1, True), ('c', None, True), ('d', None, True),
+            ('e', None, True), ('f', 2, False),
+        ])
+
+    def test_dry_run_informa_sin_tocar_nada(self):
+        informe = self._reconciliar(dry_run=True)
+
+        self.assertEqual(informe.error, '')
+        self.assertEqual(informe.acciones[('cliente', 'requeue')], 2)
+        self.assertEqual(informe.acciones[('cliente', 'delete')], 1)
+        self.assertEqual(informe.acciones[('cliente', 'import')], 1)
+        self.assertEqual(informe.acciones[('cliente', 'reassociate')], 1)
+        self.assertTrue(Cliente.objects.filter(ghl_contact_id='c2').exists())
+        self.assertFalse(Cliente.objects.filter(ghl_contact_id='c4').exists())
+        self.assertEqual(Cliente.objects.filter(sync_status='dead').count(), 2)
+        self.assertFalse(SyncJob.objects.exists())
+
+    def test_aplica_las_reparaciones(self):
+        informe = self._reconciliar(dry_run=False)
+
+        self.assertEqual(informe.aplicadas[('cliente', 'delete')], 1)
+        self.assertFalse(Cliente.objects.filter(ghl_contact_id='c2').exists())
+        self.assertEqual(Cliente.objects.get(ghl_contact_id='c4').nombre, "Solo en GHL")
+        self.assertEqual(Cliente.objects.filter(sync_status='pending').count(), 2)
+        reasociacion = SyncJob.objects.get(
+            job_type=SyncJob.JobType.SYNC_ASSOCIATIONS, payload__origin_record_id='c1'
+        )
+        self.assertEqual((reasociacion.priority, reasociacion.payload['target_ids']), ('maintenance', []))
+
+
+class SetupAgenciaTests(APITestCase):
+    def _callback(self):
+        respuesta = mock.Mock(status_code=200)
+        respuesta.json.return_value = {
+            'locationId': 'loc-nueva', 'access_token': 'a', 'refresh_token': 'r',
+            'token_type': 'Bearer', 'expires_in': 86399, 'scope': 'x',
+        }
+        with mock.patch('ghl_middleware.views.requests.post', return_value=respuesta), \
+                mock.patch('ghl_middleware.utils.get_location_name') as nombre, \
+                mock.patch('ghl_middleware.outbox.kick_outbox'):
+            response = self.client.get('/oauth/callback/', {'code': 'abc'})
+        nombre.assert_not_called()
+        return response
+
+    def test_callback_guarda_tokens_y_encola_el_setup(self):
+        response = self._callback()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Agencia.objects.get(pk='loc-nueva').setup_status, 'pending')
+        job = SyncJob.objects.get(job_type=SyncJob.JobType.SETUP_AGENCY)
+        self.assertEqual((job.priority, job.payload), ('interactive', {'location_id': 'loc-nueva'}))
+
+        estado = self.client.get(response.data['status_url'])
+        self.assertEqual(estado.data['setup']['status'], 'pending')
+        self.assertIsNone(estado.data['importacion'])
+
+    def test_setup_en_background_guarda_ids_y_encola_la_importacion(self):
+        self._callback()
+        with mock.patch('ghl_middleware.tasks.get_valid_token', return_value="token"), \
+                mock.patch('ghl_middleware.utils.get_property_object_id', return_value="obj-1"), \
+                mock.patch('ghl_middleware.utils.find_association_details', return_value="assoc-1"), \
+                mock.patch('ghl_middleware.utils.find_custom_fields_ids',
+                           return_value={'zona_cliente': 'cf-c', 'zona_propiedad': 'cf-p'}), \
+                mock.patch('ghl_middleware.utils.get_location_name', return_value="Inmobiliaria"), \
+                mock.patch('ghl_middleware.tasks.actualizar_zonas_agencias') as zonas, \
+                mock.patch('ghl_middleware.utils.probar_registros_dummy') as dummies, \
+                mock.patch('ghl_middleware.outbox.kick_outbox'):
+            _run_setup_agency({'location_id': 'loc-nueva'})
+
+        agencia = Agencia.objects.get(pk='loc-nueva')
+        self.assertEqual(agencia.setup_status, 'done')
+        self.assertEqual(
+            (agencia.nombre, agencia.property_object_id, agencia.association_type_id, agencia.ghl_custom_field_cliente_zona),
+            ("Inmobiliaria", "obj-1", "assoc-1", "cf-c")
+        )
+        self.assertTrue(SyncJob.objects.filter(job_type=SyncJob.JobType.IMPORT_AGENCY).exists())
+        zonas.assert_called_once_with(location_ids=['loc-nueva'])
+        dummies.assert_called_once_with("token", 'loc-nueva', "obj-1")
+
+    def test_setup_fallido_queda_en_error_para_reintentar(self):
+        Agencia.objects.create(location_id='loc-nueva')
+        with mock.patch('ghl_middleware.tasks.get_valid_token', return_value="token"), \
+                mock.patch('ghl_middleware.utils.get_property_object_id', return_value=None), \
+                mock.patch('ghl_middleware.utils.find_association_details', return_value=None), \
+                mock.patch('ghl_middleware.utils.find_custom_fields_ids', return_value={}), \
+                mock.patch('ghl_middleware.utils.get_location_name', return_value=None):
+            with self.assertRaises(Exception):
+                _run_setup_agency({'location_id': 'loc-nueva'})
+
+        agencia = Agencia.objects.get(pk='loc-nueva')
+        self.assertEqual(agencia.setup_status, 'error')
+        self.assertIn("Propiedad", agencia.setup_error)
+
+    def test_estado_publico_sin_detalle_de_errores(self):
+        Agencia.objects.create(location_id='loc-nueva', nombre="Inmobiliaria", setup_status='error',
+                               setup_error="GHL 401: invalid token xyz")
+        estado = self.client.get('/oauth/status/', {'location_id': 'loc-nueva'}).data
+        self.assertEqual(estado, {'location_id': 'loc-nueva', 'setup': {'status': 'error'}, 'importacion': None})
+
+        self.client.force_login(get_user_model().objects.create_user('admin', password='x', is_staff=True))
+        estado = self.client.get('/oauth/status/', {'location_id': 'loc-nueva'}).data
+        self.assertEqual((estado['nombre'], estado['setup']['error']), ("Inmobiliaria", "GHL 401: invalid token xyz"))
+
+
+class PushZonasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        provincia = Provincia.objects.create(nombre="Madrid")
+        cls.municipio = Municipio.objects.create(nombre="Madrid", provincia=provincia)
+        Zona.objects.create(nombre="Centro", municipio=cls.municipio)
+        for i in range(3):
+            Agencia.objects.create(
+                location_id=f"loc-z{i}", active=True,
+                ghl_custom_field_propiedad_zona=f"cf-p{i}", ghl_custom_field_cliente_zona=f"cf-c{i}",
+            )
+        Agencia.objects.create(location_id="loc-sin-campos", active=True)
+
+    def _push(self, fallar=()):
+        def put(location_id, opciones, token, url, prop):
+            return None if location_id in fallar else True
+
+        with mock.patch('ghl_middleware.tasks.get_valid_token', return_value="token"), \
+                mock.patch('ghl_middleware.tasks.ghlActualizarZonaAPI', side_effect=put) as api:
+            return actualizar_zonas_agencias(), api.call_count
+
+    def test_solo_se_envia_a_las_agencias_con_opciones_distintas(self):
+        self.assertEqual(self._push(fallar={'loc-z1'}), ((2, 1), 6))
+        # Sin cambios solo se reintenta la que fallo
+        self.assertEqual(self._push(), ((1, 0), 2))
+        self.assertEqual(self._push(), ((0, 0), 0))
+
+        Zona.objects.create(nombre="Retiro", municipio=self.municipio)
+        self.assertEqual(self._push(), ((3, 0), 6))
+
+    def test_altas_seguidas_de_zonas_dejan_un_solo_trabajo(self):
+        with mock.patch('ghl_middleware.outbox._programar_kick'):
+            for _ in range(50):
+                funcionAsyncronaZonas()
+        job = SyncJob.objects.get(job_type=SyncJob.JobType.ZONAS_PUSH)
+        self.assertEqual(job.priority, 'maintenance')
+
+
+class ZonaEtiquetasTests(TestCase):
+    def test_label_y_key_se_mantienen_al_renombrar(self):
+        provincia = Provincia.objects.create(nombre="Barcelona")
+        municipio = Municipio.objects.create(nombre="Sant Cugat", provincia=provincia)
+        zona = Zona.objects.create(nombre="Mira-sol", municipio=municipio)
+        self.assertEqual((zona.label, zona.key), (
+            "Mira-sol -- Sant Cugat -- Barcelona", "mira-sol__sant_cugat__barcelona"
+        ))
+
+        municipio.nombre = "Sant Cugat del Valles"
+        municipio.save()
+        provincia.nombre = "BCN"
+        provincia.save()
+        zona.refresh_from_db()
+        self.assertEqual(zona.label, "Mira-sol -- Sant Cugat del Valles -- BCN")
+
+        zona.nombre = "Volpelleres"
+        zona.save(update_fields=['nombre'])
+        zona.refresh_from_db()
+        self.assertEqual(zona.key, "volpelleres__sant_cugat_del_valles__bcn")
+
+
+class ZonaResolverTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        provincia = Provincia.objects.create(nombre="Barcelona")
+        cls.bcn = Municipio.objects.create(nombre="Barcelona", provincia=provincia)
+        cls.cugat = Municipio.objects.create(nombre="Sant Cugat", provincia=provincia)
+        cls.gracia = Zona.objects.create(nombre="Gràcia", municipio=cls.bcn)
+        cls.centro_bcn = Zona.objects.create(nombre="Centro", municipio=cls.bcn)
+        cls.centro_cugat = Zona.objects.create(nombre="Centro", municipio=cls.cugat)
+
+    def test_sin_acentos_ni_mayusculas(self):
+        self.assertEqual(resolver_zonas("  GRACIA "), [self.gracia.pk])
+        self.assertEqual(resolver_zonas(["gràcia__barcelona__barcelona"]), [self.gracia.pk])
+
+    def test_municipio_acota_nombres_repetidos(self):
+        self.assertEqual(resolver_zonas("Centro -- Sant Cugat"), [self.centro_cugat.pk])
+        self.assertEqual(resolver_zonas("Centro -- Sant Cugat -- Barcelona, Gracia"), [self.centro_cugat.pk, self.gracia.pk])
+        self.assertEqual(resolver_zonas("centro"), [self.centro_bcn.pk, self.centro_cugat.pk])
+        self.assertEqual(resolver_zonas("Inexistente"), [])
+
+    def test_sin_consultas_y_se_invalida_al_crear_zona(self):
+        resolver_zonas("Gracia")
+        with self.assertNumQueries(0):
+            resolver_zonas("Centro -- Barcelona")
+
+        nueva = Zona.objects.create(nombre="Sants", municipio=self.bcn)
+        self.assertEqual(resolver_zonas("sants"), [nueva.pk])
+
+
+class ArbolZonasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        provincia = Provincia.objects.create(nombre="Madrid")
+        cls.municipio = Municipio.objects.create(nombre="Madrid", provincia=provincia)
+        Municipio.objects.create(nombre="Getafe", provincia=provincia)
+        Zona.objects.create(nombre="Retiro", municipio=cls.municipio)
+        Zona.objects.create(nombre="Chamberi", municipio=cls.municipio)
+
+    def test_arbol_sin_consultas_y_304_con_etag(self):
+        client = HttpClient()
+        response = client.get('/zonas/')
+        self.assertEqual(response.json()['zonas'], [{"provincia": "Madrid", "municipios": [
+            {"nombre": "Madrid", "zonas": ["Retiro", "Chamberi"]},
+            {"nombre": "Getafe", "zonas": []},
+        ]}])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = client.get('/zonas/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        locations = client.get('/front/api/locations/', {'agency_id': 'loc', 'all': 'true'}).json()['locations']
+        self.assertEqual([z['zona'] for z in locations], ["Chamberi", "Retiro"])
+
+    def test_nueva_zona_cambia_el_etag(self):
+        client = HttpClient()
+        etag = client.get('/zonas/')['ETag']
+        Zona.objects.create(nombre="Sol", municipio=self.municipio)
+
+        response = client.get('/zonas/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn("Sol", response.json()['zonas'][0]['municipios'][0]['zonas'])
+
+
+class UbicacionesAgenciaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc_ubic", nombre="Agencia")
+        otra = Agencia.objects.create(location_id="loc_otra", nombre="Otra")
+        provincia = Provincia.objects.create(nombre="Madrid")
+        municipio = Municipio.objects.create(nombre="Madrid", provincia=provincia)
+        cls.retiro = Zona.objects.create(nombre="Retiro", municipio=municipio)
+        cls.sol = Zona.objects.create(nombre="Sol", municipio=municipio)
+        Zona.objects.create(nombre="Vacia", municipio=municipio)
+        for agencia, zonas in ((cls.agencia, [cls.retiro, cls.sol]), (cls.agencia, [cls.retiro]), (otra, [cls.sol])):
+            propiedad = Propiedad.objects.create(agencia=agencia, precio=100000, sync_status='synced')
+            propiedad.zonas.set(zonas)
+
+    def _ubicaciones(self, **cabeceras):
+        return HttpClient().get('/front/api/locations/', {'agency_id': 'loc_ubic'}, **cabeceras)
+
+    def test_solo_zonas_en_uso_con_su_count(self):
+        data = self._ubicaciones().json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([(z['zona'], z['count']) for z in data['locations']], [("Retiro", 2), ("Sol", 1)])
+
+    def test_cacheado_e_invalidado_al_cambiar_propiedades(self):
+        etag = self._ubicaciones()['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self._ubicaciones()['ETag'], etag)
+
+        propiedad = Propiedad.objects.create(agencia=self.agencia, precio=1, sync_status='synced')
+        propiedad.zonas.add(self.sol)
+        response = self._ubicaciones(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([z['count'] for z in response.json()['locations']], [2, 2])
+
+        propiedad.delete()
+        self.assertEqual([z['count'] for z in self._ubicaciones().json()['locations']], [2, 1])
+
+
+class PaginacionCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc_cursor")
+        # Precios repetidos: el id desempata dentro de cada precio
+        cls.ids = [
+            Propiedad.objects.create(agencia=cls.agencia, precio=precio, sync_status='synced').pk
+            for precio in (300, 100, 200, 100, 300, 200, 100)
+        ]
+
+    def _recorrer(self, url, params):
+        client, vistos, paginas = HttpClient(), [], 0
+        data = client.get(url, params).json()
+        while True:
+            paginas += 1
+            vistos += [p['id'] for p in data['results']]
+            if not data['next']:
+                return vistos, paginas
+            data = client.get(data['next']).json()
+
+    def test_recorre_todo_sin_duplicados_en_orden(self):
+        vistos, paginas = self._recorrer('/front/api/properties/search/', {
+            'agency_id': 'loc_cursor', 'pagination': 'cursor', 'page_size': 2,
+        })
+        esperados = list(
+            Propiedad.objects.filter(agencia=self.agencia).order_by('-precio', '-id').values_list('pk', flat=True)
+        )
+        self.assertEqual(vistos, esperados)
+        self.assertEqual(paginas, 4)
+
+        vistos, _ = self._recorrer('/front/api/properties/', {'agency_id': 'loc_cursor', 'pagination': 'cursor', 'page_size': 3})
+        self.assertEqual(vistos, sorted(self.ids, reverse=True))
+
+    def test_totales_opcionales(self):
+        client = HttpClient()
+        params = {'agency_id': 'loc_cursor', 'pagination': 'cursor', 'page_size': 2}
+        self.assertNotIn('count', client.get('/front/api/properties/', params).json())
+        self.assertEqual(client.get('/front/api/properties/', {**params, 'count': 'exact'}).json()['count'], 7)
+
+        with mock.patch.object(PropiedadCursorPagination, 'max_count_aproximado', 5):
+            data = client.get('/front/api/properties/', {**params, 'count': 'approx'}).json()
+        self.assertEqual((data['count'], data['count_is_approximate']), (5, True))
+
+    def test_cursor_no_valido_o_de_otra_ordenacion(self):
+        client = HttpClient()
+        params = {'agency_id': 'loc_cursor', 'page_size': 2}
+        self.assertEqual(client.get('/front/api/properties/search/', {**params, 'cursor': 'basura'}).status_code, 400)
+        manipulado = base64.urlsafe_b64encode(b'{"o":"-precio","v":"abc","id":1}').decode()
+        self.assertEqual(client.get('/front/api/properties/search/', {**params, 'cursor': manipulado}).status_code, 400)
+
+        siguiente = client.get('/front/api/properties/search/', {**params, 'pagination': 'cursor'}).json()['next']
+        cursor = siguiente.split('cursor=')[1].split('&')[0]
+        response = client.get('/front/api/properties/search/', {**params, 'cursor': cursor, 'ordering': 'metros'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CacheRespuestasFrontTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.agencia = Agencia.objects.create(location_id="loc_cache")
+        cls.propiedad = Propiedad.objects.create(agencia=cls.agencia, precio=100000, sync_status='synced')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hit_sin_consultas_con_params_en_otro_orden(self):
+        client = HttpClient()
+        self.assertEqual(client.get('/front/api/properties/search/?agency_id=loc_cache&beds=0')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = client.get('/front/api/properties/search/?beds=0&agency_id=loc_cache')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_tras_editar_sirve_la_copia_vieja_y_revalida(self):
+        client = HttpClient()
+        params = {'agency_id': 'loc_cache'}
+        client.get('/front/api/properties/', params)
+
+        Propiedad.objects.create(agencia=self.agencia, precio=200000, sync_status='synced')
+        with mock.patch('ghl_middleware.background.runner.submit', side_effect=lambda tipo, func: func()) as submit:
+            response = client.get('/front/api/properties/', params)
+        self.assertEqual((response['X-Cache'], response.json()['count']), ('STALE', 1))
+        submit.assert_called_once()
+
+        response = client.get('/front/api/properties/', params)
+        self.assertEqual((response['X-Cache'], response.json()['count']), ('HIT', 2))
+
+    def test_primer_sync_invalida_el_ghl_id_cacheado(self):
+        antes = versions.version(versions.propiedades(self.agencia.pk))
+        self.propiedad.sync_status = 'syncing'
+        self.propiedad.save(update_fields=['sync_status'])
+        self.assertEqual(versions.version(versions.propiedades(self.agencia.pk)), antes)
+
+        self.propiedad.ghl_contact_id = 'p-nueva'
+        self.propiedad.sync_status = 'synced'
+        self.propiedad.save(update_fields=['ghl_contact_id', 'sync_status'])
+        self.assertNotEqual(versions.version(versions.propiedades(self.agencia.pk)), antes)
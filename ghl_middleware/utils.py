@@ -10,19 +10,24 @@ from datetime import timedelta
 from django.utils import timezone
 from django.conf import settings
 from django.db import transaction
-from .models import GHLToken, Zona
-from .helpers import (
-    format_currency_eur, preferencias_inversa_1, preferencias_inversa_2,
-    estado_prop_inversa, imagenes_para_ghl
-)
+from .models import GHLToken
+from .priority import ghl_rate_budget
+from .helpers import format_currency_eur, preferencias_inversa_1, preferencias_inversa_2
 
 
 logger = logging.getLogger(__name__)
 
 
+class _BudgetedSession(requests.Session):
+    """Sesion que consume el presupuesto de rate limit de GHL (segun la prioridad del thread)."""
+    def request(self, *args, **kwargs):
+        ghl_rate_budget.acquire()
+        return super().request(*args, **kwargs)
+
+
 def create_resilient_session():
     """Crea una sesion HTTP con reintentos automaticos para errores transitorios."""
-    session = requests.Session()
+    session = _BudgetedSession()
 
     retry_strategy = Retry(
         total=3,
@@ -117,6 +122,77 @@ class RecentSyncCache:
 _recent_syncs = RecentSyncCache(ttl=60)
 
 
+# --- COALESCING DE EVENTOS (RAFAGAS DE WEBHOOKS) ---
+
+class CoalescingWindow:
+    """
+    Agrupa eventos con la misma clave que llegan dentro de una ventana de tiempo.
+    El primer evento abre la ventana; los siguientes solo reemplazan (o fusionan con
+    `merge`) el valor pendiente. Al cerrarse la ventana se llama UNA vez a
+    on_flush(key, value) con el ultimo estado.
+    """
+    def __init__(self, on_flush, merge=None):
+        self._on_flush = on_flush
+        self._merge = merge
+        self._pending = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, value, window):
+        """
+        Registra un evento. Retorna True si abre una ventana nueva,
+        False si se ha fusionado con un evento pendiente.
+        """
+        with self._lock:
+            if key in self._pending:
+                previo = self._pending[key]
+                self._pending[key] = self._merge(previo, value) if self._merge else value
+                return False
+
+            self._pending[key] = value
+            timer = threading.Timer(window, self._flush, args=(key,))
+            timer.daemon = True
+            self._timers[key] = timer
+
+        timer.start()
+        return True
+
+    def _flush(self, key):
+        with self._lock:
+            value = self._pending.pop(key, None)
+            self._timers.pop(key, None)
+
+        if value is None:
+            return
+
+        try:
+            self._on_flush(key, value)
+        except Exception as e:
+            logger.error(f"Error procesando evento agrupado {key}: {str(e)}", exc_info=True)
+
+    def flush_all(self):
+        """
+        Cierra ya todas las ventanas abiertas (apagado del proceso): cancela los timers
+        y llama a on_flush en el thread actual. Retorna el numero de eventos procesados.
+        """
+        with self._lock:
+            pendientes, self._pending = self._pending, {}
+            timers, self._timers = self._timers, {}
+
+        for timer in timers.values():
+            timer.cancel()
+        for key, value in pendientes.items():
+            try:
+                self._on_flush(key, value)
+            except Exception as e:
+                logger.error(f"Error procesando evento agrupado {key}: {str(e)}", exc_info=True)
+        return len(pendientes)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+
 # --- TOKEN AUTO-REFRESH ---
 
 def get_valid_token(location_id):
@@ -191,6 +267,31 @@ def refresh_ghl_token(token_obj):
         return None
 
 
+def refresh_expiring_tokens(margin_seconds):
+    """
+    Refresca por adelantado los tokens que caducan en los proximos `margin_seconds`,
+    para que ninguna peticion tenga que esperar al refresco. Retorna cuantos se refrescaron.
+    """
+    limite = timezone.now() + timedelta(seconds=margin_seconds)
+    refrescados = 0
+
+    for token_obj in GHLToken.objects.only('location_id', 'updated_at', 'expires_in'):
+        if token_obj.updated_at + timedelta(seconds=token_obj.expires_in) > limite:
+            continue
+        try:
+            with transaction.atomic():
+                # Mismo candado que get_valid_token: nunca dos refrescos del mismo token
+                token_obj = GHLToken.objects.select_for_update().get(location_id=token_obj.location_id)
+                if token_obj.updated_at + timedelta(seconds=token_obj.expires_in) > limite:
+                    continue
+                if refresh_ghl_token(token_obj):
+                    refrescados += 1
+        except Exception as e:
+            logger.error(f"Error refrescando token de {token_obj.location_id}: {str(e)}", exc_info=True)
+
+    return refrescados
+
+
 def get_location_name(access_token, location_id):
     """
     Obtiene el nombre de la agencia desde GHL API.
@@ -228,7 +329,11 @@ def get_location_name(access_token, location_id):
 # --- FUNCIONES DE API GHL (Asociaciones) ---
 
 def ghl_get_current_associations(access_token, location_id, property_id):
-    """Obtiene las asociaciones actuales de una propiedad."""
+    """
+    Obtiene las asociaciones actuales de un registro: {id_del_otro_registro: relacion}.
+    {} si no tiene (o GHL responde 404); None si GHL falla, para no confundir un error con
+    "sin asociaciones".
+    """
     rate_limit_wait()
 
     headers = {
@@ -262,10 +367,10 @@ def ghl_get_current_associations(access_token, location_id, property_id):
             return {}
         else:
             logger.error(f"Error GHL GET Associations: {response.status_code}")
-            return {}
+            return None
     except Exception as e:
         logger.error(f"Excepcion GET Associations: {str(e)}")
-        return {}
+        return None
 
 
 def ghl_delete_association(access_token, location_id, relation_id):
@@ -598,114 +703,102 @@ def delete_dummy_property(access_token, property_object_id, record_id):
     except Exception as e:
         logger.error(f"Excepcion borrando propiedad dummy: {str(e)}")
 
-def actualizarAgenciaIndividualZona(agencia, location_id):
-    opciones_propiedad = []
-    opciones_cliente = []
-    for zona in Zona.objects.select_related('municipio', 'municipio__provincia').all():
-        nombre_zona = zona.nombre
-        nombre_municipio = zona.municipio.nombre
-        nombre_provincia = zona.municipio.provincia.nombre
-
-        label = f"{nombre_zona} -- {nombre_municipio} -- {nombre_provincia}"
-        value = f"{nombre_zona}__{nombre_municipio}__{nombre_provincia}".lower().replace(" ", "_")
-
-        # Los nombres de abajo han de ser así. No estan mal puestos.
-        opciones_propiedad.append(label)
-        opciones_cliente.append(label)
-    if not agencia.ghl_custom_field_propiedad_zona or not agencia.ghl_custom_field_cliente_zona:
-        logger.warning(f"Agencia {location_id} no tiene custom field IDs de zona configurados. Saltando.")
-        return
-
-    try:
-        token = get_valid_token(location_id)
-        if not token:
-            logger.warning(f"No se pudo obtener token válido para agencia {location_id}")
-            return
-
-        url_propiedad = f"https://services.leadconnectorhq.com/custom-fields/{agencia.ghl_custom_field_propiedad_zona}/"
-        url_cliente = f"https://services.leadconnectorhq.com/locations/{location_id}/customFields/{agencia.ghl_custom_field_cliente_zona}/"
-
-        ghlActualizarZonaAPI(location_id, opciones_propiedad, token, url_propiedad, True)
-        ghlActualizarZonaAPI(location_id, opciones_cliente, token, url_cliente, False)
-
-    except Exception as e:
-        logger.error(f"Error obteniendo token para agencia {location_id}: {str(e)}")
-
 def initialize_ghl_setup(access_token, location_id, agencia):
     """
-    Orquesta todo el proceso de setup inicial de GHL:
-    1. Obtener ID de Object Propiedad
-    2. Crear Contacto Dummy
-    3. Crear Propiedad Dummy
-    4. Obtener ID de Asociacion
-    5. Obtener IDs de Camps Custom (Zonas)
-    6. Guardar en Agencia
-    7. Limpiar Dummies
+    Setup inicial de GHL de una agencia (lo ejecuta el trabajo SETUP_AGENCY del outbox):
+    1. En paralelo, porque no dependen entre si: ID del Object Propiedad, ID de Asociacion,
+       IDs de los Custom Fields de zona y nombre de la location
+    2. Guardar en Agencia
+    Retorna False si no se encontro el Object Propiedad (sin el no se puede sincronizar nada).
+    El push de zonas y la prueba con registros dummy van despues, fuera del camino critico.
     """
-    logger.info(f"Iniciando Setup Wizard para {location_id}...")
+    from concurrent.futures import ThreadPoolExecutor
+    from .priority import current_priority, prioridad
 
-    # 1. Obtener ID Objeto Propiedad
-    prop_obj_id = get_property_object_id(access_token, location_id)
-    if not prop_obj_id:
-        logger.error("Setup fallido: No se pudo obtener Property Object ID")
-        return False
+    logger.info(f"Iniciando Setup Wizard para {location_id}...")
 
-    # 2. Crear Contacto Dummy
-    contact_id = create_dummy_contact(access_token, location_id)
-    if not contact_id:
-        logger.error("Setup fallido: No se pudo crear Contacto Dummy")
-        return False
+    # Los threads del pool no heredan la clase de prioridad del que los lanza
+    clase = current_priority()
 
-    # 3. Crear Propiedad Dummy
-    prop_record_id = create_dummy_property(access_token, location_id, prop_obj_id)
-    if not prop_record_id:
-        logger.error("Setup fallido: No se pudo crear Propiedad Dummy")
-        # Intentar limpiar el contacto aunque falle aqui
-        delete_dummy_contact(access_token, contact_id)
-        return False
+    def _llamar(func, *args):
+        with prioridad(clase):
+            return func(*args)
 
-    try:
-        # 4. Obtener ID de Asociacion
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix="ghl_setup_") as pool:
+        prop_obj_id = pool.submit(_llamar, get_property_object_id, access_token, location_id)
         # Nota: Segun instrucciones, "asociaciones" es el endpoint, y buscamos key="propiedad_contacto"
-        assoc_id = find_association_details(access_token, location_id)
-        
-        # 5. Obtener IDs de Custom Fields
-        fields_map = find_custom_fields_ids(access_token, location_id)
-        
-        # 6. Guardar en Agencia
-        updated = False
-
-        # Guardar el property_object_id para usarlo al crear propiedades via API
+        assoc_id = pool.submit(_llamar, find_association_details, access_token, location_id)
+        fields_map = pool.submit(_llamar, find_custom_fields_ids, access_token, location_id)
+        location_name = pool.submit(_llamar, get_location_name, access_token, location_id)
+    prop_obj_id, assoc_id = prop_obj_id.result(), assoc_id.result()
+    fields_map, location_name = fields_map.result(), location_name.result()
+
+    # 2. Guardar en Agencia (solo lo encontrado: un fallo parcial no borra IDs ya guardados)
+    if location_name:
+        agencia.nombre = location_name
+    if prop_obj_id:
         agencia.property_object_id = prop_obj_id
-        updated = True
+    if assoc_id:
+        agencia.association_type_id = assoc_id
+    if fields_map.get('zona_cliente'):
+        agencia.ghl_custom_field_cliente_zona = fields_map['zona_cliente']
+    if fields_map.get('zona_propiedad'):
+        agencia.ghl_custom_field_propiedad_zona = fields_map['zona_propiedad']
+    agencia.save(update_fields=[
+        'nombre', 'property_object_id', 'association_type_id',
+        'ghl_custom_field_cliente_zona', 'ghl_custom_field_propiedad_zona',
+    ])
 
-        if assoc_id:
-            agencia.association_type_id = assoc_id
-            updated = True
-
-        if fields_map.get('zona_cliente'):
-            agencia.ghl_custom_field_cliente_zona = fields_map['zona_cliente']
-            updated = True
-
-        if fields_map.get('zona_propiedad'):
-            agencia.ghl_custom_field_propiedad_zona = fields_map['zona_propiedad']
-            updated = True
+    if not prop_obj_id:
+        logger.error("Setup fallido: No se pudo obtener Property Object ID")
+        return False
 
-        actualizarAgenciaIndividualZona(agencia, location_id)
-        
-        if updated:
-            agencia.save()
-            logger.info(f"Setup completado exitosamente para {location_id}. Agencia actualizada.")
-        else:
-            logger.warning(f"Setup finalizado pero no se encontraron IDs clave para {location_id}.")
+    faltan = [
+        nombre for nombre, valor in (
+            ('association_type_id', assoc_id),
+            ('zona_cliente', fields_map.get('zona_cliente')),
+            ('zona_propiedad', fields_map.get('zona_propiedad')),
+        ) if not valor
+    ]
+    if faltan:
+        logger.warning(f"Setup de {location_id} completado sin: {', '.join(faltan)}")
+    else:
+        logger.info(f"Setup completado exitosamente para {location_id}. Agencia actualizada.")
+    return True
 
-    finally:
-        # 7. Limpiar Dummies (Siempre intentar borrar)
-        logger.info("Limpiando registros dummy...")
-        delete_dummy_contact(access_token, contact_id)
-        delete_dummy_property(access_token, prop_obj_id, prop_record_id)
 
-    return True
+def probar_registros_dummy(access_token, location_id, property_object_id):
+    """
+    Comprueba que la app puede crear y borrar Contactos y registros de Propiedad en la
+    location, creando y borrando un dummy de cada (en paralelo). Se ejecuta tras el setup.
+    Retorna True si se pudieron crear los dos.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from .priority import current_priority, prioridad
+
+    clase = current_priority()
+
+    def _contacto():
+        with prioridad(clase):
+            contact_id = create_dummy_contact(access_token, location_id)
+            if contact_id:
+                delete_dummy_contact(access_token, contact_id)
+            return bool(contact_id)
+
+    def _propiedad():
+        with prioridad(clase):
+            record_id = create_dummy_property(access_token, location_id, property_object_id)
+            if record_id:
+                delete_dummy_property(access_token, property_object_id, record_id)
+            return bool(record_id)
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="ghl_setup_") as pool:
+        contacto, propiedad = pool.submit(_contacto), pool.submit(_propiedad)
+    if not contacto.result():
+        logger.error(f"Setup de {location_id}: no se pudo crear el Contacto Dummy")
+    if not propiedad.result():
+        logger.error(f"Setup de {location_id}: no se pudo crear la Propiedad Dummy")
+    return contacto.result() and propiedad.result()
 
 
 # --- FUNCIONES DE CREACION EN GHL (DB → GHL) ---
@@ -732,10 +825,7 @@ def ghl_create_contact(access_token, location_id, cliente):
     last_name = parts[1] if len(parts) > 1 else ""
 
     # 1. Zonas de interes como LISTA (Array), no como string
-    zonas_list = []
-    for zona in cliente.zona_interes.select_related('municipio', 'municipio__provincia').all():
-        label = f"{zona.nombre} -- {zona.municipio.nombre} -- {zona.municipio.provincia.nombre}"
-        zonas_list.append(label)
+    zonas_list = list(cliente.zona_interes.values_list('label', flat=True))
 
     # 2. Construimos los Custom Fields usando las UNIQUE KEYS exactas de GHL
     custom_fields = [
@@ -885,7 +975,183 @@ def ghl_update_property_record(access_token, location_id, property_object_id, re
         return False
 
 
-def sync_record_to_ghl(record, record_type, created=True):
+# --- FUNCIONES DE LECTURA EN GHL (IMPORTACION Y RECONCILIACION GHL → DB) ---
+
+def ghl_list_contacts(access_token, location_id, limit=100, start_after_id=None, start_after=None):
+    """
+    Lee una pagina de contactos de la location (paginacion por cursor de GHL).
+    Retorna (contactos, meta) o None si falla. meta trae startAfterId/startAfter de la siguiente pagina.
+    """
+    url = "https://services.leadconnectorhq.com/contacts/"
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Version": "2021-07-28",
+        "Accept": "application/json"
+    }
+    params = {"locationId": location_id, "limit": limit}
+    if start_after_id:
+        params["startAfterId"] = start_after_id
+        params["startAfter"] = start_after
+
+    try:
+        response = _http_session.get(url, headers=headers, params=params, timeout=30)
+        if response.status_code == 200:
+            data = response.json()
+            return data.get('contacts', []), data.get('meta', {})
+        logger.error(f"Error listando contactos de {location_id}: {response.status_code} - {response.text}")
+        return None
+    except Exception as e:
+        logger.error(f"Excepcion listando contactos de {location_id}: {str(e)}")
+        return None
+
+
+def ghl_search_property_records(access_token, location_id, property_object_id, page=1, page_limit=100):
+    """
+    Lee una pagina de registros del Custom Object Propiedad.
+    Retorna (registros, total) o None si falla.
+    """
+    url = f"https://services.leadconnectorhq.com/objects/{property_object_id}/records/search"
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Version": "2021-07-28",
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
+    payload = {"locationId": location_id, "page": page, "pageLimit": page_limit}
+
+    try:
+        response = _http_session.post(url, headers=headers, json=payload, timeout=30)
+        if response.status_code in [200, 201]:
+            data = response.json()
+            return data.get('records', []), data.get('total', 0)
+        logger.error(f"Error listando propiedades de {location_id}: {response.status_code} - {response.text}")
+        return None
+    except Exception as e:
+        logger.error(f"Excepcion listando propiedades de {location_id}: {str(e)}")
+        return None
+
+
+def ghl_get_contact(access_token, contact_id):
+    """
+    Lee un contacto de GHL.
+    Retorna el contacto, False si no existe en GHL (404) o None si falla.
+    """
+    url = f"https://services.leadconnectorhq.com/contacts/{contact_id}"
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Version": "2021-07-28",
+        "Accept": "application/json"
+    }
+
+    try:
+        response = _http_session.get(url, headers=headers, timeout=10)
+        if response.status_code == 200:
+            return response.json().get('contact', {})
+        if response.status_code == 404:
+            return False
+        logger.error(f"Error leyendo contacto {contact_id}: {response.status_code} - {response.text}")
+        return None
+    except Exception as e:
+        logger.error(f"Excepcion leyendo contacto {contact_id}: {str(e)}")
+        return None
+
+
+def ghl_get_property_record(access_token, property_object_id, record_id):
+    """
+    Lee un registro del Custom Object Propiedad.
+    Retorna el registro, False si no existe en GHL (404) o None si falla.
+    """
+    url = f"https://services.leadconnectorhq.com/objects/{property_object_id}/records/{record_id}"
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Version": "2021-07-28",
+        "Accept": "application/json"
+    }
+
+    try:
+        response = _http_session.get(url, headers=headers, timeout=10)
+        if response.status_code == 200:
+            return response.json().get('record', {})
+        if response.status_code == 404:
+            return False
+        logger.error(f"Error leyendo propiedad {record_id}: {response.status_code} - {response.text}")
+        return None
+    except Exception as e:
+        logger.error(f"Excepcion leyendo propiedad {record_id}: {str(e)}")
+        return None
+
+
+def ghl_get_custom_field_keys(access_token, location_id):
+    """
+    Mapa id → fieldKey (sin prefijo 'contact.') de los custom fields de contacto.
+    Los contactos listados traen sus custom fields por id; el mapeo local va por key.
+    Retorna None si falla.
+    """
+    url = f"https://services.leadconnectorhq.com/locations/{location_id}/customFields/"
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Version": "2021-07-28",
+        "Accept": "application/json"
+    }
+    params = {"model": "contact"}
+
+    try:
+        response = _http_session.get(url, headers=headers, params=params, timeout=10)
+        if response.status_code == 200:
+            return {
+                field.get('id'): (field.get('fieldKey') or '').split('.', 1)[-1]
+                for field in response.json().get('customFields', [])
+            }
+        logger.error(f"Error leyendo custom fields de {location_id}: {response.text}")
+        return None
+    except Exception as e:
+        logger.error(f"Excepcion leyendo custom fields de {location_id}: {str(e)}")
+        return None
+
+
+def sync_lease_deadline():
+    """Fecha de caducidad de un lease de sync reclamado o renovado ahora."""
+    return timezone.now() + timedelta(seconds=settings.SYNC_LEASE_SECONDS)
+
+
+def registrar_fallo_sync(record, error):
+    """
+    Marca un registro como fallido y programa su reintento con backoff exponencial
+    y jitter. Tras SYNC_MAX_ATTEMPTS intentos pasa a 'dead' y el worker deja de cogerlo.
+    """
+    record.sync_attempt_count += 1
+    record.sync_error = str(error)[:500]
+    record.sync_lease_until = None
+    if record.sync_attempt_count >= settings.SYNC_MAX_ATTEMPTS:
+        record.sync_status = 'dead'
+        record.sync_next_attempt_at = None
+        logger.error(f"Registro PK={record.pk} descartado tras {record.sync_attempt_count} intentos: {error}")
+    else:
+        delay = exponential_backoff(
+            record.sync_attempt_count - 1,
+            base_delay=settings.SYNC_RETRY_BASE_SECONDS, max_delay=settings.SYNC_RETRY_MAX_SECONDS
+        )
+        record.sync_status = 'error'
+        record.sync_next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    record.save(update_fields=[
+        'sync_status', 'sync_error', 'sync_lease_until', 'sync_attempt_count', 'sync_next_attempt_at'
+    ])
+
+
+def aplazar_sin_token(model, pks):
+    """
+    Devuelve a 'error' registros que no se han podido sincronizar por falta de token.
+    Es un fallo de la agencia, no de los registros: se reintentan tras SYNC_RETRY_BASE_SECONDS
+    sin contar el intento para el dead-letter (ver registrar_fallo_sync).
+    """
+    return model.objects.filter(pk__in=pks).update(
+        sync_status='error', sync_error='No se pudo obtener token de acceso',
+        sync_lease_until=None,
+        sync_next_attempt_at=timezone.now() + timedelta(seconds=settings.SYNC_RETRY_BASE_SECONDS),
+    )
+
+
+def sync_record_to_ghl(record, record_type, created=True, access_token=None):
     """
     Sincroniza un registro local (Cliente o Propiedad) con GHL.
 
@@ -897,6 +1163,7 @@ def sync_record_to_ghl(record, record_type, created=True):
       2. Re-ejecuta matching y sincroniza asociaciones.
 
     record_type: 'cliente' o 'propiedad'
+    access_token: token ya resuelto (p.ej. una vez por agencia en el sync worker); si no, se obtiene aqui.
     Retorna True si fue exitoso, False si fallo.
     """
     from .models import Propiedad
@@ -907,18 +1174,19 @@ def sync_record_to_ghl(record, record_type, created=True):
     from .tasks import sync_associations_background
 
     location_id = record.agencia.location_id
-    access_token = get_valid_token(location_id)
+    if not access_token:
+        access_token = get_valid_token(location_id)
 
     if not access_token:
         logger.error(f"No se pudo obtener token para sync de {record_type} PK={record.pk}")
-        record.sync_status = 'error'
-        record.sync_error = 'No se pudo obtener token de acceso'
-        record.save(update_fields=['sync_status', 'sync_error'])
+        aplazar_sin_token(type(record), [record.pk])
         return False
 
-    # Marcar como syncing (previene intentos concurrentes)
+    # Marcar como syncing con lease (previene intentos concurrentes; si el proceso
+    # muere a mitad, el reaper lo devuelve a 'pending' cuando caduque)
     record.sync_status = 'syncing'
-    record.save(update_fields=['sync_status'])
+    record.sync_lease_until = sync_lease_deadline()
+    record.save(update_fields=['sync_status', 'sync_lease_until'])
 
     try:
         # --- RAMA UPDATE: el registro ya existe en GHL ---
@@ -940,7 +1208,12 @@ def sync_record_to_ghl(record, record_type, created=True):
 
             record.sync_status = 'synced'
             record.sync_error = ''
-            record.save(update_fields=['sync_status', 'sync_error'])
+            record.sync_lease_until = None
+            record.sync_attempt_count = 0
+            record.sync_next_attempt_at = None
+            record.save(update_fields=[
+                'sync_status', 'sync_error', 'sync_lease_until', 'sync_attempt_count', 'sync_next_attempt_at'
+            ])
 
             # Re-ejecutar matching tambien en updates
             ghl_id = record.ghl_contact_id
@@ -969,7 +1242,13 @@ def sync_record_to_ghl(record, record_type, created=True):
             record.ghl_contact_id = ghl_id
             record.sync_status = 'synced'
             record.sync_error = ''
-            record.save(update_fields=['ghl_contact_id', 'sync_status', 'sync_error'])
+            record.sync_lease_until = None
+            record.sync_attempt_count = 0
+            record.sync_next_attempt_at = None
+            record.save(update_fields=[
+                'ghl_contact_id', 'sync_status', 'sync_error', 'sync_lease_until',
+                'sync_attempt_count', 'sync_next_attempt_at'
+            ])
 
         # --- MATCHING y ASOCIACIONES (igual en create y update) ---
         if record_type == 'propiedad' and record.estado == Propiedad.estadoPiso.ACTIVO:
@@ -997,9 +1276,7 @@ def sync_record_to_ghl(record, record_type, created=True):
 
     except Exception as e:
         logger.error(f"Error sincronizando {record_type} PK={record.pk}: {str(e)}", exc_info=True)
-        record.sync_status = 'error'
-        record.sync_error = str(e)[:500]
-        record.save(update_fields=['sync_status', 'sync_error'])
+        registrar_fallo_sync(record, e)
         return False
 
 
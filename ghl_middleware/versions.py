@@ -0,0 +1,62 @@
+"""
+Contadores de version para invalidar caches en memoria en todos los procesos.
+
+Cada conjunto de datos cacheado (p.ej. las zonas) tiene una fila CacheVersion. Quien
+modifica los datos llama a incrementar(); quien cachea guarda la version con la que
+construyo su copia y la compara con version(). La version leida de la BD se recuerda
+CACHE_VERSION_CHECK_SECONDS, asi que consultar la version casi nunca cuesta una query:
+un cambio hecho en otro proceso se ve como mucho con ese retraso, y uno hecho en este
+proceso se ve al momento.
+
+La version es el instante del cambio en ms (o la anterior + 1 si es mayor): siempre crece
+y no se repite aunque un rollback se lleve la fila, asi que sirve tambien como ETag.
+"""
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import CacheVersion
+
+# Conjuntos de datos versionados
+ZONAS = 'zonas'
+
+
+def propiedades(agencia_id):
+    """Conjunto de datos de las propiedades de una agencia (listados publicos del frontend)."""
+    return f'propiedades:{agencia_id}'
+
+
+_lock = threading.Lock()
+_leidas = {}  # nombre -> (version, instante de la lectura)
+
+
+def version(nombre):
+    """Version actual del conjunto de datos (0 si nunca se ha incrementado)."""
+    ahora = time.monotonic()
+    with _lock:
+        leida = _leidas.get(nombre)
+    if leida is not None and ahora - leida[1] < settings.CACHE_VERSION_CHECK_SECONDS:
+        return leida[0]
+
+    actual = CacheVersion.objects.filter(name=nombre).values_list('version', flat=True).first() or 0
+    with _lock:
+        _leidas[nombre] = (actual, ahora)
+    return actual
+
+
+def incrementar(nombre):
+    """Marca el conjunto de datos como modificado: las copias en memoria dejan de valer."""
+    ahora_ms = int(time.time() * 1000)
+    if not CacheVersion.objects.filter(name=nombre).update(version=Greatest(F('version') + 1, Value(ahora_ms))):
+        CacheVersion.objects.get_or_create(name=nombre, defaults={'version': ahora_ms})
+    _olvidar(nombre)
+    # Tras el commit, por si alguien leyo la version dentro de la transaccion
+    transaction.on_commit(lambda: _olvidar(nombre))
+
+
+def _olvidar(nombre):
+    with _lock:
+        _leidas.pop(nombre, None)
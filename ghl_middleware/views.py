@@ -5,30 +5,29 @@ import hashlib
 import requests
 from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
-from rest_framework import status
-from django.db.models import Q
+from rest_framework.permissions import AllowAny, IsAdminUser
 from django.db import transaction
+from django.db.models import Count
 
-from .models import Agencia, Propiedad, Cliente, GHLToken, Provincia, Municipio, Zona
-from .tasks import sync_associations_background, funcionAsyncronaZonas
+from .models import Agencia, Propiedad, Cliente, GHLToken, Provincia, Municipio, Zona, SyncJob
+from .tasks import (
+    funcionAsyncronaZonas, encolar_webhook_cliente, sync_to_ghl_background,
+    configurar_agencia_background,
+)
 from .utils import (
-    get_valid_token, get_association_type_id, initialize_ghl_setup, 
-    get_location_name, _recent_syncs, 
+    get_valid_token, _recent_syncs,
     ghl_delete_property_record, ghl_delete_contact
 )
-from .helpers import (
-    clean_currency, clean_int, preferenciasTraductor1,
-    preferenciasTraductor2, estadoPropTrad, guardadorURL,
-    parse_zona_nombres, parse_property_data
-)
-from .matching import (
-    buscar_clientes_para_propiedad, buscar_propiedades_para_cliente,
-    actualizar_relaciones_propiedad, actualizar_relaciones_cliente
-)
+from .helpers import parse_property_data, respuesta_con_etag
 from .ImgCloudinary import upload_img_model, eliminar_recurso_cloudinary, extraer_public_id
+from .webhook_handler import process_cliente_webhook
+from .zonas import resolver_zonas, arbol_zonas
+from .priority import prioridad, INTERACTIVE, WEBHOOK
+from .background import runner
+from .fairness import profundidad_colas
 
 logger = logging.getLogger(__name__)
 
@@ -82,6 +81,34 @@ class HomeView(APIView):
         return Response(health_status, status=status_code)
 
 
+# --- ESTADO DE LAS COLAS DE SYNC ---
+class SyncStatusView(APIView):
+    """Profundidad de cola de sincronizacion por agencia y metricas del runner de background (solo staff)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        colas = profundidad_colas()
+        pesos = dict(Agencia.objects.filter(pk__in=list(colas)).values_list('pk', 'sync_weight'))
+        agencias = [
+            {"location_id": agencia_id, "sync_weight": pesos.get(agencia_id, 1), **profundidad}
+            for agencia_id, profundidad in sorted(colas.items(), key=lambda item: str(item[0]))
+        ]
+        totales = {
+            campo: sum(a[campo] for a in agencias)
+            for campo in ('clientes', 'propiedades', 'trabajos')
+        }
+        por_prioridad = dict(
+            SyncJob.objects.filter(dead_at__isnull=True).order_by().values_list('priority').annotate(n=Count('pk'))
+        )
+        return Response({
+            "agencias": agencias,
+            "totales": totales,
+            "outbox_por_prioridad": por_prioridad,
+            "outbox_descartados": SyncJob.objects.filter(dead_at__isnull=False).count(),
+            "background": runner.stats(),
+        })
+
+
 # -------------------------------------------------------------------------
 # VISTA 1: OAUTH CALLBACK
 # -------------------------------------------------------------------------
@@ -107,50 +134,30 @@ class GHLOAuthCallbackView(APIView):
             tokens = response.json()
 
             if response.status_code == 200:
-                with transaction.atomic():
-                    location_id = tokens.get('locationId')
-                    access_token = tokens['access_token']
+                location_id = tokens.get('locationId')
 
+                # Solo se guardan los tokens: el setup (varias llamadas a GHL) va al outbox
+                # y se sigue en SetupStatusView, asi la instalacion no hace timeout
+                with transaction.atomic():
                     GHLToken.objects.update_or_create(
                         location_id=location_id,
                         defaults={
-                            'access_token': access_token,
+                            'access_token': tokens['access_token'],
                             'refresh_token': tokens['refresh_token'],
                             'token_type': tokens['token_type'],
                             'expires_in': tokens['expires_in'],
                             'scope': tokens['scope']
                         }
                     )
+                    Agencia.objects.get_or_create(location_id=location_id, defaults={'active': True})
+                    configurar_agencia_background(location_id)
 
-                    agencia, created = Agencia.objects.get_or_create(
-                        location_id=location_id, defaults={'active': True}
-                    )
-
-                    # Obtener y guardar el nombre de la agencia desde GHL API
-                    try:
-                        location_name = get_location_name(access_token, location_id)
-                        if location_name:
-                            agencia.nombre = location_name
-                            agencia.save()
-                            logger.info(f"Nombre de agencia guardado: {location_name}")
-                        else:
-                            logger.warning(f"No se pudo obtener el nombre de la agencia para {location_id}")
-                    except Exception as name_error:
-                        logger.error(f"Error obteniendo nombre de agencia: {str(name_error)}", exc_info=True)
-                        # Continuar incluso si falla (no es crítico)
-
-
-                    logger.info(f"Iniciando Setup Wizard para {location_id}...")
-                    # Ejecutamos el setup completo (busqueda de IDs, creacion de dummies, etc.)
-                    # Esto actualiza la instancia 'agencia' internamente.
-                    setup_success = initialize_ghl_setup(access_token, location_id, agencia)
-
-                    if setup_success:
-                        logger.info(f"Setup completado para {location_id}.")
-                    else:
-                        logger.warning(f"Setup finalizado con advertencias para {location_id}. Revisar logs.")
-
-                return Response({"message": "App instalada y configurada.", "location_id": location_id}, status=200)
+                logger.info(f"App instalada en {location_id}, setup encolado")
+                return Response({
+                    "message": "App instalada. La configuracion continua en segundo plano.",
+                    "location_id": location_id,
+                    "status_url": f"{reverse('ghl_setup_status')}?location_id={location_id}",
+                }, status=202)
 
             logger.error(f"Error OAuth GHL Respuesta: {tokens}")
             return Response({"error": "Fallo en la autenticacion con GHL."}, status=400)
@@ -163,7 +170,51 @@ class GHLOAuthCallbackView(APIView):
             )
 
 
+# -------------------------------------------------------------------------
+# VISTA 2: ESTADO DE LA INSTALACION
+# -------------------------------------------------------------------------
+class SetupStatusView(APIView):
+    """
+    Estado de la instalacion de una agencia: setup inicial en GHL e importacion de sus datos.
+    GET ?location_id=X
+    Es la status_url que recibe quien instala la app, asi que es publica pero solo da el
+    estado y la fase. El detalle (nombre, contadores y errores, que pueden llevar respuestas
+    de la API de GHL) solo lo ve el staff.
+    """
+    permission_classes = [AllowAny]
 
+    def get(self, request):
+        from .models import AgencyImport
+
+        location_id = request.query_params.get('location_id')
+        if not location_id:
+            return Response({"error": "Falta location_id"}, status=400)
+        agencia = get_object_or_404(Agencia, location_id=location_id)
+        importacion = AgencyImport.objects.filter(agencia=agencia).first()
+
+        estado = {
+            "location_id": agencia.location_id,
+            "setup": {"status": agencia.setup_status},
+            "importacion": {
+                "status": importacion.status,
+                "phase": importacion.phase,
+            } if importacion else None,
+        }
+        if request.user.is_staff:
+            estado["nombre"] = agencia.nombre
+            estado["setup"].update({
+                "error": agencia.setup_error or None,
+                "completed_at": agencia.setup_completed_at,
+            })
+            if importacion:
+                estado["importacion"].update({
+                    "clientes": importacion.clientes_importados,
+                    "propiedades": importacion.propiedades_importadas,
+                    "matches": importacion.matches,
+                    "saltados": importacion.registros_saltados,
+                    "error": importacion.last_error or None,
+                })
+        return Response(estado)
 
 
 # -------------------------------------------------------------------------
@@ -198,82 +249,14 @@ class WebhookClienteView(APIView):
                 logger.info(f"Bounce-back webhook detectado para Cliente {ghl_contact_id}. Ignorando.")
                 return Response({'status': 'bounce_back'})
 
-            with transaction.atomic():
-                # Fix: Capturar las propiedades con las que coincidia ANTES de actualizar
-                # Para saber cuales hay que actualizar si deja de coincidir.
-                cliente_existente = Cliente.objects.filter(ghl_contact_id=ghl_contact_id, agencia=agencia).first()
-                if cliente_existente:
-                     old_matched_ids = list(cliente_existente.propiedades_interes.values_list('id', flat=True))
-                else:
-                     old_matched_ids = []
-
-                cliente_data = {
-                    'agencia': agencia,
-                    'ghl_contact_id': ghl_contact_id,
-                    'nombre': custom_data.get('full_name'),
-                    'presupuesto_maximo': clean_currency(custom_data.get('presupuesto') or data.get('presupuesto')),
-                    'habitaciones_minimas': clean_int(custom_data.get('habitaciones') or data.get('habitaciones_min')),
-                    'animales': preferenciasTraductor1(custom_data.get('animales')),
-                    'metrosMinimo': clean_int(custom_data.get('metros')),
-                    'balcon': preferenciasTraductor2(custom_data.get('balcon')),
-                    'garaje': preferenciasTraductor2(custom_data.get('garaje')),
-                    'patioInterior': preferenciasTraductor2(custom_data.get('patioInterior')),
-                }
-
-                cliente, created = Cliente.objects.update_or_create(
-                    agencia=agencia,
-                    ghl_contact_id=ghl_contact_id,
-                    defaults=cliente_data
-                )
-
-                zona_nombre = custom_data.get("zona_interes")
-                if zona_nombre:
-                    if isinstance(zona_nombre, list):
-                        zona_lista_bruta = [str(z).strip() for z in zona_nombre]
-                    else:
-                        zona_lista_bruta = [z.strip() for z in str(zona_nombre).split(",")]
-                        
-                    zona_lista = []
-                    for z in zona_lista_bruta:
-                        z_nombre = z.split("--")[0].strip()
-                        if z_nombre:
-                            zona_lista.append(z_nombre)
-
-                    logger.debug(f"Procesando zonas de interes para {ghl_contact_id}: {zona_lista}")
+            # Rafagas de webhooks (uno por custom field editado): se agrupan por
+            # (location, contacto) y solo se procesa el ultimo estado de la ventana.
+            if settings.WEBHOOK_COALESCE_SECONDS > 0:
+                encolar_webhook_cliente(location_id, ghl_contact_id, data)
+                return Response({'status': 'queued'}, status=202)
 
-                    zonas = Zona.objects.filter(nombre__in=zona_lista)
-                    cliente.zona_interes.set(zonas)
-                    cliente.save()
-
-                propiedades_match = buscar_propiedades_para_cliente(cliente, agencia)
-                matches_count = actualizar_relaciones_cliente(cliente, propiedades_match)
-                logger.info(f"Matches encontrados para {cliente.ghl_contact_id}: {matches_count}")
-
-            # Sincronizacion con GHL (fuera de la transaccion)
-            # Sincronizacion con GHL (fuera de la transaccion)
-            if not agencia.association_type_id:
-                logger.warning(f"Agencia {location_id} no tiene 'association_type_id'. Cruzado saltado.")
-                return Response({'status': 'warning', 'msg': 'Falta Association ID', 'matches_found': matches_count})
-
-            access_token = get_valid_token(location_id)
-
-            if access_token:
-                # El objetivo es que este Cliente este asociado con ESTAS propiedades.
-                # Cualquier otra asociacion sera borrada por sync_associations_background.
-                target_prop_ids = [p.ghl_contact_id for p in propiedades_match]
-
-                sync_associations_background(
-                    access_token=access_token,
-                    location_id=location_id,
-                    origin_record_id=cliente.ghl_contact_id,
-                    target_ids_list=target_prop_ids,
-                    association_id_val=agencia.association_type_id,
-                    origin_is_contact=True  # IMPORTANTE: Indica que origin es Cliente
-                )
-            else:
-                logger.warning(f"No valid token found for {location_id}")
-
-            return Response({'status': 'success', 'matches_found': matches_count})
+            with prioridad(WEBHOOK):
+                return Response(process_cliente_webhook(agencia, ghl_contact_id, data))
 
         except Exception as e:
             logger.error(f"Error en Webhook Cliente: {str(e)}", exc_info=True)
@@ -284,25 +267,13 @@ class WebhookClienteView(APIView):
 # ENDPOINTS AUXILIARES
 # -------------------------------------------------------------------------
 class ZonasTreeView(APIView):
-    """Endpoint para obtener el arbol de zonas."""
+    """Endpoint para obtener el arbol de zonas (cacheado por version, con ETag)."""
     permission_classes = [AllowAny]
 
     def get(self, request):
         try:
-            provincias = Provincia.objects.prefetch_related('municipios__zonas').all()
-            arbol = []
-            for p in provincias:
-                municipios_p = []
-                for m in p.municipios.all():
-                    municipios_p.append({
-                        "nombre": m.nombre,
-                        "zonas": list(m.zonas.values_list('nombre', flat=True))
-                    })
-                arbol.append({
-                    "provincia": p.nombre,
-                    "municipios": municipios_p
-                })
-            return Response({"zonas": arbol})
+            arbol = arbol_zonas()
+            return respuesta_con_etag(request, arbol['etag'], {"zonas": arbol['arbol']})
         except Exception as e:
             logger.error(f"Error obteniendo zonas: {str(e)}", exc_info=True)
             return Response({"error": "Error interno"}, status=500)
@@ -515,9 +486,6 @@ class UniversalDeleteView(APIView):
 # -------------------------------------------------------------------------
 # VISTA 7: GESTION DE PROPIEDADES (CREAR/EDITAR DESDE FRONTEND)
 # -------------------------------------------------------------------------
-import threading
-from .utils import sync_record_to_ghl
-
 class ApiGestionPropiedadView(APIView):
     """
     Endpoint (CQRS Command) para el Frontend.
@@ -644,16 +612,15 @@ class ApiGestionPropiedadView(APIView):
 
                 # Zonas
                 zona_input = data.get("location") or data.get("zona")
-                z_nombres = parse_zona_nombres(zona_input)
-                if z_nombres:
-                    zonas_objs = Zona.objects.filter(nombre__in=z_nombres)
-                    propiedad.zonas.set(zonas_objs)
-
-            # Enviar a GHL en background para no bloquear el frontend HTTP
-            threading.Thread(
-                target=sync_record_to_ghl,
-                args=(propiedad, 'propiedad', created)
-            ).start()
+                zona_ids = resolver_zonas(zona_input)
+                if zona_ids:
+                    propiedad.zonas.set(zona_ids)
+
+            # Enviar a GHL en background para no bloquear el frontend HTTP. Se fusiona con el
+            # trabajo que ya encolo el post_save del registro (un solo sync por rafaga)
+            sync_to_ghl_background(
+                propiedad.pk, 'propiedad', created=created, agencia_id=agencia.location_id, priority=INTERACTIVE
+            )
 
             return Response({
                 "status": "success",
@@ -0,0 +1,110 @@
+"""
+Despertador del worker de sync: avisa de que hay trabajo pendiente sin esperar al
+siguiente SYNC_INTERVAL (que queda solo como red de seguridad).
+
+- PostgreSQL: NOTIFY en el canal `ghl_sync` tras el commit; el worker hace LISTEN en una
+  conexion dedicada, asi que despierta tambien un proceso `run_sync_worker` separado.
+- Resto (SQLite en local): threading.Event dentro del proceso.
+"""
+import time
+import select
+import logging
+import threading
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'ghl_sync'
+
+_local_event = threading.Event()
+
+
+def notify_sync_pending():
+    """Avisa al worker de que hay trabajo. Se emite cuando la transaccion actual hace commit."""
+    transaction.on_commit(_notify_now)
+
+
+def _notify_now():
+    _local_event.set()
+    if connection.vendor != 'postgresql':
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, '')", [CHANNEL])
+    except Exception as e:
+        logger.warning(f"No se pudo emitir NOTIFY {CHANNEL}: {str(e)}")
+
+
+def interrupt_waiters():
+    """Despierta a los que esperan en este proceso (p.ej. para pararlos)."""
+    _local_event.set()
+
+
+class SyncWakeup:
+    """
+    Espera notificaciones de trabajo pendiente. Una instancia por thread que espera
+    (en PostgreSQL mantiene su propia conexion LISTEN).
+    """
+    def __init__(self):
+        self._listen_conn = None
+
+    def wait(self, timeout, stop_event=None):
+        """
+        Bloquea hasta recibir una notificacion (True), agotar el timeout (False)
+        o que se active stop_event (False).
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Esperas cortas para poder reaccionar a stop_event
+            if self._wait_once(min(remaining, 1.0)):
+                return True
+
+    def _wait_once(self, timeout):
+        if connection.vendor == 'postgresql':
+            try:
+                return self._wait_postgres(timeout)
+            except Exception as e:
+                logger.warning(f"LISTEN {CHANNEL} no disponible, usando espera local: {str(e)}")
+                self.close()
+
+        if _local_event.wait(timeout):
+            _local_event.clear()
+            return True
+        return False
+
+    def _wait_postgres(self, timeout):
+        conn = self._get_listen_conn()
+        ready, _, _ = select.select([conn], [], [], timeout)
+        if not ready:
+            return False
+
+        conn.poll()
+        if conn.notifies:
+            # Varias notificaciones seguidas = un solo despertar
+            del conn.notifies[:]
+            _local_event.clear()
+            return True
+        return False
+
+    def _get_listen_conn(self):
+        if self._listen_conn is None or self._listen_conn.closed:
+            params = connection.get_connection_params()
+            conn = connection.get_new_connection(params)
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            self._listen_conn = conn
+        return self._listen_conn
+
+    def close(self):
+        if self._listen_conn is not None:
+            try:
+                self._listen_conn.close()
+            except Exception:
+                pass
+            self._listen_conn = None
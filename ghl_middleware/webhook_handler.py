@@ -0,0 +1,73 @@
+import logging
+from django.db import transaction
+
+from .models import Cliente
+from .zonas import resolver_zonas
+from .helpers import parse_cliente_data
+from .matching import buscar_propiedades_para_cliente, actualizar_relaciones_cliente
+
+logger = logging.getLogger(__name__)
+
+
+def process_cliente_webhook(agencia, ghl_contact_id, data):
+    """
+    Aplica el estado de un webhook de Cliente: guarda el cliente, recalcula el matching
+    y lanza la sincronizacion de asociaciones con GHL.
+    Retorna el diccionario de respuesta del webhook.
+    """
+    from .tasks import sync_associations_background
+    from .utils import get_valid_token
+
+    custom_data = data.get('customData', {})
+    location_id = agencia.location_id
+
+    with transaction.atomic():
+        cliente_data = {
+            'agencia': agencia,
+            'ghl_contact_id': ghl_contact_id,
+            **parse_cliente_data(data, custom_data),
+        }
+
+        cliente, created = Cliente.objects.update_or_create(
+            agencia=agencia,
+            ghl_contact_id=ghl_contact_id,
+            defaults=cliente_data
+        )
+
+        zona_nombre = custom_data.get("zona_interes")
+        if zona_nombre:
+            # Resolucion en memoria: sin acentos/mayusculas y acotada al municipio si viene
+            zona_ids = resolver_zonas(zona_nombre)
+            logger.debug(f"Procesando zonas de interes para {ghl_contact_id}: {zona_nombre} -> {zona_ids}")
+
+            cliente.zona_interes.set(zona_ids)
+            cliente.save()
+
+        propiedades_match = buscar_propiedades_para_cliente(cliente, agencia)
+        matches_count = actualizar_relaciones_cliente(cliente, propiedades_match)
+        logger.info(f"Matches encontrados para {cliente.ghl_contact_id}: {matches_count}")
+
+    # Sincronizacion con GHL (fuera de la transaccion)
+    if not agencia.association_type_id:
+        logger.warning(f"Agencia {location_id} no tiene 'association_type_id'. Cruzado saltado.")
+        return {'status': 'warning', 'msg': 'Falta Association ID', 'matches_found': matches_count}
+
+    access_token = get_valid_token(location_id)
+
+    if access_token:
+        # El objetivo es que este Cliente este asociado con ESTAS propiedades.
+        # Cualquier otra asociacion sera borrada por sync_associations_background.
+        target_prop_ids = [p.ghl_contact_id for p in propiedades_match]
+
+        sync_associations_background(
+            access_token=access_token,
+            location_id=location_id,
+            origin_record_id=cliente.ghl_contact_id,
+            target_ids_list=target_prop_ids,
+            association_id_val=agencia.association_type_id,
+            origin_is_contact=True  # IMPORTANTE: Indica que origin es Cliente
+        )
+    else:
+        logger.warning(f"No valid token found for {location_id}")
+
+    return {'status': 'success', 'matches_found': matches_count}
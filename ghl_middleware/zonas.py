@@ -0,0 +1,167 @@
+"""
+Resolucion de nombres de zona (webhooks de GHL, frontend, importacion) sin consultas.
+
+Un mapa en memoria por proceso, construido una vez y reconstruido cuando cambia la
+version ZONAS (versions.py), que se incrementa al guardar o borrar una Zona, Municipio
+o Provincia. Los nombres se comparan normalizados (sin acentos ni mayusculas), y un
+valor se resuelve, por orden:
+1. Etiqueta o key completa de la opcion de GHL ('Zona -- Municipio -- Provincia').
+2. 'Zona -- Municipio': la zona de ese municipio.
+3. Nombre suelto: todas las zonas con ese nombre (en orden de pk si hay varias).
+
+Con la misma version se cachea el arbol de zonas que piden los frontends (arbol_zonas):
+en memoria del proceso y en la cache de Django, y servido con ETag. Las zonas en uso por
+cada agencia (ubicaciones_agencia) dependen ademas de la version de sus propiedades.
+"""
+import threading
+import unicodedata
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from . import versions
+from .models import Provincia, Municipio, Zona, Propiedad
+
+_lock = threading.Lock()
+_resolver = None
+_arbol = None
+
+
+def normalizar(texto):
+    """Texto sin acentos, en minusculas y con los espacios colapsados."""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.casefold().split())
+
+
+class ZonaResolver:
+    """Mapa en memoria nombre/etiqueta/key normalizados → id de zona."""
+
+    def __init__(self, version=None):
+        self.version = version
+        self._exactas = {}
+        self._por_municipio = {}
+        self._por_nombre = defaultdict(list)
+        for pk, nombre, municipio, key, label in Zona.objects.order_by('pk').values_list(
+            'pk', 'nombre', 'municipio__nombre', 'key', 'label'
+        ):
+            self._exactas[normalizar(label)] = pk
+            self._exactas[normalizar(key)] = pk
+            self._por_municipio[(normalizar(nombre), normalizar(municipio))] = pk
+            self._por_nombre[normalizar(nombre)].append(pk)
+
+    def resolver(self, valor):
+        """IDs de zona (sin repetir) de un valor: lista o texto separado por comas."""
+        if not valor:
+            return []
+        valores = valor if isinstance(valor, list) else str(valor).split(",")
+        ids = []
+        for v in valores:
+            v = normalizar(v)
+            if not v:
+                continue
+            if v in self._exactas:
+                ids.append(self._exactas[v])
+                continue
+            partes = [parte.strip() for parte in v.split("--")]
+            if len(partes) > 1 and (partes[0], partes[1]) in self._por_municipio:
+                ids.append(self._por_municipio[(partes[0], partes[1])])
+            else:
+                ids += self._por_nombre.get(partes[0], [])
+        return list(dict.fromkeys(ids))
+
+
+def zona_resolver():
+    """Resolver compartido por el proceso, al dia con la version ZONAS."""
+    global _resolver
+    actual = versions.version(versions.ZONAS)
+    resolver = _resolver
+    if resolver is None or resolver.version != actual:
+        with _lock:
+            if _resolver is None or _resolver.version != actual:
+                _resolver = ZonaResolver(actual)
+            resolver = _resolver
+    return resolver
+
+
+def resolver_zonas(valor):
+    """IDs de zona de un valor de GHL o del frontend (ver el docstring del modulo)."""
+    return zona_resolver().resolver(valor)
+
+
+def arbol_zonas():
+    """
+    Instantanea de la taxonomia de zonas para los frontends, al dia con la version ZONAS:
+    {'etag', 'version', 'arbol' (provincia → municipios → zonas), 'locations' (zonas
+    ordenadas por nombre)}. Sin consultas mientras la version no cambie; si la construyo
+    otro proceso se toma de la cache de Django.
+    """
+    global _arbol
+    actual = versions.version(versions.ZONAS)
+    instantanea = _arbol
+    if instantanea is not None and instantanea['version'] == actual:
+        return instantanea
+
+    clave = f'zonas:arbol:{actual}'
+    instantanea = cache.get(clave)
+    if instantanea is None:
+        instantanea = _construir_arbol(actual)
+        cache.set(clave, instantanea, settings.ZONAS_ARBOL_CACHE_SECONDS)
+    _arbol = instantanea
+    return instantanea
+
+
+def _construir_arbol(version):
+    """Tres consultas (provincias, municipios, zonas) en vez de una por municipio."""
+    zonas_por_municipio = defaultdict(list)
+    locations = []
+    for nombre, municipio_id, municipio, provincia in Zona.objects.order_by('pk').values_list(
+        'nombre', 'municipio_id', 'municipio__nombre', 'municipio__provincia__nombre'
+    ):
+        zonas_por_municipio[municipio_id].append(nombre)
+        locations.append({'zona': nombre, 'municipio': municipio, 'provincia': provincia})
+    locations.sort(key=lambda z: z['zona'])
+
+    municipios_por_provincia = defaultdict(list)
+    for pk, nombre, provincia_id in Municipio.objects.order_by('pk').values_list('pk', 'nombre', 'provincia_id'):
+        municipios_por_provincia[provincia_id].append({
+            "nombre": nombre,
+            "zonas": zonas_por_municipio[pk],
+        })
+
+    arbol = [
+        {"provincia": nombre, "municipios": municipios_por_provincia[pk]}
+        for pk, nombre in Provincia.objects.order_by('pk').values_list('pk', 'nombre')
+    ]
+    return {'etag': f'"zonas-{version}"', 'version': version, 'arbol': arbol, 'locations': locations}
+
+
+def ubicaciones_agencia(agencia_id):
+    """
+    Zonas con propiedades de la agencia y cuantas tiene en cada una: {'etag', 'locations'}.
+    Una sola consulta agrupada sobre la tabla intermedia propiedad-zona, cacheada en la
+    cache de Django hasta que cambian las zonas o las propiedades de la agencia.
+    """
+    version_zonas = versions.version(versions.ZONAS)
+    version_propiedades = versions.version(versions.propiedades(agencia_id))
+    clave = f'zonas:ubicaciones:{agencia_id}:{version_zonas}:{version_propiedades}'
+    ubicaciones = cache.get(clave)
+    if ubicaciones is None:
+        filas = (
+            Propiedad.zonas.through.objects.filter(propiedad__agencia_id=agencia_id)
+            .values('zona__nombre', 'zona__municipio__nombre', 'zona__municipio__provincia__nombre')
+            .annotate(count=Count('propiedad_id'))
+            .order_by('zona__nombre', 'zona__municipio__nombre')
+        )
+        ubicaciones = {'etag': f'"ubicaciones-{version_zonas}-{version_propiedades}"', 'locations': [
+            {
+                'zona': fila['zona__nombre'],
+                'municipio': fila['zona__municipio__nombre'],
+                'provincia': fila['zona__municipio__provincia__nombre'],
+                'count': fila['count'],
+            }
+            for fila in filas
+        ]}
+        cache.set(clave, ubicaciones, settings.ZONAS_ARBOL_CACHE_SECONDS)
+    return ubicaciones
@@ -0,0 +1,17 @@
+"""
+Configuracion de gunicorn (se carga sola desde el directorio de trabajo).
+
+Al recibir SIGTERM (redeploy) cada worker deja de aceptar peticiones y, al salir de su loop,
+ejecuta el apagado ordenado de ghl_middleware/shutdown.py: persiste los webhooks agrupados,
+espera al trabajo en vuelo y devuelve a la BD lo reclamado que no haya terminado.
+"""
+import os
+
+# Margen del master antes de matar al worker: el apagado ordenado mas 10 segundos
+graceful_timeout = int(os.environ.get('GRACEFUL_SHUTDOWN_SECONDS', 20)) + 10
+
+
+def worker_exit(server, worker):
+    from ghl_middleware.shutdown import graceful_shutdown
+
+    graceful_shutdown()